@@ -0,0 +1,158 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+import faiss
+from metrics import counter, gauge, histogram
+from question_rewrite import is_self_contained
+
+logger = logging.getLogger(__name__)
+
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))                # 0 disables the cache
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", str(24 * 3600)))
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))    # cosine similarity
+
+answer_cache_requests = counter(
+    "chat_answer_cache_requests_total", "Semantic answer cache lookups by outcome", ["result"]
+)
+answer_cache_entries = gauge("chat_answer_cache_entries", "Answers held in the semantic answer cache")
+answer_cache_evictions = counter(
+    "chat_answer_cache_evictions_total", "Answers removed from the semantic answer cache", ["reason"]
+)
+answer_cache_similarity = histogram(
+    "chat_answer_cache_similarity", "Similarity of the nearest cached question per lookup",
+    buckets=(0.5, 0.7, 0.8, 0.85, 0.9, 0.93, 0.95, 0.97, 0.99, 1.0),
+)
+
+
+def is_cacheable_question(question, has_history):
+    """Only questions that are their own standalone query share cached answers
+
+    Follow-ups depend on the conversation, so they always go through the chain.
+    Only answers generated without history are stored (see rag.remember_answer).
+    """
+    return not has_history or is_self_contained(question)
+
+
+class CacheLookup:
+    """Result of SemanticAnswerCache.lookup(); answer is None on a miss"""
+
+    def __init__(self, vector, answer=None, similarity=None, question=None):
+        self.vector = vector
+        self.answer = answer
+        self.similarity = similarity
+        self.question = question
+
+    @property
+    def hit(self):
+        return self.answer is not None
+
+
+class SemanticAnswerCache:
+    """Answers to previous standalone questions, looked up by embedding similarity
+
+    Question embeddings live in a small inner-product FAISS index over
+    normalized vectors, so scores are cosine similarities. Entries expire after
+    ttl_seconds, the least recently hit entries are evicted beyond max_entries,
+    and everything is dropped when index_version() changes (the document index
+    was rebuilt, so cached answers may be stale).
+    """
+
+    def __init__(self, embeddings, index_version=lambda: None, max_entries=ANSWER_CACHE_SIZE,
+                 ttl_seconds=ANSWER_CACHE_TTL_SECONDS, threshold=ANSWER_CACHE_THRESHOLD):
+        self.embeddings = embeddings
+        self.index_version = index_version
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._index = None
+        self._entries = OrderedDict()    # id -> (question, answer, created_at), LRU order
+        self._next_id = 0
+        self._version = index_version()
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def _embed(self, question):
+        vector = np.asarray(self.embeddings.embed_query(question.strip()), dtype="float32").reshape(1, -1)
+        faiss.normalize_L2(vector)
+        return vector
+
+    def lookup(self, question):
+        """Embed the question and return the closest cached answer above the threshold"""
+        vector = self._embed(question)
+        with self._lock:
+            self._check_version()
+            self._expire(time.time())
+            if self._index is None or not self._entries:
+                answer_cache_requests.inc(result="miss")
+                return CacheLookup(vector)
+
+            scores, ids = self._index.search(vector, 1)
+            similarity, entry_id = float(scores[0][0]), int(ids[0][0])
+            answer_cache_similarity.observe(similarity)
+            entry = self._entries.get(entry_id)
+            if entry is None or similarity < self.threshold:
+                answer_cache_requests.inc(result="miss")
+                return CacheLookup(vector, similarity=similarity)
+
+            self._entries.move_to_end(entry_id)
+            answer_cache_requests.inc(result="hit")
+            return CacheLookup(vector, answer=entry[1], similarity=similarity, question=entry[0])
+
+    def put(self, question, answer, vector=None):
+        if not self.enabled or not answer:
+            return
+        if vector is None:
+            vector = self._embed(question)
+        with self._lock:
+            self._check_version()
+            if self._index is None or self._index.d != vector.shape[1]:
+                self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[1]))
+                self._entries.clear()
+            entry_id = self._next_id
+            self._next_id += 1
+            self._index.add_with_ids(vector, np.array([entry_id], dtype="int64"))
+            self._entries[entry_id] = (question, answer, time.time())
+            overflow = list(self._entries)[:max(0, len(self._entries) - self.max_entries)]
+            self._remove(overflow, "size")
+            answer_cache_entries.set(len(self._entries))
+
+    def invalidate(self, reason="invalidated"):
+        with self._lock:
+            self._clear(reason)
+
+    def _check_version(self):
+        version = self.index_version()
+        if version != self._version:
+            logger.info("Document index changed, clearing semantic answer cache")
+            self._clear("index_rebuilt")
+            self._version = version
+
+    def _expire(self, now):
+        expired = [entry_id for entry_id, entry in self._entries.items() if now - entry[2] > self.ttl_seconds]
+        self._remove(expired, "ttl")
+
+    def _remove(self, entry_ids, reason):
+        if not entry_ids:
+            return
+        self._index.remove_ids(np.array(entry_ids, dtype="int64"))
+        for entry_id in entry_ids:
+            del self._entries[entry_id]
+        answer_cache_evictions.inc(len(entry_ids), reason=reason)
+        answer_cache_entries.set(len(self._entries))
+
+    def _clear(self, reason):
+        if self._entries:
+            answer_cache_evictions.inc(len(self._entries), reason=reason)
+        self._entries.clear()
+        self._index = None
+        answer_cache_entries.set(0)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries, "threshold": self.threshold}
@@ -0,0 +1,267 @@
+"""ASGI serving mode for the PCOS backend.
+
+Exposes the same routes as inference.py on an ASGI server:
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 4933
+
+/chat, /tts, /transcribe and /predict are native async handlers: LangChain
+astream, and the async Groq clients for speech, so waiting on an upstream
+holds no thread; image decode and overlay run on a bounded CPU pool. The
+request logic itself is shared with the Flask handlers (handlers.py). Every
+other route is served by the Flask app through WSGIMiddleware.
+"""
+import os
+import time
+import asyncio
+import contextvars
+import logging
+from contextlib import asynccontextmanager
+from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+import inference
+from inference import components
+from components import ComponentUnavailable
+from handlers import (
+    CHAT_COMPLETE_INCLUDE_HISTORY, SSE_HEADERS, TRANSCRIBE_ERROR, TTS_ERROR, ChatTurn,
+    parse_flag, open_chat_session, no_input_payload, transcription_event, transcription_error_event,
+    transcription_payload, tts_request, tts_failed_payload, tts_headers, prediction_options, cached_prediction,
+    store_prediction,
+)
+from tracing import start_trace, end_trace, current_request_id, incoming_request_id, span, REQUEST_ID_HEADER
+
+logger = logging.getLogger(__name__)
+
+# Bounded pool for CPU-bound image decode/overlay so it never starves the event loop
+ASYNC_CPU_WORKERS = int(os.getenv("ASYNC_CPU_WORKERS", str(min(8, os.cpu_count() or 1))))
+
+cpu_executor = ThreadPoolExecutor(max_workers=ASYNC_CPU_WORKERS, thread_name_prefix="asgi-cpu")
+
+def log_request_time(f):
+    """Async counterpart of inference.log_request_time"""
+    @wraps(f)
+    async def decorated_function(request):
+        start_time = time.time()
+        trace, trace_token = start_trace(incoming_request_id(request.headers.get(REQUEST_ID_HEADER)))
+        request_id = trace.request_id
+        try:
+            result = await f(request)
+            result.headers[REQUEST_ID_HEADER] = request_id
+            logger.info(f"[{request_id}] Request completed successfully in {time.time() - start_time:.2f}s")
+            return result
+        except Exception as e:
+            logger.error(f"[{request_id}] Request failed after {time.time() - start_time:.2f}s: {str(e)}", exc_info=True)
+            raise
+        finally:
+            end_trace(trace_token)
+    return decorated_function
+
+
+async def run_cpu(fn, *args):
+    # Carry the request trace into the pool so stage spans land on it
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(cpu_executor, context.run, fn, *args)
+
+
+def requires_component(name):
+    """Async counterpart of inference.requires_component"""
+    def decorator(f):
+        @wraps(f)
+        async def decorated_function(request):
+            try:
+                # May block on a component that is still loading, so keep it off the event loop
+                component = await run_in_threadpool(components.get, name)
+            except ComponentUnavailable as e:
+                logger.warning(f"{request.url.path} unavailable: {str(e)}")
+                return JSONResponse({'error': str(e), 'component': name}, status_code=503)
+            return await f(component, request)
+        return decorated_function
+    return decorator
+
+
+@log_request_time
+@requires_component("rag")
+async def chat(rag, request):
+    request_start_time = time.time()
+    form = await request.form()
+    session_id = form.get('session_id')
+    user_input = form.get('input')
+    include_history = parse_flag(form.get('include_history'), default=CHAT_COMPLETE_INCLUDE_HISTORY)
+
+    # Session backends may do blocking I/O (SQLite/Redis)
+    session_id = await run_in_threadpool(open_chat_session, rag, session_id, user_input)
+    if not user_input:
+        return JSONResponse(await run_in_threadpool(no_input_payload, rag, session_id), status_code=400)
+
+    turn = ChatTurn(rag, session_id, user_input, request_start_time, current_request_id(), include_history)
+
+    async def generate_response():
+        with turn.traced():
+            try:
+                # Embedding call and session reads block; keep them off the event loop
+                cached = await run_in_threadpool(turn.lookup)
+                if cached is not None:
+                    for event in cached:
+                        yield event
+                else:
+                    async for chunk in rag.conversational_rag_chain.astream(turn.chain_input(), config=turn.chain_config()):
+                        event = turn.feed(chunk)
+                        if event:
+                            yield event
+                    event = turn.flush()
+                    if event:
+                        yield event
+                    await run_in_threadpool(turn.remember)
+                yield await run_in_threadpool(turn.complete)
+            except Exception as e:
+                yield turn.error(e)
+
+    return StreamingResponse(generate_response(), media_type='text/event-stream', headers=SSE_HEADERS)
+
+
+@log_request_time
+@requires_component("speech")
+async def transcribe_audio(speech, request):
+    """Groq Whisper transcription endpoint; ?stream=true sends partial transcripts over SSE"""
+    try:
+        form = await request.form()
+        audio_file = form.get('file')
+        if audio_file is None or isinstance(audio_file, str):
+            logger.warning("No audio file provided in transcribe request")
+            return JSONResponse({'error': 'No audio file provided', 'success': False}, status_code=400)
+        if not audio_file.filename:
+            logger.warning("Empty filename in transcribe request")
+            return JSONResponse({'error': 'No audio file selected', 'success': False}, status_code=400)
+
+        logger.info(f"Transcribe request received - File: {audio_file.filename}")
+        data = await audio_file.read()
+        filename = audio_file.filename
+        content_type = audio_file.content_type
+
+        values = {**form, **request.query_params}
+        if parse_flag(values.get('stream')):
+            request_id = current_request_id()
+
+            async def generate_events():
+                try:
+                    async for event in speech.transcription_pipeline.astream(data, filename, content_type):
+                        yield transcription_event(event, filename, request_id)
+                except Exception as e:
+                    yield transcription_error_event(e, request_id)
+
+            return StreamingResponse(generate_events(), media_type='text/event-stream', headers=SSE_HEADERS)
+
+        # Decoding runs on the pipeline's threads, chunk uploads on the async Groq client
+        result = await speech.transcription_pipeline.arun(data, filename, content_type)
+        return JSONResponse(transcription_payload(result, filename))
+
+    except Exception as e:
+        logger.error(f"Error in transcribe endpoint: {str(e)}", exc_info=True)
+        return JSONResponse(TRANSCRIBE_ERROR, status_code=500)
+
+
+@log_request_time
+@requires_component("speech")
+async def text_to_speech(speech, request):
+    """Groq TTS endpoint; streams WAV audio sentence by sentence"""
+    request_start_time = time.perf_counter()
+    try:
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        try:
+            text, session_id, model, voice = tts_request(data)
+        except ValueError as e:
+            return JSONResponse({'error': str(e), 'success': False}, status_code=400)
+
+        try:
+            # Segments are asyncio tasks on the async Groq client
+            audio = speech.tts_pipeline.aopen(text, model, voice, started_at=request_start_time)
+            head = await audio.head()
+        except Exception as groq_error:
+            return JSONResponse(tts_failed_payload(groq_error), status_code=500)
+
+        async def generate_audio():
+            try:
+                yield head
+                async for pcm in audio:
+                    yield pcm
+            finally:
+                audio.close()
+
+        return StreamingResponse(generate_audio(), media_type='audio/wav', headers=tts_headers(audio, session_id))
+
+    except Exception as e:
+        logger.error(f"Error in TTS endpoint: {str(e)}", exc_info=True)
+        return JSONResponse(TTS_ERROR, status_code=500)
+
+
+@log_request_time
+@requires_component("vision")
+async def predict(vision, request):
+    form = await request.form()
+    file = form.get('file')
+    if file is None or isinstance(file, str):
+        return JSONResponse({"error": "No file uploaded"}, status_code=400)
+    if not file.filename:
+        return JSONResponse({"error": "Empty filename"}, status_code=400)
+
+    try:
+        explain, options = prediction_options({**form, **request.query_params})
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    try:
+        image_bytes = await file.read()
+        key, cached = cached_prediction(vision, image_bytes, explain, options)
+        if cached is not None:
+            return JSONResponse(cached)
+
+        rgb, img_tensor = await run_cpu(vision.preprocess_image, image_bytes)
+        # The micro-batcher has its own worker thread; just await its future
+        with span("vision", "classify"):
+            probs, pred_idx, heatmap = await asyncio.wrap_future(vision.classifier_batcher.submit(img_tensor, key=explain))
+        result = await run_cpu(lambda: vision.build_prediction(probs, pred_idx, heatmap, rgb, **options))
+        store_prediction(key, result)
+        return JSONResponse(result)
+
+    except Exception as e:
+        logger.error(f"Prediction error: {str(e)}", exc_info=True)
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    cpu_executor.shutdown(wait=False)
+    speech = components.peek("speech")
+    if speech is not None:
+        speech.shutdown()
+
+
+app = Starlette(
+    routes=[
+        Route('/chat', chat, methods=['POST']),
+        Route('/transcribe', transcribe_audio, methods=['POST']),
+        Route('/tts', text_to_speech, methods=['POST']),
+        Route('/predict', predict, methods=['POST']),
+        # Everything else (/predict/batch, /metrics, ...) is served by the Flask app
+        Mount('/', app=WSGIMiddleware(inference.app)),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])],
+    lifespan=lifespan,
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(app, host='0.0.0.0', port=int(os.getenv("PORT", "4933")), timeout_keep_alive=75)
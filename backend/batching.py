@@ -0,0 +1,137 @@
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from metrics import gauge, histogram, counter
+
+logger = logging.getLogger(__name__)
+
+queue_depth = gauge(
+    "batcher_queue_depth", "Requests waiting in the micro-batching queue", ["batcher"]
+)
+batch_size_hist = histogram(
+    "batcher_batch_size", "Number of requests executed together in one batch", ["batcher"],
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+queue_wait_hist = histogram(
+    "batcher_queue_wait_seconds", "Time a request spent queued before its batch ran", ["batcher"]
+)
+batch_latency_hist = histogram(
+    "batcher_batch_seconds", "Execution time of one batch", ["batcher"]
+)
+batch_errors = counter(
+    "batcher_batch_errors_total", "Batches that raised an exception", ["batcher"]
+)
+
+
+class _Item:
+    __slots__ = ("payload", "key", "future", "enqueued_at")
+
+    def __init__(self, payload, key):
+        self.payload = payload
+        self.key = key
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class MicroBatcher:
+    """Dynamic batching queue in front of a batch function.
+
+    Request handlers call submit() and get a Future back. A single worker
+    thread collects up to max_batch_size pending requests, waiting at most
+    max_wait_ms after the first one arrives, groups them by key and calls
+    process_batch(key, payloads) once per group. process_batch must return
+    one result per payload, in order.
+    """
+
+    def __init__(self, process_batch, max_batch_size=8, max_wait_ms=5, name="batcher"):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+        self._queue = queue.Queue()
+        self._stopped = threading.Event()
+        self._worker = threading.Thread(target=self._run, name=f"{name}-worker", daemon=True)
+        self._worker.start()
+        logger.info(f"Micro-batcher '{name}' started (max_batch_size={max_batch_size}, max_wait_ms={max_wait_ms})")
+
+    def submit(self, payload, key=None):
+        """Queue one request and return a Future for its result"""
+        if self._stopped.is_set():
+            raise RuntimeError(f"Micro-batcher '{self.name}' is stopped")
+        item = _Item(payload, key)
+        self._queue.put(item)
+        queue_depth.inc(batcher=self.name)
+        return item.future
+
+    def stop(self, timeout=None):
+        """Stop accepting work and let the worker drain the queue"""
+        self._stopped.set()
+        self._queue.put(None)
+        self._worker.join(timeout)
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Stop sentinel: put it back so the main loop exits after this batch
+                self._queue.put(None)
+                break
+            batch.append(item)
+        queue_depth.dec(len(batch), batcher=self.name)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                if self._stopped.is_set():
+                    if self._queue.empty():
+                        return
+                    # Work is still queued: put the sentinel back behind it and drain
+                    self._queue.put(None)
+                continue
+
+            batch = self._collect(first)
+            groups = {}
+            for item in batch:
+                groups.setdefault(item.key, []).append(item)
+
+            for key, items in groups.items():
+                self._execute(key, items)
+
+    def _execute(self, key, items):
+        # Skip requests whose callers already gave up
+        items = [item for item in items if item.future.set_running_or_notify_cancel()]
+        if not items:
+            return
+
+        started = time.perf_counter()
+        for item in items:
+            queue_wait_hist.observe(started - item.enqueued_at, batcher=self.name)
+        batch_size_hist.observe(len(items), batcher=self.name)
+
+        try:
+            results = self.process_batch(key, [item.payload for item in items])
+            if len(results) != len(items):
+                raise RuntimeError(f"Batch function returned {len(results)} results for {len(items)} inputs")
+        except Exception as e:
+            batch_errors.inc(batcher=self.name)
+            logger.error(f"Micro-batcher '{self.name}' batch of {len(items)} failed: {str(e)}")
+            for item in items:
+                item.future.set_exception(e)
+            return
+        finally:
+            batch_latency_hist.observe(time.perf_counter() - started, batcher=self.name)
+
+        for item, result in zip(items, results):
+            item.future.set_result(result)
@@ -0,0 +1,103 @@
+import time
+import threading
+from langchain_core.callbacks import BaseCallbackHandler
+from tracing import record_stage
+
+REWRITE_RUN_NAME = "standalone_question"       # RunnableLambda in question_rewrite
+GENERATION_RUN_NAME = "stuff_documents_chain"  # answer chain from create_stuff_documents_chain
+
+
+class StageTimer(BaseCallbackHandler):
+    """Times the stages of conversational_rag_chain from LangChain callbacks
+
+    Stages, recorded on the request trace and in pipeline_stage_seconds:
+      rewrite          standalone-question step, including any LLM rewrite
+      rewrite_llm      the rewrite LLM call itself (only when one is made)
+      retrieval        outermost retriever call: hybrid search and compression
+      llm_first_token  answer LLM call start to its first streamed token
+      generation       answer LLM call start to end
+    Finer retrieval stages (embedding, faiss_search, bm25, ...) are recorded
+    by the retriever itself.
+    """
+
+    def __init__(self, trace, pipeline="chat"):
+        self.trace = trace
+        self.pipeline = pipeline
+        self._runs = {}    # run_id -> (name, stage, parent_run_id, started)
+        self._first_token_seen = set()
+        self._lock = threading.Lock()
+
+    def _start(self, run_id, parent_run_id, name, stage):
+        with self._lock:
+            self._runs[run_id] = (name, stage, parent_run_id, time.perf_counter())
+
+    def _end(self, run_id):
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+            self._first_token_seen.discard(run_id)
+        if run is not None and run[1] is not None:
+            record_stage(self.pipeline, run[1], time.perf_counter() - run[3], trace=self.trace)
+
+    def _ancestors(self, parent_run_id):
+        """(name, stage) of each enclosing run, innermost first"""
+        ancestors = []
+        with self._lock:
+            while parent_run_id in self._runs:
+                name, stage, parent_run_id, _ = self._runs[parent_run_id]
+                ancestors.append((name, stage))
+        return ancestors
+
+    @staticmethod
+    def _name(serialized, kwargs):
+        return kwargs.get("name") or (serialized or {}).get("name")
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs):
+        name = self._name(serialized, kwargs)
+        self._start(run_id, parent_run_id, name, "rewrite" if name == REWRITE_RUN_NAME else None)
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, **kwargs):
+        nested = any(stage == "retrieval" for _, stage in self._ancestors(parent_run_id))
+        self._start(run_id, parent_run_id, self._name(serialized, kwargs), None if nested else "retrieval")
+
+    def _llm_start(self, serialized, run_id, parent_run_id, kwargs):
+        stage = None
+        for name, ancestor_stage in self._ancestors(parent_run_id):
+            if ancestor_stage == "rewrite":
+                stage = "rewrite_llm"
+                break
+            if name == GENERATION_RUN_NAME:
+                stage = "generation"
+                break
+        self._start(run_id, parent_run_id, self._name(serialized, kwargs), stage)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        self._llm_start(serialized, run_id, parent_run_id, kwargs)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        self._llm_start(serialized, run_id, parent_run_id, kwargs)
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run is None or run[1] != "generation" or run_id in self._first_token_seen:
+                return
+            self._first_token_seen.add(run_id)
+        record_stage(self.pipeline, "llm_first_token", time.perf_counter() - run[3], trace=self.trace)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id)
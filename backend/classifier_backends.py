@@ -0,0 +1,341 @@
+import os
+import copy
+import time
+import logging
+import argparse
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+# Backend selection (see load_backend)
+CLASSIFIER_BACKEND = os.getenv("CLASSIFIER_BACKEND", "eager")                 # eager | torchscript | compile | onnx
+CLASSIFIER_QUANTIZATION = os.getenv("CLASSIFIER_QUANTIZATION", "none")        # none | dynamic | static
+CLASSIFIER_CHANNELS_LAST = os.getenv("CLASSIFIER_CHANNELS_LAST", "false").lower() in ("1", "true", "yes")
+CLASSIFIER_ARTIFACT_DIR = os.getenv("CLASSIFIER_ARTIFACT_DIR", "classifier_artifacts")
+CLASSIFIER_CALIBRATION_DIR = os.getenv("CLASSIFIER_CALIBRATION_DIR", "")
+CLASSIFIER_VERIFY = os.getenv("CLASSIFIER_VERIFY", "true").lower() in ("1", "true", "yes")
+
+# Accuracy gate against the eager model
+MAX_PROB_DIFF = float(os.getenv("CLASSIFIER_MAX_PROB_DIFF", "0.02"))
+MIN_TOP1_AGREEMENT = float(os.getenv("CLASSIFIER_MIN_TOP1_AGREEMENT", "0.98"))
+
+BACKENDS = ("eager", "torchscript", "compile", "onnx")
+QUANTIZATION_MODES = ("none", "dynamic", "static")
+INPUT_SHAPE = (3, 224, 224)
+
+
+class BackendAccuracyError(RuntimeError):
+    """Raised when an optimized backend drifts too far from the eager model"""
+
+
+class ClassifierBackend:
+    """Callable mapping a (N, C, H, W) float tensor to (N, num_classes) logits"""
+    name = "base"
+
+    def __init__(self, channels_last=False, quantization="none"):
+        self.channels_last = channels_last
+        self.quantization = quantization
+
+    def prepare(self, batch):
+        if self.channels_last:
+            return batch.contiguous(memory_format=torch.channels_last)
+        return batch
+
+    def __call__(self, batch):
+        raise NotImplementedError
+
+
+class TorchBackend(ClassifierBackend):
+    """Any torch.nn.Module / ScriptModule / compiled module run under inference_mode"""
+
+    def __init__(self, module, name, device="cpu", channels_last=False, quantization="none"):
+        super().__init__(channels_last, quantization)
+        self.module = module
+        self.name = name
+        self.device = device
+
+    def __call__(self, batch):
+        with torch.inference_mode():
+            return self.module(self.prepare(batch.to(self.device))).float()
+
+
+class OnnxRuntimeBackend(ClassifierBackend):
+    """ONNX Runtime CPU session over an exported classifier"""
+    name = "onnx"
+
+    def __init__(self, model_path, intra_op_threads=0, quantization="none"):
+        super().__init__(channels_last=False, quantization=quantization)
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch):
+        inputs = batch.detach().cpu().numpy().astype(np.float32, copy=False)
+        logits, = self.session.run(None, {self.input_name: inputs})
+        return torch.from_numpy(logits)
+
+
+def artifact_path(backend, quantization, channels_last=False, ext="pt"):
+    suffix = "" if quantization == "none" else f"-int8-{quantization}"
+    layout = "-cl" if channels_last else ""
+    return os.path.join(CLASSIFIER_ARTIFACT_DIR, f"pcos_classifier_resnet50.{backend}{suffix}{layout}.{ext}")
+
+
+def calibration_batches(num_batches=8, batch_size=8):
+    """Yield preprocessed input batches for calibration and accuracy checks
+
+    Uses images from CLASSIFIER_CALIBRATION_DIR when set; otherwise falls back to
+    random inputs, which is only good enough for smoke-testing the pipeline.
+    """
+    paths = []
+    if CLASSIFIER_CALIBRATION_DIR and os.path.isdir(CLASSIFIER_CALIBRATION_DIR):
+        for root, _, files in os.walk(CLASSIFIER_CALIBRATION_DIR):
+            paths.extend(os.path.join(root, f) for f in sorted(files)
+                         if f.lower().endswith((".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")))
+        paths = paths[:num_batches * batch_size]
+
+    if not paths:
+        logger.warning("No calibration images found; using random inputs for calibration/verification")
+        generator = torch.Generator().manual_seed(0)
+        for _ in range(num_batches):
+            yield torch.randn((batch_size,) + INPUT_SHAPE, generator=generator)
+        return
+
+    from classifier_model import preprocess_image
+
+    for start in range(0, len(paths), batch_size):
+        tensors = []
+        for path in paths[start:start + batch_size]:
+            with open(path, "rb") as f:
+                tensors.append(preprocess_image(f.read())[1].cpu())
+        yield torch.cat(tensors, dim=0)
+
+
+def _quantize_torch(model, quantization):
+    # Work on a CPU copy so the eager model used for Grad-CAM is left untouched
+    model = copy.deepcopy(model).cpu().eval()
+    if quantization == "dynamic":
+        # Only the final Linear layer is eligible for dynamic quantization in ResNet-50
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    torch.backends.quantized.engine = "fbgemm" if "fbgemm" in torch.backends.quantized.supported_engines else "qnnpack"
+    example = torch.randn((1,) + INPUT_SHAPE)
+    prepared = prepare_fx(model, get_default_qconfig_mapping(torch.backends.quantized.engine), (example,))
+    with torch.inference_mode():
+        for batch in calibration_batches():
+            prepared(batch)
+    return convert_fx(prepared)
+
+
+def build_torchscript(model, quantization="none", channels_last=False):
+    """Trace, freeze and save a TorchScript classifier; returns the artifact path"""
+    if quantization != "none":
+        model = _quantize_torch(model, quantization)
+        device = torch.device("cpu")
+    else:
+        device = next(model.parameters()).device
+        model = copy.deepcopy(model).eval()
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    example = torch.randn((1,) + INPUT_SHAPE, device=device)
+    with torch.inference_mode():
+        scripted = torch.jit.trace(model, example)
+        scripted = torch.jit.optimize_for_inference(torch.jit.freeze(scripted.eval()))
+    path = artifact_path("torchscript", quantization, channels_last)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    torch.jit.save(scripted, path)
+    return path
+
+
+def build_onnx(model, quantization="none"):
+    """Export the classifier to ONNX (dynamic batch axis), optionally int8-quantized"""
+    os.makedirs(CLASSIFIER_ARTIFACT_DIR, exist_ok=True)
+    fp32_path = artifact_path("onnx", "none", ext="onnx")
+    example = torch.randn((1,) + INPUT_SHAPE)
+    torch.onnx.export(
+        copy.deepcopy(model).cpu().eval(), example, fp32_path,
+        input_names=["input"], output_names=["logits"],
+        dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=17,
+    )
+    if quantization == "none":
+        return fp32_path
+
+    from onnxruntime.quantization import (
+        quantize_dynamic, quantize_static, CalibrationDataReader, QuantFormat, QuantType,
+    )
+
+    path = artifact_path("onnx", quantization, ext="onnx")
+    if quantization == "dynamic":
+        quantize_dynamic(fp32_path, path, weight_type=QuantType.QInt8)
+        return path
+
+    class _Reader(CalibrationDataReader):
+        def __init__(self):
+            self._batches = iter(calibration_batches())
+
+        def get_next(self):
+            batch = next(self._batches, None)
+            return None if batch is None else {"input": batch.numpy()}
+
+    quantize_static(fp32_path, path, _Reader(), quant_format=QuantFormat.QDQ,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+    return path
+
+
+def build_backend(model, backend=CLASSIFIER_BACKEND, quantization=CLASSIFIER_QUANTIZATION,
+                  channels_last=CLASSIFIER_CHANNELS_LAST, rebuild=False):
+    """Create the configured inference backend from the eager classifier"""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown classifier backend '{backend}', expected one of {BACKENDS}")
+    if quantization not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization mode '{quantization}', expected one of {QUANTIZATION_MODES}")
+
+    device = next(model.parameters()).device
+    if quantization != "none" and device.type != "cpu":
+        raise ValueError("int8 quantization is only supported on CPU")
+
+    if backend in ("eager", "compile"):
+        if quantization != "none":
+            module = _quantize_torch(model, quantization)
+        elif channels_last:
+            # Module.to() converts in place; keep the shared eager model (used by Grad-CAM) as it is
+            module = copy.deepcopy(model)
+        else:
+            module = model
+        if channels_last:
+            module = module.to(memory_format=torch.channels_last)
+        if backend == "compile":
+            module = torch.compile(module, dynamic=True)
+        return TorchBackend(module, backend, device, channels_last, quantization)
+
+    if backend == "torchscript":
+        path = artifact_path("torchscript", quantization, channels_last)
+        if rebuild or not os.path.exists(path):
+            logger.info(f"Building TorchScript classifier at {path}")
+            path = build_torchscript(model, quantization, channels_last)
+        module = torch.jit.load(path, map_location=device)
+        return TorchBackend(module, "torchscript", device, channels_last, quantization)
+
+    path = artifact_path("onnx", quantization, ext="onnx")
+    if rebuild or not os.path.exists(path):
+        logger.info(f"Exporting ONNX classifier at {path}")
+        path = build_onnx(model, quantization)
+    return OnnxRuntimeBackend(path, quantization=quantization)
+
+
+def verify_backend(backend, reference_model, max_prob_diff=MAX_PROB_DIFF, min_top1_agreement=MIN_TOP1_AGREEMENT):
+    """Compare backend outputs against the eager model; raise BackendAccuracyError on drift"""
+    device = next(reference_model.parameters()).device
+    worst_diff, agree, total = 0.0, 0, 0
+    for batch in calibration_batches():
+        with torch.inference_mode():
+            expected = torch.softmax(reference_model(batch.to(device)), dim=1).cpu()
+        actual = torch.softmax(backend(batch), dim=1).cpu()
+        worst_diff = max(worst_diff, (expected - actual).abs().max().item())
+        agree += (expected.argmax(dim=1) == actual.argmax(dim=1)).sum().item()
+        total += batch.shape[0]
+
+    agreement = agree / total if total else 1.0
+    report = {"backend": backend.name, "max_prob_diff": worst_diff, "top1_agreement": agreement, "samples": total}
+    logger.info(f"Classifier backend check: {report}")
+    if worst_diff > max_prob_diff or agreement < min_top1_agreement:
+        raise BackendAccuracyError(
+            f"Backend '{backend.name}' failed accuracy check: max prob diff {worst_diff:.4f} "
+            f"(limit {max_prob_diff}), top-1 agreement {agreement:.3f} (min {min_top1_agreement})"
+        )
+    return report
+
+
+def load_backend(model):
+    """Build the configured backend, falling back to eager if it fails its accuracy check
+
+    The returned backend's name, quantization and channels_last describe what
+    actually serves requests (the fallback is unquantized eager).
+    """
+    try:
+        backend = build_backend(model)
+        if backend.name != "eager" or backend.quantization != "none":
+            if CLASSIFIER_VERIFY:
+                verify_backend(backend, model)
+        logger.info(f"Classifier backend '{backend.name}' ready (quantization={backend.quantization}, channels_last={backend.channels_last})")
+        return backend
+    except Exception as e:
+        logger.error(f"Failed to load classifier backend '{CLASSIFIER_BACKEND}', falling back to eager: {str(e)}")
+        return TorchBackend(model, "eager", next(model.parameters()).device)
+
+
+def benchmark_backend(backend, batch_size=1, iterations=50, warmup=5):
+    """Return images/sec and p50/p99 latency (ms) for one backend"""
+    batch = torch.randn((batch_size,) + INPUT_SHAPE)
+    for _ in range(warmup):
+        backend(batch)
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        backend(batch)
+        latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies)
+    return {
+        "backend": backend.name,
+        "batch_size": batch_size,
+        "images_per_sec": round(batch_size * iterations / latencies.sum(), 2),
+        "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 2),
+        "p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build, verify and benchmark classifier inference backends")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="Export a backend artifact and run the accuracy check")
+    build.add_argument("--backend", default=CLASSIFIER_BACKEND, choices=BACKENDS)
+    build.add_argument("--quantization", default=CLASSIFIER_QUANTIZATION, choices=QUANTIZATION_MODES)
+    build.add_argument("--channels-last", action="store_true", default=CLASSIFIER_CHANNELS_LAST)
+
+    bench = sub.add_parser("bench", help="Benchmark images/sec and p50/p99 latency per backend")
+    bench.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    bench.add_argument("--quantization", nargs="+", default=["none"], choices=QUANTIZATION_MODES)
+    bench.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 8])
+    bench.add_argument("--iterations", type=int, default=50)
+    bench.add_argument("--channels-last", action="store_true", default=CLASSIFIER_CHANNELS_LAST)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    from classifier_model import load_classifier
+    model = load_classifier()
+
+    if args.command == "build":
+        backend = build_backend(model, args.backend, args.quantization, args.channels_last, rebuild=True)
+        report = verify_backend(backend, model)
+        print(f"✅ {args.backend} ({args.quantization}) passed accuracy check: {report}")
+        return
+
+    print(f"{'backend':<12} {'quant':<8} {'batch':>5} {'img/s':>10} {'p50 ms':>10} {'p99 ms':>10}")
+    for name in args.backends:
+        for quantization in args.quantization:
+            try:
+                backend = build_backend(model, name, quantization, args.channels_last)
+                verify_backend(backend, model)
+            except Exception as e:
+                print(f"{name:<12} {quantization:<8} skipped: {str(e)}")
+                continue
+            for batch_size in args.batch_sizes:
+                result = benchmark_backend(backend, batch_size, args.iterations)
+                print(f"{name:<12} {quantization:<8} {batch_size:>5} {result['images_per_sec']:>10} "
+                      f"{result['p50_ms']:>10} {result['p99_ms']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""Classifier weights, loading and input preprocessing
+
+Importing this module has no side effects; vision.py loads the model and
+starts the batcher, while tools such as classifier_backends use these
+helpers without doing either.
+"""
+import hashlib
+import torch
+import torch.nn as nn
+from torchvision import models
+from imaging import decode_image, to_model_input, INPUT_SIZE
+from tracing import span
+
+MODEL_PATH = "pcos_classifier_resnet50.pth"  # Ensure this file exists
+CLASSES = ["infected", "noninfected"]
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+def load_classifier():
+    model = models.resnet50(weights=None)  # Updated: Replaced pretrained=False with weights=None
+    model.fc = nn.Linear(model.fc.in_features, len(CLASSES))
+    model.load_state_dict(torch.load(MODEL_PATH, map_location=DEVICE, weights_only=True))  # Updated: Added weights_only=True
+    model.to(DEVICE)
+    model.eval()
+    return model
+
+def weights_fingerprint(path=MODEL_PATH):
+    """Short content hash of the classifier weights, used to version cached results"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+def preprocess_image(image_bytes):
+    """Decode uploaded bytes into a bounded RGB array and the (1, C, H, W) model input"""
+    with span("vision", "decode"):
+        rgb = decode_image(image_bytes)
+    with span("vision", "preprocess"):
+        img_tensor = torch.empty((1, 3, INPUT_SIZE, INPUT_SIZE), dtype=torch.float32)
+        to_model_input(rgb, out=img_tensor.numpy()[0])
+        return rgb, img_tensor.to(DEVICE)
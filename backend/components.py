@@ -0,0 +1,159 @@
+import os
+import time
+import logging
+import threading
+import traceback
+from metrics import gauge, histogram
+
+logger = logging.getLogger(__name__)
+
+SERVER_ROLE = os.getenv("SERVER_ROLE", "all")                  # all | chat | vision
+COMPONENT_INIT = os.getenv("COMPONENT_INIT", "parallel")       # parallel | lazy
+
+SERVER_ROLES = ("all", "chat", "vision")
+
+component_state = gauge("component_state", "1 for the current state of each component", ["component", "state"])
+component_init_seconds = histogram(
+    "component_init_seconds", "Time to initialize each component", ["component"],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 20, 40, 80),
+)
+
+DISABLED = "disabled"
+PENDING = "pending"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+STATES = (DISABLED, PENDING, LOADING, READY, FAILED)
+
+
+class ComponentUnavailable(RuntimeError):
+    """Raised by ComponentRegistry.get() for a disabled or failed component"""
+
+
+class Component:
+    """A heavy subsystem initialized once, either in the background or on first use"""
+
+    def __init__(self, name, init, roles):
+        self.name = name
+        self.init = init
+        self.roles = roles
+        self.state = PENDING
+        self.value = None
+        self.error = None
+        self.started_at = None
+        self.seconds = None
+        self._lock = threading.Lock()
+
+    def _set_state(self, state):
+        self.state = state
+        for s in STATES:
+            component_state.set(1 if s == state else 0, component=self.name, state=s)
+
+    def load(self):
+        """Initialize exactly once; concurrent callers wait for the first one"""
+        with self._lock:
+            if self.state in (READY, FAILED, DISABLED):
+                return
+            self._set_state(LOADING)
+            self.started_at = time.time()
+            started = time.perf_counter()
+            try:
+                logger.info(f"Initializing component '{self.name}'...")
+                self.value = self.init()
+                self._set_state(READY)
+            except Exception as e:
+                self.error = str(e)
+                self._set_state(FAILED)
+                logger.error(f"Component '{self.name}' failed to initialize: {str(e)}")
+                logger.error(f"Traceback: {traceback.format_exc()}")
+            finally:
+                self.seconds = time.perf_counter() - started
+                component_init_seconds.observe(self.seconds, component=self.name)
+            if self.state == READY:
+                logger.info(f"Component '{self.name}' ready in {self.seconds:.2f}s")
+
+    def report(self):
+        return {
+            "state": self.state,
+            "seconds": None if self.seconds is None else round(self.seconds, 3),
+            "started_at": self.started_at,
+            "error": self.error,
+        }
+
+
+class ComponentRegistry:
+    """Registry of the app's heavy subsystems
+
+    Components outside this worker's role are disabled. With
+    COMPONENT_INIT=parallel every enabled component starts loading on its own
+    thread as soon as start() is called; with COMPONENT_INIT=lazy each one is
+    loaded by the first request that needs it.
+    """
+
+    def __init__(self, role=SERVER_ROLE, mode=COMPONENT_INIT):
+        if role not in SERVER_ROLES:
+            raise ValueError(f"SERVER_ROLE must be one of {', '.join(SERVER_ROLES)}")
+        self.role = role
+        self.mode = mode
+        self.created_at = time.time()
+        self._components = {}
+
+    def register(self, name, init, roles):
+        """roles: the SERVER_ROLE values (besides 'all') that serve this component"""
+        component = Component(name, init, roles)
+        if self.role != "all" and self.role not in roles:
+            component._set_state(DISABLED)
+        else:
+            component._set_state(PENDING)
+        self._components[name] = component
+        return component
+
+    def start(self):
+        if self.mode == "lazy":
+            logger.info(f"Components load on first use (role={self.role})")
+            return
+        for component in self._components.values():
+            if component.state == PENDING:
+                threading.Thread(target=component.load, name=f"init-{component.name}", daemon=True).start()
+
+    def get(self, name):
+        """The initialized component, loading it now if needed"""
+        component = self._components[name]
+        if component.state == DISABLED:
+            raise ComponentUnavailable(f"'{name}' is not served by this worker (SERVER_ROLE={self.role})")
+        if component.state != READY:
+            component.load()
+        if component.state != READY:
+            raise ComponentUnavailable(f"'{name}' failed to initialize: {component.error}")
+        return component.value
+
+    def peek(self, name):
+        """The component if it has already been initialized, else None; never loads it"""
+        component = self._components[name]
+        return component.value if component.state == READY else None
+
+    def enabled(self, name):
+        return self._components[name].state != DISABLED
+
+    def readiness(self):
+        """(ready, report): ready once every enabled component is loaded, or loadable on demand"""
+        ok_states = (READY, DISABLED, PENDING) if self.mode == "lazy" else (READY, DISABLED)
+        report = {name: c.report() for name, c in self._components.items()}
+        return all(c.state in ok_states for c in self._components.values()), report
+
+    def startup_profile(self):
+        """Per-component init time relative to registry creation"""
+        profile = {}
+        for name, c in self._components.items():
+            profile[name] = {
+                "state": c.state,
+                "offset_s": None if c.started_at is None else round(c.started_at - self.created_at, 3),
+                "seconds": None if c.seconds is None else round(c.seconds, 3),
+            }
+        done = [c.started_at + c.seconds for c in self._components.values() if c.seconds is not None]
+        return {
+            "role": self.role,
+            "mode": self.mode,
+            "components": profile,
+            "ready_after_s": round(max(done) - self.created_at, 3) if done else None,
+        }
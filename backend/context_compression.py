@@ -0,0 +1,169 @@
+import os
+import re
+from typing import Optional, Sequence
+from langchain_core.callbacks import Callbacks
+from langchain_core.documents import BaseDocumentCompressor, Document
+from history_window import estimate_tokens
+from hybrid_retrieval import tokenize
+from metrics import counter, histogram
+from tracing import annotate, span
+
+CONTEXT_COMPRESSION = os.getenv("CONTEXT_COMPRESSION", "true").lower() in ("1", "true", "yes")
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "600"))
+CONTEXT_MAX_OVERLAP_CHARS = int(os.getenv("CONTEXT_MAX_OVERLAP_CHARS", "300"))   # splitter overlap is 200
+CONTEXT_NEIGHBOR_SENTENCES = int(os.getenv("CONTEXT_NEIGHBOR_SENTENCES", "1"))
+
+context_tokens = counter(
+    "chat_context_tokens_total", "Estimated tokens of retrieved context, before and after compression", ["kind"]
+)
+context_tokens_sent = histogram(
+    "chat_context_tokens", "Estimated context tokens stuffed into the prompt per request",
+    buckets=(50, 100, 200, 400, 600, 800, 1200, 1600, 2400),
+)
+
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+|\n{2,}|\n(?=[-•*\d])")
+
+
+def split_sentences(text):
+    return [s.strip() for s in SENTENCE_PATTERN.split(text) if s and s.strip()]
+
+
+def _overlap(left, right, max_chars):
+    """Length of the longest suffix of left that is a prefix of right"""
+    for size in range(min(max_chars, len(left), len(right)), 20, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def _page(doc):
+    try:
+        return int(doc.metadata.get("page"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _contiguous(group, pages, doc, page):
+    """Same known source and the same or an adjacent known page"""
+    source = doc.metadata.get("source")
+    return (source is not None and source == group.metadata.get("source")
+            and page is not None and pages[0] is not None and pages[0] - 1 <= page <= pages[1] + 1)
+
+
+def merge_chunks(documents, max_overlap=CONTEXT_MAX_OVERLAP_CHARS):
+    """Drop duplicate chunks and join neighbouring chunks, removing the splitter overlap
+
+    Chunks are only joined when they come from the same source, have known
+    pages that are the same or adjacent, and their text overlaps the way
+    consecutive splitter chunks do; anything else stays a separate block, so
+    unrelated passages are never presented as continuous text. Groups keep
+    the rank of their best chunk.
+    """
+    groups = []    # [document, (first page, last page)]
+    for doc in documents:
+        text = doc.page_content.strip()
+        if any(text in group.page_content for group, _ in groups):
+            continue
+        page = _page(doc)
+        for entry in groups:
+            group, pages = entry
+            if not _contiguous(group, pages, doc, page):
+                continue
+            merged = group.page_content
+            if merged in text:
+                group.page_content = text
+            elif _overlap(merged, text, max_overlap):
+                group.page_content = merged + text[_overlap(merged, text, max_overlap):]
+            elif _overlap(text, merged, max_overlap):
+                group.page_content = text + merged[_overlap(text, merged, max_overlap):]
+            else:
+                continue
+            entry[1] = (min(pages[0], page), max(pages[1], page))
+            break
+        else:
+            groups.append([Document(page_content=text, metadata=dict(doc.metadata)), (page, page)])
+    return [group for group, _ in groups]
+
+
+class ContextCompressor(BaseDocumentCompressor):
+    """Shrinks retrieved chunks to the sentences most relevant to the query, within a token budget
+
+    Overlapping and duplicate chunks are merged first; sentences are scored by
+    query-term overlap and picked best-first until the budget is used, then
+    put back in document order. If nothing matches the query, the leading
+    sentences of the top documents are kept instead.
+    """
+    token_budget: int = CONTEXT_TOKEN_BUDGET
+    neighbor_sentences: int = CONTEXT_NEIGHBOR_SENTENCES
+
+    def compress_documents(self, documents: Sequence[Document], query: str,
+                           callbacks: Optional[Callbacks] = None) -> Sequence[Document]:
+        with span("chat", "compression"):
+            return self._compress(documents, query)
+
+    def _compress(self, documents, query):
+        before = sum(estimate_tokens(doc.page_content) for doc in documents)
+        merged = merge_chunks(documents)
+        query_terms = set(tokenize(query))
+
+        seen = set()
+        candidates = []    # (score, doc_rank, sentence_index, sentence)
+        per_doc = []
+        for rank, doc in enumerate(merged):
+            sentences = []
+            for sentence in split_sentences(doc.page_content):
+                normalized = " ".join(sentence.lower().split())
+                if normalized in seen:
+                    continue
+                seen.add(normalized)
+                sentences.append(sentence)
+            per_doc.append(sentences)
+            for index, sentence in enumerate(sentences):
+                terms = set(tokenize(sentence))
+                score = len(query_terms & terms) / (len(query_terms) or 1)
+                # Earlier-ranked documents win ties
+                candidates.append((score - rank * 1e-3, rank, index, sentence))
+
+        if not any(c[0] > 0 for c in candidates):
+            candidates.sort(key=lambda c: (c[1], c[2]))
+        else:
+            candidates = [c for c in candidates if c[0] > 0]
+            candidates.sort(key=lambda c: c[0], reverse=True)
+
+        chosen = set()
+        used = 0
+
+        def take(rank, index):
+            nonlocal used
+            if (rank, index) in chosen:
+                return True
+            tokens = estimate_tokens(per_doc[rank][index])
+            if used + tokens > self.token_budget:
+                return False
+            chosen.add((rank, index))
+            used += tokens
+            return True
+
+        for _, rank, index, _ in candidates:
+            if not take(rank, index):
+                continue
+            # Keep a little surrounding context around each matching sentence
+            for offset in range(1, self.neighbor_sentences + 1):
+                for i in (index - offset, index + offset):
+                    if 0 <= i < len(per_doc[rank]):
+                        take(rank, i)
+            if used >= self.token_budget:
+                break
+
+        compressed = []
+        for rank, doc in enumerate(merged):
+            keep = [per_doc[rank][i] for i in range(len(per_doc[rank])) if (rank, i) in chosen]
+            if keep:
+                compressed.append(Document(page_content=" ".join(keep), metadata=doc.metadata))
+
+        context_tokens.inc(before, kind="retrieved")
+        context_tokens.inc(used, kind="sent")
+        context_tokens_sent.observe(used)
+        annotate("context_tokens_retrieved", before)
+        annotate("context_tokens_sent", used)
+        return compressed
@@ -1,14 +1,44 @@
 import os
+import json
+import time
+import random
+import shutil
+import hashlib
 import logging
+import argparse
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from langchain_community.document_loaders import DirectoryLoader, PyPDFLoader, CSVLoader
 from langchain_community.vectorstores import FAISS
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_ollama import OllamaEmbeddings
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from dotenv import load_dotenv  
+from embedding_cache import CachedEmbeddings
+from upstreams import get_upstream
+from vector_index import (
+    DOCSTORE_FILE, INDEX_FILE, index_settings, save_vector_store, load_vector_store, load_editable_store,
+)
+from hybrid_retrieval import BM25Index, BM25_FILE
+from dotenv import load_dotenv
 load_dotenv()
 
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+
+EMBEDDING_MODEL = "models/embedding-001"
+DOCS_DIR = "docs2"
+FAISS_INDEX_PATH = "faiss_index"
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+# faiss_index/CURRENT names the live version directory; MANIFEST_FILE lives in each version
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+INDEX_KEEP_VERSIONS = int(os.getenv("INDEX_KEEP_VERSIONS", "2"))
+INDEX_PARSE_WORKERS = int(os.getenv("INDEX_PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+INDEX_EMBED_BATCH_SIZE = int(os.getenv("INDEX_EMBED_BATCH_SIZE", "64"))
+INDEX_EMBED_CONCURRENCY = int(os.getenv("INDEX_EMBED_CONCURRENCY", "4"))
+INDEX_EMBED_RETRIES = int(os.getenv("INDEX_EMBED_RETRIES", "5"))
+
 def setup_logging():
     """Set up basic logging for embeddings creation"""
     logging.basicConfig(
@@ -17,101 +47,254 @@ def setup_logging():
     )
     return logging.getLogger(__name__)
 
-def create_embeddings():
-    """Create and save FAISS embeddings from PDF documents"""
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def chunk_id_prefix(rel_path, file_hash):
+    # Path and content both go in, so identical copies of a PDF get distinct IDs
+    return hashlib.sha256(f"{rel_path}\x00{file_hash}".encode("utf-8")).hexdigest()[:16]
+
+def load_and_split(path, id_prefix, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """Parse one PDF into chunks with stable IDs; runs in a worker process"""
+    docs = PyPDFLoader(path).load()
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    splits = text_splitter.split_documents(docs)
+    ids = [f"{id_prefix}-{i}" for i in range(len(splits))]
+    return ids, splits
+
+def embed_with_retry(embeddings, texts, retries=INDEX_EMBED_RETRIES):
+    """embed_documents with exponential backoff and jitter on failures"""
+    for attempt in range(retries + 1):
+        try:
+            return embeddings.embed_documents(texts)
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = min(60, 2 ** attempt) + random.uniform(0, 1)
+            setup_logging().warning(f"Embedding batch of {len(texts)} failed ({str(e)}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+def embed_chunks(embeddings, texts, batch_size=INDEX_EMBED_BATCH_SIZE, concurrency=INDEX_EMBED_CONCURRENCY):
+    """Embed texts in batches with at most `concurrency` requests in flight"""
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="index-embed") as pool:
+        results = list(pool.map(lambda batch: embed_with_retry(embeddings, batch), batches))
+    return [vector for batch in results for vector in batch]
+
+def resolve_index_path(faiss_index_path=FAISS_INDEX_PATH):
+    """Directory holding the live index: the version named in CURRENT, or the legacy flat layout"""
+    try:
+        with open(os.path.join(faiss_index_path, CURRENT_FILE)) as f:
+            return os.path.join(faiss_index_path, f.read().strip())
+    except FileNotFoundError:
+        return faiss_index_path
+
+def read_manifest(index_dir):
+    try:
+        with open(os.path.join(index_dir, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def publish_index(vectorstore, manifest, faiss_index_path=FAISS_INDEX_PATH):
+    """Write a new index version and atomically point CURRENT at it"""
     logger = setup_logging()
-    
+    version = datetime.now().strftime("v%Y%m%d-%H%M%S-%f")
+    version_dir = os.path.join(faiss_index_path, version)
+    save_vector_store(vectorstore, version_dir, manifest["index"])
+    # Lexical index over the same chunks for hybrid retrieval
+    BM25Index.from_vectorstore(vectorstore).save(os.path.join(version_dir, BM25_FILE))
+    with open(os.path.join(version_dir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f)
+
+    # os.replace is atomic, so readers see either the old or the new CURRENT
+    tmp_path = os.path.join(faiss_index_path, CURRENT_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(faiss_index_path, CURRENT_FILE))
+    logger.info(f"Published FAISS index version '{version}'")
+
+    # Keep a few older versions for rollback. Workers still serving a pruned
+    # version are unaffected: they hold its docstore and index files open
+    versions = sorted(d for d in os.listdir(faiss_index_path)
+                      if d.startswith("v") and os.path.isdir(os.path.join(faiss_index_path, d)))
+    for old in versions[:-max(1, INDEX_KEEP_VERSIONS)]:
+        shutil.rmtree(os.path.join(faiss_index_path, old), ignore_errors=True)
+    return version
+
+def create_embeddings(full=False):
+    """Incrementally update the FAISS index from PDF documents
+
+    Only new or changed PDFs are parsed and embedded; vectors of removed or
+    changed files are deleted. full=True (or a change of embedding model or
+    chunking) rebuilds from scratch.
+    """
+    logger = setup_logging()
+
     try:
         # Initialize embeddings
         logger.info("Initializing embeddings model...")
-        embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
+        embeddings = GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL)
         logger.info("Embeddings model initialized successfully")
-        
+
         # Check if documents directory exists
-        docs_dir = "docs2"
+        docs_dir = DOCS_DIR
         if not os.path.exists(docs_dir):
             logger.error(f"Documents directory '{docs_dir}' not found!")
             return False
-            
-        # Load and process documents
-        logger.info("Loading csv documents...")
-        # loader = CSVLoader('PITB.csv')
-        loader = DirectoryLoader(
-            docs_dir,
-            glob="**/*.pdf",
-            loader_cls=PyPDFLoader,
-            show_progress=True
-        )
-        docs = loader.load()
-        logger.info(f"Loaded {len(docs)} documents from csv files")
-        
-        if not docs:
+
+        settings = {"embedding_model": EMBEDDING_MODEL, "chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP}
+        faiss_index_path = FAISS_INDEX_PATH
+        os.makedirs(faiss_index_path, exist_ok=True)
+        current_dir = resolve_index_path(faiss_index_path)
+        manifest = None if full else read_manifest(current_dir)
+        if manifest is not None and manifest.get("settings") != settings:
+            logger.info("Embedding model or chunking changed, rebuilding the whole index")
+            manifest = None
+
+        vectorstore = None
+        known_files = {}
+        if manifest is not None:
+            if os.path.exists(os.path.join(current_dir, DOCSTORE_FILE)):
+                vectorstore = load_editable_store(current_dir, embeddings)
+            else:
+                vectorstore = FAISS.load_local(current_dir, embeddings, allow_dangerous_deserialization=True)
+            known_files = manifest["files"]
+
+        # Hash every PDF to find what changed since the last build
+        logger.info("Scanning PDF documents...")
+        current_files = {}
+        for root, _, names in os.walk(docs_dir):
+            for name in names:
+                if name.lower().endswith(".pdf"):
+                    path = os.path.join(root, name)
+                    current_files[os.path.relpath(path, docs_dir)] = file_sha256(path)
+
+        removed = [f for f in known_files if f not in current_files]
+        changed = [f for f in current_files if f in known_files and known_files[f]["sha256"] != current_files[f]]
+        added = [f for f in current_files if f not in known_files]
+        logger.info(f"Documents: {len(added)} new, {len(changed)} changed, {len(removed)} removed, "
+                    f"{len(current_files) - len(added) - len(changed)} unchanged")
+
+        # A new index type or parameters only needs the serving index rebuilt, not re-embedding
+        if manifest is not None and not (added or changed or removed) and manifest.get("index") == index_settings():
+            logger.info("FAISS index is up to date")
+            return True
+
+        files = {f: known_files[f] for f in current_files if f in known_files and f not in changed}
+        stale_ids = [chunk_id for f in removed + changed for chunk_id in known_files[f]["chunk_ids"]]
+        if vectorstore is not None and stale_ids:
+            logger.info(f"Deleting {len(stale_ids)} chunks of removed or changed documents...")
+            vectorstore.delete(stale_ids)
+
+        # Parse and split new/changed PDFs in parallel
+        to_parse = added + changed
+        texts, metadatas, ids = [], [], []
+        if to_parse:
+            logger.info(f"Parsing {len(to_parse)} PDFs with {INDEX_PARSE_WORKERS} worker processes...")
+            with ProcessPoolExecutor(max_workers=INDEX_PARSE_WORKERS) as pool:
+                jobs = [pool.submit(load_and_split, os.path.join(docs_dir, f), chunk_id_prefix(f, current_files[f]))
+                        for f in to_parse]
+                for rel_path, job in zip(to_parse, jobs):
+                    chunk_ids, splits = job.result()
+                    files[rel_path] = {"sha256": current_files[rel_path], "chunk_ids": chunk_ids}
+                    texts.extend(split.page_content for split in splits)
+                    metadatas.extend(split.metadata for split in splits)
+                    ids.extend(chunk_ids)
+            logger.info(f"Created {len(texts)} document chunks")
+
+        if texts:
+            logger.info(f"Embedding {len(texts)} chunks (batch size {INDEX_EMBED_BATCH_SIZE}, "
+                        f"concurrency {INDEX_EMBED_CONCURRENCY})...")
+            vectors = embed_chunks(embeddings, texts)
+            text_embeddings = list(zip(texts, vectors))
+            if vectorstore is None:
+                vectorstore = FAISS.from_embeddings(text_embeddings, embeddings, metadatas=metadatas, ids=ids)
+            else:
+                vectorstore.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+
+        if vectorstore is None:
             logger.error("No documents found to process!")
             return False
-        
-        # Split documents
-        logger.info("Splitting documents into chunks...")
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000, 
-            chunk_overlap=200
-        )
-        splits = text_splitter.split_documents(docs)
-        logger.info(f"Created {len(splits)} document chunks")
-        
-        # Create vectorstore from documents
-        logger.info("Creating FAISS vector store...")
-        vectorstore = FAISS.from_documents(documents=splits, embedding=embeddings)
-        
-        # Save the index locally
-        faiss_index_path = 'faiss_index'
+
         logger.info(f"Saving FAISS index to '{faiss_index_path}'...")
-        vectorstore.save_local(faiss_index_path)
+        publish_index(vectorstore, {"settings": settings, "index": index_settings(), "files": files}, faiss_index_path)
         logger.info("FAISS index created and saved successfully!")
-        
+
         return True
-        
+
     except Exception as e:
         logger.error(f"Error during embeddings creation: {str(e)}")
         logger.error(f"Exception details:", exc_info=True)
         return False
 
-def load_embeddings():
-    """Load existing FAISS embeddings"""
+def index_fingerprint(faiss_index_path=FAISS_INDEX_PATH):
+    """Identifies the saved FAISS index; changes whenever it is rebuilt"""
+    index_dir = resolve_index_path(faiss_index_path)
+    # Published versions keep documents in SQLite; the legacy layout pickles them
+    docstore = DOCSTORE_FILE if os.path.exists(os.path.join(index_dir, DOCSTORE_FILE)) else "index.pkl"
+    try:
+        stats = [os.stat(os.path.join(index_dir, name)) for name in (INDEX_FILE, docstore)]
+    except OSError:
+        return None
+    return (index_dir,) + tuple((s.st_mtime_ns, s.st_size) for s in stats)
+
+def load_embeddings(embeddings=None):
+    """Load existing FAISS embeddings, optionally reusing an existing query embedder"""
     logger = setup_logging()
-    
+
     try:
-        # Initialize embeddings
-        embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-        
+        # Initialize embeddings; query embeddings are cached, coalesced and batched
+        if embeddings is None:
+            google = get_upstream("google")
+            embeddings = CachedEmbeddings(
+                GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL, request_options={"timeout": google.timeout.read}),
+                model_name=EMBEDDING_MODEL,
+                upstream=google
+            )
+
         # Check if FAISS index exists
-        faiss_index_path = 'faiss_index'
+        faiss_index_path = resolve_index_path(FAISS_INDEX_PATH)
         if not (os.path.exists(faiss_index_path) and os.path.isdir(faiss_index_path)):
             logger.error(f"FAISS index not found at '{faiss_index_path}'. Please run create_embeddings() first.")
             return None
-            
-        # Load existing FAISS index
-        logger.info("Loading existing FAISS index...")
-        vectorstore = FAISS.load_local(
-            faiss_index_path, 
-            embeddings, 
-            allow_dangerous_deserialization=True
-        )
+
+        # Load existing FAISS index: memory-mapped with the SQLite docstore, or the legacy pickle
+        logger.info(f"Loading existing FAISS index from '{faiss_index_path}'...")
+        if os.path.exists(os.path.join(faiss_index_path, DOCSTORE_FILE)):
+            vectorstore = load_vector_store(faiss_index_path, embeddings)
+        else:
+            vectorstore = FAISS.load_local(
+                faiss_index_path,
+                embeddings,
+                allow_dangerous_deserialization=True
+            )
         logger.info("FAISS index loaded successfully")
-        
+
         return vectorstore
-        
+
     except Exception as e:
         logger.error(f"Error loading embeddings: {str(e)}")
         logger.error(f"Exception details:", exc_info=True)
         return None
 
 if __name__ == "__main__":
-    """Run this script to create embeddings from PDF documents"""
+    """Run this script to create or update embeddings from PDF documents"""
+    parser = argparse.ArgumentParser(description="Build or incrementally update the FAISS index from docs2/")
+    parser.add_argument("--full", action="store_true", help="re-embed every document instead of only changes")
+    args = parser.parse_args()
+
     print("Creating embeddings from PDF documents...")
-    success = create_embeddings()
-    
+    success = create_embeddings(full=args.full)
+
     if success:
         print("✅ Embeddings created successfully!")
         print("You can now run inference.py to start the chatbot.")
     else:
-        print("❌ Failed to create embeddings. Check the logs for details.")
\ No newline at end of file
+        print("❌ Failed to create embeddings. Check the logs for details.")
@@ -0,0 +1,216 @@
+import os
+import time
+import array
+import hashlib
+import inspect
+import logging
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+from langchain_core.embeddings import Embeddings
+from batching import MicroBatcher
+from metrics import counter, gauge, histogram
+from tracing import current_trace
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.db")   # empty disables the disk tier
+EMBEDDING_CACHE_DISK_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_DISK_MAX_ENTRIES", "200000"))
+EMBEDDING_MAX_BATCH_SIZE = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "16"))
+EMBEDDING_MAX_WAIT_MS = float(os.getenv("EMBEDDING_MAX_WAIT_MS", "10"))
+
+embedding_cache_requests = counter(
+    "embedding_cache_requests_total", "Query embedding lookups by tier and outcome", ["tier", "result"]
+)
+embedding_cache_entries = gauge("embedding_cache_entries", "Query embeddings held by each cache tier", ["tier"])
+embedding_seconds = histogram(
+    "embedding_request_seconds", "Time to obtain a query embedding, by where it came from", ["source"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+embedding_remote_calls = counter(
+    "embedding_remote_calls_total", "Calls made to the remote embedding model", ["kind"]
+)
+
+
+def normalize_query(text):
+    """Whitespace/case/Unicode-normalized form used as the cache key (the model sees the original text)"""
+    return " ".join(unicodedata.normalize("NFKC", text).split()).lower()
+
+
+def _record_latency(source, started):
+    elapsed = time.perf_counter() - started
+    embedding_seconds.observe(elapsed, source=source)
+    # Reported on the request trace separately from LLM time
+    trace = current_trace()
+    if trace is not None:
+        trace.annotate("embedding_ms", trace.attributes.get("embedding_ms", 0.0) + elapsed * 1000)
+
+
+class _DiskTier:
+    """SQLite table of packed float32 vectors, trimmed oldest-first beyond max_entries"""
+
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, created_at REAL NOT NULL)"
+        )
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        vector = array.array("f")
+        vector.frombytes(row[0])
+        return vector.tolist()
+
+    def put_many(self, items):
+        now = time.time()
+        conn = self._conn()
+        conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, vector, created_at) VALUES (?, ?, ?)",
+            [(key, array.array("f", vector).tobytes(), now) for key, vector in items],
+        )
+        self._writes += len(items)
+        if self._writes >= 1000:
+            self._writes = 0
+            conn.execute(
+                "DELETE FROM embeddings WHERE key IN ("
+                "SELECT key FROM embeddings ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            embedding_cache_entries.set(self.count(), tier="disk")
+
+    def count(self):
+        return self._conn().execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+
+class CachedEmbeddings(Embeddings):
+    """Query-side wrapper around an embedding model
+
+    embed_query() goes through an in-process LRU, then an optional SQLite tier,
+    both keyed by model name and normalized text; the model is always sent the
+    caller's original text, since case can carry meaning. Concurrent identical
+    queries share one in-flight request, and distinct misses arriving within
+    max_wait_ms are sent to the model as one batch. Document embedding is
+    passed straight through.
+    """
+
+    def __init__(self, embeddings, model_name, max_entries=EMBEDDING_CACHE_SIZE, path=EMBEDDING_CACHE_PATH,
+                 disk_max_entries=EMBEDDING_CACHE_DISK_MAX_ENTRIES, max_batch_size=EMBEDDING_MAX_BATCH_SIZE,
+                 max_wait_ms=EMBEDDING_MAX_WAIT_MS, upstream=None):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.upstream = upstream
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._inflight = {}
+        self._disk = _DiskTier(path, disk_max_entries) if path else None
+        self._batch_task_type = "task_type" in inspect.signature(embeddings.embed_documents).parameters
+        self._batcher = MicroBatcher(self._embed_batch, max_batch_size, max_wait_ms, name="query-embedding")
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model_name}\x00{text}".encode("utf-8")).hexdigest()
+
+    def embed_documents(self, texts):
+        embedding_remote_calls.inc(kind="documents")
+        return self._remote(self.embeddings.embed_documents, texts)
+
+    def _remote(self, fn, *args, **kwargs):
+        """Model calls go through the upstream's concurrency limit, retries and circuit breaker"""
+        if self.upstream is None:
+            return fn(*args, **kwargs)
+        return self.upstream.call(fn, *args, **kwargs)
+
+    def embed_query(self, text):
+        started = time.perf_counter()
+        # Variants differing only in case or spacing share an entry; the first one seen is embedded
+        key = self._key(normalize_query(text))
+
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                embedding_cache_requests.inc(tier="memory", result="hit")
+                _record_latency("memory", started)
+                return list(vector)
+            embedding_cache_requests.inc(tier="memory", result="miss")
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+
+        if not owner:
+            embedding_cache_requests.inc(tier="inflight", result="hit")
+            vector = future.result()
+            _record_latency("inflight", started)
+            return list(vector)
+
+        try:
+            vector = self._disk_get(key)
+            if vector is not None:
+                embedding_cache_requests.inc(tier="disk", result="hit")
+                source = "disk"
+            else:
+                if self._disk is not None:
+                    embedding_cache_requests.inc(tier="disk", result="miss")
+                vector = self._batcher.submit(text).result()
+                source = "remote"
+            self._remember(key, vector, persist=source == "remote")
+            future.set_result(vector)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+        _record_latency(source, started)
+        return list(vector)
+
+    def _disk_get(self, key):
+        if self._disk is None:
+            return None
+        try:
+            return self._disk.get(key)
+        except sqlite3.Error as e:
+            logger.error(f"Query embedding cache read failed: {str(e)}")
+            return None
+
+    def _embed_batch(self, key, texts):
+        if len(texts) == 1:
+            embedding_remote_calls.inc(kind="query")
+            return [self._remote(self.embeddings.embed_query, texts[0])]
+        embedding_remote_calls.inc(kind="query_batch")
+        if self._batch_task_type:
+            return self._remote(self.embeddings.embed_documents, texts, task_type="retrieval_query")
+        return [self._remote(self.embeddings.embed_query, text) for text in texts]
+
+    def _remember(self, key, vector, persist):
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+            embedding_cache_entries.set(len(self._memory), tier="memory")
+        if persist and self._disk is not None:
+            try:
+                self._disk.put_many([(key, vector)])
+            except sqlite3.Error as e:
+                logger.error(f"Failed to persist query embedding: {str(e)}")
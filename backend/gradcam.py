@@ -0,0 +1,100 @@
+"""Grad-CAM engine shared by every /predict request that asks for a heatmap"""
+import time
+import threading
+import torch
+from tracing import span, record_stage
+
+
+class GradCAM:
+    """Long-lived Grad-CAM engine attached once to a model layer.
+
+    A single forward hook is registered for the lifetime of the engine and
+    only records activations for the thread that is currently inside
+    classify(). Gradients are taken with torch.autograd.grad against those
+    activations, so nothing is accumulated on the model's parameters and
+    concurrent requests never see each other's tensors.
+    """
+
+    def __init__(self, model, target_layer):
+        self.model = model
+        self.target_layer = target_layer
+        self._local = threading.local()
+        self._handle = target_layer.register_forward_hook(self._save_activations)
+
+    def _save_activations(self, module, input, output):
+        # Ignore forward passes that are not part of a Grad-CAM request
+        # (e.g. plain classification under torch.no_grad() on other threads)
+        if getattr(self._local, "capturing", False) and torch.is_grad_enabled():
+            self._local.activations = output
+
+    @property
+    def attached(self):
+        return self._handle is not None
+
+    def remove(self):
+        """Detach the forward hook from the target layer"""
+        if self._handle is not None:
+            self._handle.remove()
+            self._handle = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.remove()
+
+    def classify(self, input_image, explain=True, target_class=None):
+        """Classify a batch and optionally build its Grad-CAM from the same forward pass
+
+        Returns (probs, pred_idx, heatmaps); heatmaps is None when explain is False.
+        """
+        if not explain:
+            with torch.no_grad(), span("vision", "forward"):
+                output = self.model(input_image)
+                probs = torch.softmax(output, dim=1)
+            return probs, probs.argmax(dim=1), None
+
+        if self._handle is None:
+            raise RuntimeError("GradCAM hooks have been removed")
+
+        self._local.capturing = True
+        self._local.activations = None
+        try:
+            # Single forward pass shared by classification and Grad-CAM
+            with torch.enable_grad():
+                with span("vision", "forward"):
+                    output = self.model(input_image)
+                activations = self._local.activations
+                pred_idx = output.argmax(dim=1)
+                if target_class is None:
+                    target = pred_idx
+                else:
+                    target = torch.full_like(pred_idx, target_class)
+
+                # Gradient of the target class w.r.t. the captured activations only
+                backward_started = time.perf_counter()
+                score = output.gather(1, target.unsqueeze(1)).sum()
+                gradients, = torch.autograd.grad(score, activations)
+        finally:
+            self._local.capturing = False
+            self._local.activations = None
+
+        probs = torch.softmax(output.detach(), dim=1)
+
+        # Compute Grad-CAM
+        weights = torch.mean(gradients, dim=(2, 3), keepdim=True)
+        grad_cam = torch.sum(weights * activations.detach(), dim=1)
+        grad_cam = torch.relu(grad_cam)
+
+        # Normalize each heatmap in the batch
+        grad_cam = grad_cam / (grad_cam.amax(dim=(1, 2), keepdim=True) + 1e-8)
+        heatmaps = grad_cam.cpu().numpy()
+        record_stage("vision", "backward_cam", time.perf_counter() - backward_started)
+
+        return probs, pred_idx, heatmaps
+
+    def generate(self, input_image, target_class=None):
+        _, pred_idx, heatmaps = self.classify(input_image, explain=True, target_class=target_class)
+        if target_class is None:
+            target_class = pred_idx[0].item()
+        return heatmaps[0], target_class
@@ -0,0 +1,283 @@
+"""Request logic shared by the Flask (inference.py) and ASGI (asgi_app.py) front ends
+
+A front end reads the request, does the I/O its own way (worker threads or
+the event loop) and wraps the results in its response type. Validation,
+cache lookups, chat logging and the bodies of JSON responses and stream
+frames live here, so both front ends behave the same.
+"""
+import os
+import time
+import uuid
+import logging
+from contextlib import contextmanager
+from heatmaps import heatmap_options
+from result_cache import PredictionCache, cache_key
+from streaming import ThinkTagFilter, FrameCoalescer, ChunkEvents, sse_event, split_frames
+from tracing import start_trace, end_trace
+
+logger = logging.getLogger(__name__)
+chat_logger = logging.getLogger('chat')
+
+CHAT_COMPLETE_INCLUDE_HISTORY = os.getenv("CHAT_COMPLETE_INCLUDE_HISTORY", "false").lower() in ("1", "true", "yes")
+TTS_MAX_CHARS = 10000
+
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'Connection': 'keep-alive',
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Cache-Control'
+}
+
+CHAT_ERROR = 'An error occurred while processing your request'
+TRANSCRIBE_ERROR = {'error': 'Internal transcription error', 'success': False}
+TTS_ERROR = {'error': 'Internal TTS error', 'success': False}
+
+# Content-addressed cache of /predict results
+prediction_cache = PredictionCache()
+
+
+def parse_flag(value, default=False):
+    """Parse a boolean query/form flag such as ?explain=false"""
+    if value is None or value == "":
+        return default
+    return value.strip().lower() not in ("0", "false", "no", "off")
+
+
+# Chat
+
+def open_chat_session(rag, session_id, user_input):
+    """Log the request and create its session if needed; returns the session ID (blocking)"""
+    logger.info(f"Chat request received - Session ID: {session_id}")
+    chat_logger.info(f"SESSION: {session_id} | USER: {user_input}", extra={'session_id': session_id})
+
+    if not session_id:
+        session_id = str(uuid.uuid4())
+        logger.info(f"Generated new session ID: {session_id}")
+    with rag.session_store.lock(session_id):
+        if not rag.session_store.exists(session_id):
+            rag.session_store.create(session_id)
+            logger.info(f"Initialized new session: {session_id}")
+    return session_id
+
+
+def no_input_payload(rag, session_id):
+    """400 body for a chat request without input (blocking)"""
+    logger.warning(f"Empty user input received for session: {session_id}")
+    return {
+        'error': 'No input provided',
+        'session_id': session_id,
+        'chat_history': rag.session_store.messages(session_id)
+    }
+
+
+class ChatTurn:
+    """One /chat answer stream
+
+    The front end runs rag.conversational_rag_chain (stream() or astream())
+    with chain_input() and chain_config() and hands each chunk to feed();
+    the cached-answer path, <think> filtering, frame coalescing, chat logging
+    and the complete/error frames are handled here. lookup(), remember() and
+    complete() may block on the session store or the embedding API.
+    """
+
+    def __init__(self, rag, session_id, user_input, started_at, request_id, include_history):
+        self.rag = rag
+        self.session_id = session_id
+        self.user_input = user_input
+        self.started_at = started_at
+        self.request_id = request_id
+        self.include_history = include_history
+        # <think> content is filtered out incrementally and the visible answer
+        # is coalesced into size/time-bounded frames
+        self.tag_filter = ThinkTagFilter()
+        self.frames = FrameCoalescer()
+        self.chunks = ChunkEvents(session_id, started_at, request_id)
+        self.trace = None
+        self.cache_lookup = None
+        self.answer = ""
+        self.think = ""
+
+    @contextmanager
+    def traced(self):
+        """The stream outlives the handler's trace; it continues under the same request ID"""
+        self.trace, trace_token = start_trace(self.request_id)
+        try:
+            yield self
+        finally:
+            end_trace(trace_token)
+
+    def lookup(self):
+        """Frames replaying a cached answer for a hot question, or None when the chain has to run"""
+        self.cache_lookup = self.rag.lookup_cached_answer(self.session_id, self.user_input)
+        if self.cache_lookup is None or not self.cache_lookup.hit:
+            return None
+        logger.info(f"Semantic cache hit for session {self.session_id} (similarity {self.cache_lookup.similarity:.3f})")
+        self.rag.record_cached_turn(self.session_id, self.user_input, self.cache_lookup.answer)
+        self.answer = self.cache_lookup.answer
+        return [self.chunks.event(frame) for frame in split_frames(self.answer)]
+
+    def chain_input(self):
+        return {"input": self.user_input}
+
+    def chain_config(self):
+        # History is injected (and the turn persisted) by RunnableWithMessageHistory
+        return {
+            "configurable": {"session_id": self.session_id},
+            "callbacks": [self.rag.StageTimer(self.trace)],
+        }
+
+    def feed(self, chunk):
+        """Frame for a chain chunk, or None while its text is held back"""
+        if 'answer' not in chunk:
+            return None
+        frame = self.frames.push(self.tag_filter.feed(chunk['answer']))
+        return self.chunks.event(frame) if frame else None
+
+    def flush(self):
+        """Frame for any text still held back once the chain is done, or None"""
+        frame = self.frames.push(self.tag_filter.flush()) or self.frames.flush()
+        self.answer = self.tag_filter.answer.strip()
+        self.think = self.tag_filter.think.strip()
+        return self.chunks.event(frame) if frame else None
+
+    def remember(self):
+        self.rag.remember_answer(self.cache_lookup, self.trace, self.answer)
+
+    def complete(self):
+        """Log the answer and build the final frame (blocking with include_history)"""
+        trace = self.trace
+        chat_logger.info(f"SESSION: {self.session_id} | BOT: {self.answer}", extra={'session_id': self.session_id})
+        if self.think:
+            chat_logger.info(f"SESSION: {self.session_id} | THINK: {self.think}", extra={'session_id': self.session_id})
+        logger.info(f"Session {self.session_id} retrieval query path: {trace.attributes.get('rewrite_path')}, {self.chunks.count} chunk events")
+
+        total_execution_time = time.time() - self.started_at
+        cache_lookup = self.cache_lookup
+        complete = {
+            'type': 'complete',
+            'session_id': self.session_id,
+            'request_id': self.request_id,
+            'processing_time': f'{total_execution_time:.2f}s',
+            'think_content': self.think,
+            'telemetry': {
+                'rewrite_path': trace.attributes.get('rewrite_path'),
+                'chunk_events': self.chunks.count,
+                'ttft_ms': self.chunks.ttft_ms,
+                'context_tokens': trace.attributes.get('context_tokens_sent'),
+                'context_tokens_retrieved': trace.attributes.get('context_tokens_retrieved'),
+                'answer_cache': 'skip' if cache_lookup is None else ('hit' if cache_lookup.hit else 'miss'),
+                'embedding_ms': round(trace.attributes.get('embedding_ms', 0.0), 1),
+                'stages': trace.spans,
+            },
+        }
+        if self.include_history:
+            complete['chat_history'] = self.rag.session_store.messages(self.session_id)
+        return sse_event(complete)
+
+    def error(self, e):
+        """Log a failed stream (call from the except block) and build its error frame"""
+        logger.error(f"Error in streaming response for session {self.session_id}: {str(e)}", exc_info=True)
+        chat_logger.error(f"SESSION: {self.session_id} | ERROR: {str(e)}", extra={'session_id': self.session_id})
+        return sse_event({'type': 'error', 'error': CHAT_ERROR, 'session_id': self.session_id,
+                          'request_id': self.request_id})
+
+
+# Transcription
+
+def transcription_event(event, filename, request_id):
+    return sse_event({**event, 'success': True, 'audio_filename': filename, 'request_id': request_id})
+
+
+def transcription_error_event(e, request_id):
+    """Log a failed transcription stream (call from the except block) and build its error frame"""
+    logger.error(f"Error in streaming transcription: {str(e)}", exc_info=True)
+    return sse_event({'type': 'error', **TRANSCRIBE_ERROR, 'request_id': request_id})
+
+
+def transcription_payload(result, filename):
+    """JSON body for a finished (non-streamed) transcription"""
+    transcription_text = result['transcription']
+    short = (transcription_text[:100] + '...') if len(transcription_text) > 100 else transcription_text
+    logger.info(f"Groq Whisper transcription result ({result['chunks']} chunks, {result['bytes_sent']} bytes sent): {short}")
+    return {
+        'transcription': transcription_text,
+        'success': True,
+        'audio_filename': filename,
+        'chunks': result['chunks'],
+        'processing_time': result['processing_time'],
+    }
+
+
+# Text to speech
+
+def select_tts_voice(text, language, session_id):
+    """Select model and voice based on language; returns (model, voice, text)"""
+    model = "playai-tts" if language == 'en' else "playai-tts-arabic"
+    voice = "Adelaide-PlayAI" if language == 'en' else "Ahmad-PlayAI"
+
+    if language == 'ur':
+        logger.warning(f"Urdu TTS not supported, falling back to English for session: {session_id}")
+        model = "playai-tts"
+        voice = "Adelaide-PlayAI"
+        text = f"Urdu is not supported for text-to-speech. The response will be in English: {text}"
+    return model, voice, text
+
+
+def tts_request(data):
+    """Validate a /tts JSON body; returns (text, session_id, model, voice) or raises ValueError"""
+    if not data or 'text' not in data:
+        logger.warning("No text provided in TTS request")
+        raise ValueError('No text provided')
+
+    text = data['text']
+    session_id = data.get('session_id', str(uuid.uuid4()))
+    language = data.get('language', 'en')  # Default to English
+
+    if not text:
+        logger.warning(f"Empty text input received for session: {session_id}")
+        raise ValueError('Empty text input')
+    if len(text) > TTS_MAX_CHARS:
+        logger.warning(f"Text input exceeds 10K characters for session: {session_id}")
+        raise ValueError('Text input exceeds 10,000 character limit')
+
+    logger.info(f"TTS request received - Session ID: {session_id}, Text: {text[:100]}...")
+    model, voice, text = select_tts_voice(text, language, session_id)
+    return text, session_id, model, voice
+
+
+def tts_failed_payload(e):
+    """500 body when the first sentence could not be synthesized"""
+    logger.error(f"Groq TTS API error: {str(e)}")
+    return {'error': f'TTS generation failed: {str(e)}', 'success': False}
+
+
+def tts_headers(audio, session_id):
+    logger.info(f"TTS first audio for session {session_id} in {audio.first_audio_s:.2f}s ({len(audio.segments)} segments)")
+    return {
+        'Content-Disposition': f'attachment; filename=tts_output_{session_id}.wav',
+        'Cache-Control': 'no-cache',
+        'Access-Control-Allow-Origin': '*'
+    }
+
+
+# Prediction
+
+def prediction_options(values):
+    """(explain, heatmap options) from request values; raises ValueError for bad options"""
+    # Skip the backward pass entirely when no heatmap is requested (?explain=false)
+    explain = parse_flag(values.get("explain"), default=True)
+    return explain, heatmap_options(values)
+
+
+def cached_prediction(vision, image_bytes, explain, options):
+    """(cache key, cached result or None); identical uploads, model and options share a key"""
+    key = cache_key(image_bytes, vision.MODEL_VERSION, explain=explain, **options)
+    cached = prediction_cache.get(key)
+    if cached is not None:
+        logger.info(f"Prediction cache hit -> {cached['label']} ({cached['probability']})")
+    return key, cached
+
+
+def store_prediction(key, result):
+    prediction_cache.put(key, result)
+    logger.info(f"Prediction -> {result['label']} ({result['probability']})")
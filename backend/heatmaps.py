@@ -0,0 +1,23 @@
+import os
+
+# Heatmap encoding settings; kept free of numpy/cv2 so request validation
+# does not pull the imaging stack into workers that never render one
+HEATMAP_FORMAT = os.getenv("HEATMAP_FORMAT", "png").lower()     # png | jpeg | webp | raw
+HEATMAP_QUALITY = int(os.getenv("HEATMAP_QUALITY", "85"))
+HEATMAP_FORMATS = ("png", "jpeg", "webp", "raw")
+
+
+def heatmap_options(values):
+    """Read ?heatmap_format=png|jpeg|webp|raw and ?heatmap_quality=1-100 from request values"""
+    heatmap_format = values.get("heatmap_format", HEATMAP_FORMAT).lower()
+    if heatmap_format == "jpg":
+        heatmap_format = "jpeg"
+    if heatmap_format not in HEATMAP_FORMATS:
+        raise ValueError(f"heatmap_format must be one of {', '.join(HEATMAP_FORMATS)}")
+    try:
+        heatmap_quality = int(values.get("heatmap_quality", HEATMAP_QUALITY))
+    except ValueError:
+        raise ValueError("heatmap_quality must be an integer")
+    if not 1 <= heatmap_quality <= 100:
+        raise ValueError("heatmap_quality must be between 1 and 100")
+    return {"heatmap_format": heatmap_format, "heatmap_quality": heatmap_quality}
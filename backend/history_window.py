@@ -0,0 +1,158 @@
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import SystemMessage
+from langchain_core.prompts import ChatPromptTemplate
+from session_store import dict_to_message, message_to_dict
+from metrics import counter, histogram
+
+logger = logging.getLogger(__name__)
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1200"))
+HISTORY_MIN_RECENT_MESSAGES = int(os.getenv("HISTORY_MIN_RECENT_MESSAGES", "2"))
+HISTORY_SUMMARY_MAX_WORDS = int(os.getenv("HISTORY_SUMMARY_MAX_WORDS", "120"))
+
+history_tokens = counter(
+    "chat_history_tokens_total", "Estimated chat history tokens per prompt, before and after windowing", ["kind"]
+)
+history_tokens_saved = counter(
+    "chat_history_tokens_saved_total", "Estimated prompt tokens removed from chat history by windowing"
+)
+history_window_tokens = histogram(
+    "chat_history_window_tokens", "Estimated tokens of chat history sent per prompt",
+    buckets=(50, 100, 250, 500, 1000, 2000, 4000, 8000),
+)
+summary_updates = counter("chat_history_summaries_total", "Rolling summary updates", ["result"])
+
+summary_prompt = ChatPromptTemplate.from_messages([
+    ("system",
+     "You maintain a running summary of a conversation between a user and the PCOS Health Assistant. "
+     "Merge the new messages into the existing summary. Keep facts the user shared about themselves "
+     "(symptoms, diagnoses, medications, questions still open) and any exact numbers. "
+     "Write at most {max_words} words of plain prose. Return only the summary."),
+    ("human", "Existing summary:\n{summary}\n\nNew messages:\n{lines}"),
+])
+
+try:
+    import tiktoken
+
+    _encoding = tiktoken.get_encoding("cl100k_base")
+
+    def estimate_tokens(text):
+        return len(_encoding.encode(text, disallowed_special=()))
+except ImportError:
+    def estimate_tokens(text):
+        # ~4 characters per token for English text
+        return max(1, len(text) // 4)
+
+
+def message_tokens(item):
+    # Content plus a small per-message overhead for role markers
+    return estimate_tokens(item["content"]) + 4
+
+
+class HistoryManager:
+    """Token-budgeted view of a session's history for the RAG chain
+
+    The most recent messages are kept verbatim within the token budget; older
+    messages are folded into a rolling summary, updated incrementally in the
+    background so the current turn never waits on it.
+    """
+
+    def __init__(self, store, llm, budget_tokens=HISTORY_TOKEN_BUDGET,
+                 min_recent_messages=HISTORY_MIN_RECENT_MESSAGES):
+        self.store = store
+        self.budget_tokens = budget_tokens
+        self.min_recent_messages = min_recent_messages
+        self.summarize_chain = summary_prompt | llm
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="history-summary")
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+
+    def get_history(self, session_id):
+        return WindowedSessionHistory(self, session_id)
+
+    def window(self, session_id):
+        """Messages to send with this turn: [summary] + recent turns within budget"""
+        items = self.store.records(session_id)
+        summary = self.store.get_summary(session_id)
+
+        if summary:
+            unfolded = [m for m in items if m.get("ts", 0) > summary["until"]]
+            budget = self.budget_tokens - estimate_tokens(summary["content"])
+        else:
+            unfolded = items
+            budget = self.budget_tokens
+
+        recent = []
+        used = 0
+        for item in reversed(unfolded):
+            tokens = message_tokens(item)
+            if used + tokens > budget and len(recent) >= self.min_recent_messages:
+                break
+            recent.append(item)
+            used += tokens
+        recent.reverse()
+
+        overflow = unfolded[:len(unfolded) - len(recent)]
+        if overflow:
+            self._schedule_summary(session_id, summary, overflow)
+
+        messages = []
+        if summary:
+            messages.append(SystemMessage(content=f"Summary of the earlier conversation: {summary['content']}"))
+            used += estimate_tokens(summary["content"])
+        messages.extend(dict_to_message(item) for item in recent)
+
+        full = sum(message_tokens(item) for item in items)
+        history_tokens.inc(full, kind="full")
+        history_tokens.inc(used, kind="sent")
+        history_tokens_saved.inc(max(0, full - used))
+        history_window_tokens.observe(used)
+        return messages
+
+    def _schedule_summary(self, session_id, summary, overflow):
+        with self._pending_lock:
+            if session_id in self._pending:
+                return
+            self._pending.add(session_id)
+        self._executor.submit(self._summarize, session_id, summary, overflow)
+
+    def _summarize(self, session_id, summary, overflow):
+        try:
+            lines = "\n".join(f"{item['role']}: {item['content']}" for item in overflow)
+            result = self.summarize_chain.invoke({
+                "summary": summary["content"] if summary else "(none)",
+                "lines": lines,
+                "max_words": HISTORY_SUMMARY_MAX_WORDS,
+            })
+            content = result.content if hasattr(result, "content") else str(result)
+            self.store.set_summary(session_id, content.strip(), overflow[-1]["ts"])
+            summary_updates.inc(result="ok")
+            logger.info(f"Folded {len(overflow)} messages into summary for session: {session_id}")
+        except Exception as e:
+            summary_updates.inc(result="error")
+            logger.error(f"Failed to update history summary for session {session_id}: {str(e)}")
+        finally:
+            with self._pending_lock:
+                self._pending.discard(session_id)
+
+
+class WindowedSessionHistory(BaseChatMessageHistory):
+    """Chat history whose reads are token-budgeted and whose writes go to the session store"""
+
+    def __init__(self, manager, session_id):
+        self.manager = manager
+        self.session_id = session_id
+
+    @property
+    def messages(self):
+        return self.manager.window(self.session_id)
+
+    def add_messages(self, messages):
+        self.manager.store.append(self.session_id, *[message_to_dict(m) for m in messages])
+
+    def clear(self):
+        self.manager.store.delete(self.session_id)
@@ -0,0 +1,347 @@
+import os
+import re
+import json
+import math
+import time
+import random
+import hashlib
+import logging
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Optional
+from langchain_core.retrievers import BaseRetriever
+from metrics import counter, histogram
+from tracing import record_stage
+
+logger = logging.getLogger(__name__)
+
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "true").lower() in ("1", "true", "yes")
+HYBRID_FETCH_K = int(os.getenv("HYBRID_FETCH_K", "20"))           # candidates taken from each retriever
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+HYBRID_RERANKER = os.getenv("HYBRID_RERANKER", "")                # e.g. cross-encoder/ms-marco-MiniLM-L-6-v2
+HYBRID_RERANK_BUDGET_MS = float(os.getenv("HYBRID_RERANK_BUDGET_MS", "150"))
+HYBRID_RERANK_MAX_PENDING = int(os.getenv("HYBRID_RERANK_MAX_PENDING", "4"))  # queued reranks before new ones are skipped
+BM25_FILE = "bm25.json"
+
+retrieval_stage_seconds = histogram(
+    "retrieval_stage_seconds", "Time spent in each hybrid retrieval stage", ["stage"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+rerank_outcomes = counter("retrieval_rerank_total", "Reranker runs by outcome", ["result"])
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[.'/-][a-z0-9]+)*")
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "how", "i", "in",
+    "is", "it", "me", "my", "of", "on", "or", "should", "that", "the", "this", "to", "what", "when",
+    "which", "who", "why", "will", "with", "you", "your",
+}
+
+
+def tokenize(text):
+    """Lowercased terms; keeps dosages and lab values like '500mg' or '1.5' intact"""
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def document_key(doc):
+    """Identity used to fuse dense and lexical results"""
+    if getattr(doc, "id", None):
+        return doc.id
+    source = f"{doc.metadata.get('source')}|{doc.metadata.get('page')}|{doc.page_content}"
+    return hashlib.sha1(source.encode("utf-8")).hexdigest()
+
+
+class BM25Index:
+    """In-process Okapi BM25 over the same chunks as the FAISS index"""
+
+    def __init__(self, doc_ids, doc_lengths, postings, k1=1.5, b=0.75):
+        self.doc_ids = doc_ids
+        self.doc_lengths = doc_lengths
+        self.postings = postings
+        self.k1 = k1
+        self.b = b
+        self.avg_length = (sum(doc_lengths) / len(doc_lengths)) if doc_lengths else 0.0
+
+    @classmethod
+    def build(cls, documents):
+        """documents: iterable of (doc_id, text)"""
+        doc_ids, doc_lengths, postings = [], [], {}
+        for position, (doc_id, text) in enumerate(documents):
+            terms = Counter(tokenize(text))
+            doc_ids.append(doc_id)
+            doc_lengths.append(sum(terms.values()))
+            for term, tf in terms.items():
+                postings.setdefault(term, []).append((position, tf))
+        return cls(doc_ids, doc_lengths, postings)
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore):
+        def documents():
+            for position in range(vectorstore.index.ntotal):
+                doc_id = vectorstore.index_to_docstore_id[position]
+                yield doc_id, vectorstore.docstore.search(doc_id).page_content
+        return cls.build(documents())
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({"k1": self.k1, "b": self.b, "doc_ids": self.doc_ids,
+                       "doc_lengths": self.doc_lengths, "postings": self.postings}, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        postings = {term: [tuple(p) for p in plist] for term, plist in data["postings"].items()}
+        return cls(data["doc_ids"], data["doc_lengths"], postings, data["k1"], data["b"])
+
+    def search(self, query, k):
+        """Top-k (doc_id, score) pairs"""
+        count = len(self.doc_ids)
+        scores = {}
+        for term in set(tokenize(query)):
+            plist = self.postings.get(term)
+            if not plist:
+                continue
+            idf = math.log(1 + (count - len(plist) + 0.5) / (len(plist) + 0.5))
+            for position, tf in plist:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[position] / self.avg_length)
+                scores[position] = scores.get(position, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        top = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.doc_ids[position], score) for position, score in top]
+
+
+def load_bm25(vectorstore, index_dir):
+    """BM25 index saved next to the FAISS index, or built from the docstore for older layouts"""
+    path = os.path.join(index_dir, BM25_FILE)
+    if os.path.exists(path):
+        return BM25Index.load(path)
+    logger.info("No saved BM25 index, building it from the docstore")
+    return BM25Index.from_vectorstore(vectorstore)
+
+
+def reciprocal_rank_fusion(rankings, rrf_k=HYBRID_RRF_K):
+    """Fuse ranked lists of keys; returns keys by descending RRF score"""
+    scores = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class CrossEncoderReranker:
+    """Local cross-encoder that gives up (keeping the fused order) past its latency budget
+
+    Work abandoned at the deadline is cancelled if it has not started, and
+    skipped by the worker if it starts late; at most max_pending reranks are
+    queued, so a slow model cannot build an unbounded backlog.
+    """
+
+    def __init__(self, model_name, budget_ms=HYBRID_RERANK_BUDGET_MS, max_pending=HYBRID_RERANK_MAX_PENDING):
+        from sentence_transformers import CrossEncoder
+
+        self.model = CrossEncoder(model_name, device="cpu")
+        self.budget = budget_ms / 1000.0
+        self.max_pending = max_pending
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reranker")
+
+    def _predict(self, pairs, deadline):
+        try:
+            if time.perf_counter() >= deadline:
+                return None
+            return self.model.predict(pairs)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def rerank(self, query, docs):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                rerank_outcomes.inc(result="overloaded")
+                return docs
+            self._pending += 1
+        deadline = time.perf_counter() + self.budget
+        future = self._executor.submit(self._predict, [(query, doc.page_content) for doc in docs], deadline)
+        try:
+            scores = future.result(timeout=self.budget)
+        except FutureTimeoutError:
+            if future.cancel():
+                with self._lock:
+                    self._pending -= 1
+            rerank_outcomes.inc(result="timeout")
+            return docs
+        if scores is None:
+            rerank_outcomes.inc(result="timeout")
+            return docs
+        rerank_outcomes.inc(result="ok")
+        return [doc for _, doc in sorted(zip(scores, docs), key=lambda pair: pair[0], reverse=True)]
+
+
+class HybridRetriever(BaseRetriever):
+    """Dense FAISS search plus BM25, fused with reciprocal rank fusion and optionally reranked"""
+    vectorstore: Any
+    bm25: Any
+    k: int = 5
+    fetch_k: int = HYBRID_FETCH_K
+    rrf_k: int = HYBRID_RRF_K
+    reranker: Optional[Any] = None
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        started = time.perf_counter()
+        vector = self.vectorstore.embeddings.embed_query(query)
+        embedded = time.perf_counter()
+        dense = self.vectorstore.similarity_search_by_vector(vector, k=self.fetch_k)
+        return self._fuse(query, dense, started, embedded)
+
+    async def _aget_relevant_documents(self, query, *, run_manager):
+        started = time.perf_counter()
+        vector = await self.vectorstore.embeddings.aembed_query(query)
+        embedded = time.perf_counter()
+        dense = await self.vectorstore.asimilarity_search_by_vector(vector, k=self.fetch_k)
+        return self._fuse(query, dense, started, embedded)
+
+    def _fuse(self, query, dense, started, embedded):
+        dense_done = time.perf_counter()
+        retrieval_stage_seconds.observe(dense_done - started, stage="dense")
+        record_stage("chat", "embedding", embedded - started)
+        record_stage("chat", "faiss_search", dense_done - embedded)
+
+        lexical_ids = [doc_id for doc_id, _ in self.bm25.search(query, self.fetch_k)]
+        lexical = [doc for doc in (self.vectorstore.docstore.search(doc_id) for doc_id in lexical_ids)
+                   if not isinstance(doc, str)]
+        lexical_done = time.perf_counter()
+        _record_stage("bm25", lexical_done - dense_done)
+
+        by_key = {}
+        for doc in dense + lexical:
+            by_key.setdefault(document_key(doc), doc)
+        fused = reciprocal_rank_fusion(
+            [[document_key(doc) for doc in dense], [document_key(doc) for doc in lexical]], self.rrf_k
+        )
+        docs = [by_key[key] for key in fused]
+        _record_stage("fusion", time.perf_counter() - lexical_done)
+
+        if self.reranker is not None and len(docs) > 1:
+            rerank_started = time.perf_counter()
+            docs = self.reranker.rerank(query, docs[:self.fetch_k])
+            _record_stage("rerank", time.perf_counter() - rerank_started)
+        return docs[:self.k]
+
+
+def _record_stage(stage, seconds):
+    retrieval_stage_seconds.observe(seconds, stage=stage)
+    record_stage("chat", stage, seconds)
+
+
+_reranker = None
+
+
+def get_reranker():
+    """Shared reranker instance, or None when HYBRID_RERANKER is unset or fails to load"""
+    global _reranker
+    if _reranker is None and HYBRID_RERANKER:
+        try:
+            _reranker = CrossEncoderReranker(HYBRID_RERANKER)
+            logger.info(f"Loaded reranker '{HYBRID_RERANKER}'")
+        except Exception as e:
+            logger.error(f"Failed to load reranker '{HYBRID_RERANKER}', continuing without it: {str(e)}")
+            return None
+    return _reranker
+
+
+def create_retriever(vectorstore, index_dir, k=5):
+    """The chain's retriever: hybrid when HYBRID_RETRIEVAL is on, otherwise plain dense search"""
+    if not HYBRID_RETRIEVAL:
+        return vectorstore.as_retriever(search_kwargs={"k": k})
+    return HybridRetriever(vectorstore=vectorstore, bm25=load_bm25(vectorstore, index_dir), k=k,
+                           reranker=get_reranker())
+
+
+def known_item_queries(bm25, vectorstore, count, seed=0):
+    """Synthetic eval set: a term window from a chunk, preferring chunks with numbers or doses"""
+    rng = random.Random(seed)
+    texts = {doc_id: vectorstore.docstore.search(doc_id).page_content for doc_id in bm25.doc_ids}
+    doc_ids = list(texts)
+    rng.shuffle(doc_ids)
+    # Exact numbers and dosages are what dense search tends to miss
+    doc_ids.sort(key=lambda doc_id: not any(ch.isdigit() for ch in texts[doc_id]))
+    queries = []
+    for doc_id in doc_ids[:count]:
+        words = texts[doc_id].split()
+        if len(words) < 12:
+            continue
+        start = rng.randrange(0, len(words) - 8)
+        queries.append({"question": " ".join(words[start:start + 8]), "doc_id": doc_id})
+    return queries
+
+
+def evaluate(retrievers, vectorstore, questions, k=5):
+    """Hit rate@k and mean/p95 latency per retriever
+
+    Each question has either 'doc_id' (the chunk that must be retrieved) or
+    'expected' (text that must appear in one of the retrieved chunks).
+    """
+    report = {}
+    for name, retriever in retrievers.items():
+        hits, latencies = 0, []
+        for item in questions:
+            started = time.perf_counter()
+            docs = retriever.invoke(item["question"])[:k]
+            latencies.append((time.perf_counter() - started) * 1000)
+            if "doc_id" in item:
+                target = document_key(vectorstore.docstore.search(item["doc_id"]))
+                hits += any(document_key(doc) == target for doc in docs)
+            else:
+                hits += any(item["expected"].lower() in doc.page_content.lower() for doc in docs)
+        latencies.sort()
+        report[name] = {
+            f"hit_rate@{k}": round(hits / len(questions), 4) if questions else None,
+            "mean_ms": round(sum(latencies) / len(latencies), 2) if latencies else None,
+            "p95_ms": round(latencies[int(len(latencies) * 0.95)], 2) if latencies else None,
+        }
+    return report
+
+
+class _BM25Only(BaseRetriever):
+    vectorstore: Any
+    bm25: Any
+    k: int = 5
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        return [self.vectorstore.docstore.search(doc_id) for doc_id, _ in self.bm25.search(query, self.k)]
+
+
+if __name__ == "__main__":
+    from embedding import load_embeddings, resolve_index_path
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Offline hit-rate and latency eval: dense vs. BM25 vs. hybrid")
+    parser.add_argument("--questions", help="JSONL with 'question' and 'expected' or 'doc_id' per line")
+    parser.add_argument("--synthetic", type=int, default=50, help="known-item queries to generate without --questions")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--reranker", default=HYBRID_RERANKER, help="cross-encoder model for the reranked variant")
+    args = parser.parse_args()
+
+    vectorstore = load_embeddings()
+    bm25 = load_bm25(vectorstore, resolve_index_path())
+    if args.questions:
+        with open(args.questions) as f:
+            questions = [json.loads(line) for line in f if line.strip()]
+    else:
+        questions = known_item_queries(bm25, vectorstore, args.synthetic)
+
+    retrievers = {
+        "dense": vectorstore.as_retriever(search_kwargs={"k": args.k}),
+        "bm25": _BM25Only(vectorstore=vectorstore, bm25=bm25, k=args.k),
+        "hybrid": HybridRetriever(vectorstore=vectorstore, bm25=bm25, k=args.k),
+    }
+    if args.reranker:
+        retrievers["hybrid+rerank"] = HybridRetriever(
+            vectorstore=vectorstore, bm25=bm25, k=args.k, reranker=CrossEncoderReranker(args.reranker)
+        )
+
+    print(f"{len(questions)} questions")
+    for name, result in evaluate(retrievers, vectorstore, questions, args.k).items():
+        print(f"{name:<14} " + "  ".join(f"{key}={value}" for key, value in result.items()))
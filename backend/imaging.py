@@ -0,0 +1,127 @@
+import io
+import os
+import base64
+import threading
+import numpy as np
+import cv2
+from PIL import Image
+from tracing import span
+from heatmaps import HEATMAP_FORMAT, HEATMAP_QUALITY, HEATMAP_FORMATS
+
+# Model input geometry and ImageNet normalization
+INPUT_SIZE = 224
+MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+# x_norm = x_uint8 * SCALE - OFFSET folds ToTensor() and Normalize() into one step
+SCALE = (1.0 / (255.0 * STD)).reshape(3, 1, 1)
+OFFSET = (MEAN / STD).reshape(3, 1, 1)
+
+# Heatmap overlay and encoding
+OVERLAY_MAX_SIDE = int(os.getenv("OVERLAY_MAX_SIDE", "512"))
+
+# Images are never decoded above this size; it covers both the model input and the overlay
+DECODE_MAX_SIDE = max(OVERLAY_MAX_SIDE, INPUT_SIZE)
+
+_buffers = threading.local()
+
+
+def _resize_buffer():
+    """Per-thread scratch buffer for the model-sized uint8 resize"""
+    buf = getattr(_buffers, "resize", None)
+    if buf is None:
+        buf = _buffers.resize = np.empty((INPUT_SIZE, INPUT_SIZE, 3), dtype=np.uint8)
+    return buf
+
+
+def decode_image(image_bytes, max_side=DECODE_MAX_SIDE):
+    """Decode uploaded bytes once into an RGB uint8 array no larger than max_side"""
+    img = Image.open(io.BytesIO(image_bytes))
+    # Let the JPEG decoder scale down in the DCT domain instead of decoding full resolution
+    img.draft("RGB", (max_side, max_side))
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    if max(img.size) > max_side:
+        scale = max_side / max(img.size)
+        img = img.resize(
+            (max(1, round(img.size[0] * scale)), max(1, round(img.size[1] * scale))),
+            Image.BILINEAR, reducing_gap=2.0,
+        )
+    return np.asarray(img)
+
+
+def to_model_input(rgb, out=None):
+    """Resize and normalize an RGB array into a (3, H, W) float32 array in one pass
+
+    Writes into `out` when given (e.g. a slice of a pre-allocated batch tensor).
+    """
+    resized = cv2.resize(rgb, (INPUT_SIZE, INPUT_SIZE), dst=_resize_buffer(), interpolation=cv2.INTER_AREA)
+    if out is None:
+        out = np.empty((3, INPUT_SIZE, INPUT_SIZE), dtype=np.float32)
+    np.multiply(resized.transpose(2, 0, 1), SCALE, out=out)
+    np.subtract(out, OFFSET, out=out)
+    return out
+
+
+def bounded_size(width, height, max_side=OVERLAY_MAX_SIDE):
+    if max(width, height) <= max_side:
+        return width, height
+    scale = max_side / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def overlay_heatmap(heatmap, rgb, alpha=0.5, max_side=OVERLAY_MAX_SIDE):
+    """Blend a [0, 1] heatmap over the image at bounded resolution; returns BGR uint8"""
+    height, width = rgb.shape[:2]
+    size = bounded_size(width, height, max_side)
+    if size != (width, height):
+        rgb = cv2.resize(rgb, size, interpolation=cv2.INTER_AREA)
+
+    heat = cv2.resize(heatmap.astype(np.float32, copy=False), size, interpolation=cv2.INTER_LINEAR)
+    heat = cv2.applyColorMap(cv2.convertScaleAbs(heat, alpha=255.0), cv2.COLORMAP_JET)
+
+    # Single colour conversion; the blend and the encoder both work in BGR
+    bgr = cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+    return cv2.addWeighted(bgr, 1 - alpha, heat, alpha, 0.0, dst=bgr)
+
+
+def encode_bgr(bgr, fmt=HEATMAP_FORMAT, quality=HEATMAP_QUALITY):
+    """Encode a BGR image as png/jpeg/webp bytes"""
+    if fmt == "jpeg":
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    elif fmt == "webp":
+        params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+    else:
+        params = [cv2.IMWRITE_PNG_COMPRESSION, 3]
+    ok, encoded = cv2.imencode(f".{'jpg' if fmt == 'jpeg' else fmt}", bgr, params)
+    if not ok:
+        raise ValueError(f"Failed to encode heatmap as {fmt}")
+    return encoded.tobytes()
+
+
+def render_heatmap(heatmap, rgb, fmt=HEATMAP_FORMAT, quality=HEATMAP_QUALITY):
+    """Build the heatmap fields of a prediction response
+
+    'raw' returns the CAM itself as a base64 uint8 grid (row-major, gradcam_shape),
+    leaving colouring and overlay to the client.
+    """
+    if fmt not in HEATMAP_FORMATS:
+        raise ValueError(f"Unsupported heatmap format '{fmt}', expected one of {HEATMAP_FORMATS}")
+
+    if fmt == "raw":
+        with span("vision", "encode"):
+            grid = np.clip(heatmap * 255.0, 0, 255).astype(np.uint8)
+        return {
+            "gradcam_heatmap": base64.b64encode(grid.tobytes()).decode("utf-8"),
+            "gradcam_format": "raw",
+            "gradcam_shape": list(grid.shape),
+        }
+
+    with span("vision", "overlay"):
+        overlay = overlay_heatmap(heatmap, rgb)
+    with span("vision", "encode"):
+        encoded = encode_bgr(overlay, fmt, quality)
+    return {
+        "gradcam_heatmap": base64.b64encode(encoded).decode("utf-8"),
+        "gradcam_format": fmt,
+    }
@@ -0,0 +1,150 @@
+import os
+import time
+import logging
+import threading
+from typing import Any
+from langchain_core.retrievers import BaseRetriever
+from embedding import load_embeddings, index_fingerprint
+from metrics import counter, gauge
+
+logger = logging.getLogger(__name__)
+
+INDEX_WATCH_INTERVAL = float(os.getenv("INDEX_WATCH_INTERVAL", "30"))     # seconds; 0 disables the watcher
+INDEX_RELOAD_PROBE = os.getenv("INDEX_RELOAD_PROBE", "What is PCOS?")
+
+index_reloads = counter("index_reloads_total", "FAISS index reload attempts by outcome", ["result"])
+index_vectors = gauge("index_vectors", "Vectors in the FAISS index currently serving queries")
+index_loaded_at = gauge("index_loaded_timestamp_seconds", "Unix time the serving FAISS index was loaded")
+
+
+class IndexValidationError(Exception):
+    pass
+
+
+class SwappableRetriever(BaseRetriever):
+    """Retriever that delegates to a replaceable inner retriever
+
+    Each call reads the inner retriever once, so a request that has started
+    keeps using the index it began with while new requests see the new one.
+    """
+    retriever: Any
+
+    def swap(self, retriever):
+        previous, self.retriever = self.retriever, retriever
+        return previous
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        return self.retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+
+    async def _aget_relevant_documents(self, query, *, run_manager):
+        return await self.retriever.ainvoke(query, config={"callbacks": run_manager.get_child()})
+
+
+def validate_vectorstore(vectorstore, probe=INDEX_RELOAD_PROBE):
+    """Reject empty or dimension-mismatched indexes and ones that cannot answer a probe query"""
+    index = vectorstore.index
+    if index.ntotal == 0:
+        raise IndexValidationError("index is empty")
+    dimension = len(vectorstore.embeddings.embed_query(probe))
+    if dimension != index.d:
+        raise IndexValidationError(f"index dimension {index.d} does not match embedding dimension {dimension}")
+    if not vectorstore.similarity_search(probe, k=1):
+        raise IndexValidationError("probe query returned no documents")
+
+
+class IndexReloader:
+    """Loads a rebuilt FAISS index in the background and swaps it into the retriever
+
+    reload() can be triggered by the admin endpoint or by the watcher thread,
+    which polls index_fingerprint() every INDEX_WATCH_INTERVAL seconds.
+    """
+
+    def __init__(self, retriever, vectorstore, make_retriever, on_swap=()):
+        self.retriever = retriever
+        self.vectorstore = vectorstore
+        self.make_retriever = make_retriever
+        self.on_swap = list(on_swap)
+        self.fingerprint = index_fingerprint()
+        self._failed_fingerprint = None
+        self._reload_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._watcher = None
+        self.last_result = None
+        self._record(vectorstore)
+
+    def _record(self, vectorstore):
+        index_vectors.set(vectorstore.index.ntotal)
+        index_loaded_at.set(time.time())
+
+    def reload(self, force=False):
+        """Load, validate and swap the index; returns a status dict"""
+        if not self._reload_lock.acquire(blocking=False):
+            return {"status": "in_progress"}
+        try:
+            fingerprint = index_fingerprint()
+            if fingerprint is None:
+                index_reloads.inc(result="missing")
+                return self._result("error", error="FAISS index not found")
+            if not force and fingerprint == self.fingerprint:
+                index_reloads.inc(result="unchanged")
+                return self._result("unchanged")
+
+            started = time.perf_counter()
+            # Reuse the live embedder so its query cache and batcher carry over
+            vectorstore = load_embeddings(embeddings=self.vectorstore.embeddings)
+            if vectorstore is None:
+                raise IndexValidationError("index failed to load")
+            validate_vectorstore(vectorstore)
+
+            self.retriever.swap(self.make_retriever(vectorstore))
+            self.vectorstore = vectorstore
+            self.fingerprint = fingerprint
+            self._failed_fingerprint = None
+            self._record(vectorstore)
+            for callback in self.on_swap:
+                callback()
+
+            index_reloads.inc(result="ok")
+            elapsed = time.perf_counter() - started
+            logger.info(f"FAISS index reloaded ({vectorstore.index.ntotal} vectors) in {elapsed:.2f}s")
+            return self._result("reloaded", vectors=vectorstore.index.ntotal, seconds=round(elapsed, 2))
+
+        except Exception as e:
+            self._failed_fingerprint = fingerprint
+            index_reloads.inc(result="error")
+            logger.error(f"FAISS index reload failed, keeping the current index: {str(e)}")
+            return self._result("error", error=str(e))
+        finally:
+            self._reload_lock.release()
+
+    def reload_async(self, force=False):
+        threading.Thread(target=self.reload, kwargs={"force": force}, name="index-reload", daemon=True).start()
+
+    def _result(self, status, **details):
+        self.last_result = {"status": status, "at": time.time(), **details}
+        return self.last_result
+
+    def start_watcher(self, interval=INDEX_WATCH_INTERVAL):
+        if interval <= 0 or self._watcher is not None:
+            return
+        self._watcher = threading.Thread(target=self._watch, args=(interval,), name="index-watcher", daemon=True)
+        self._watcher.start()
+        logger.info(f"Watching FAISS index for changes every {interval:.0f}s")
+
+    def stop(self):
+        self._stopped.set()
+
+    def _watch(self, interval):
+        while not self._stopped.wait(interval):
+            fingerprint = index_fingerprint()
+            # A build that failed validation is not retried until the files change again
+            if fingerprint is not None and fingerprint not in (self.fingerprint, self._failed_fingerprint):
+                logger.info("FAISS index change detected, reloading")
+                self.reload()
+
+    def status(self):
+        return {
+            "vectors": self.vectorstore.index.ntotal,
+            "fingerprint_changed": index_fingerprint() != self.fingerprint,
+            "last_reload": self.last_result,
+        }
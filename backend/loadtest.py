@@ -0,0 +1,133 @@
+"""Concurrent /chat SSE load test
+
+Compare the threaded Flask server against the ASGI app:
+
+    python inference.py                               # threaded, port 4933
+    uvicorn asgi_app:app --port 4934                  # async
+    python loadtest.py --url http://localhost:4933 --concurrency 200
+    python loadtest.py --url http://localhost:4934 --concurrency 200
+
+--expect-streams N exits non-zero unless at least N streams were open at the
+same moment and every request succeeded, e.g. to check that the ASGI app
+holds more chat streams than the LLM upstream's old 32-slot limit:
+
+    python loadtest.py --url http://localhost:4934 --concurrency 200 --expect-streams 100
+"""
+import time
+import uuid
+import json
+import asyncio
+import argparse
+import httpx
+
+
+class OpenStreams:
+    """Counts /chat responses currently being read, and the most at once"""
+
+    def __init__(self):
+        self.open = 0
+        self.peak = 0
+
+    def enter(self):
+        self.open += 1
+        self.peak = max(self.peak, self.open)
+
+    def exit(self):
+        self.open -= 1
+
+DEFAULT_QUESTIONS = (
+    "What are the common symptoms of PCOS?",
+    "How is PCOS diagnosed?",
+    "Which lifestyle changes help manage insulin resistance in PCOS?",
+)
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+async def one_stream(client, url, question, streams):
+    """Run one /chat request; returns (first_chunk_s, total_s, error)"""
+    start = time.perf_counter()
+    first_chunk = None
+    try:
+        async with client.stream("POST", f"{url}/chat", data={"input": question, "session_id": str(uuid.uuid4())}) as response:
+            if response.status_code != 200:
+                return None, time.perf_counter() - start, f"http {response.status_code}"
+            streams.enter()
+            try:
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    event = json.loads(line[6:])
+                    if event.get("type") == "chunk" and first_chunk is None:
+                        first_chunk = time.perf_counter() - start
+                    elif event.get("type") == "error":
+                        return first_chunk, time.perf_counter() - start, event.get("error", "error")
+                    elif event.get("type") == "complete":
+                        break
+            finally:
+                streams.exit()
+        return first_chunk, time.perf_counter() - start, None
+    except httpx.HTTPError as e:
+        return first_chunk, time.perf_counter() - start, type(e).__name__
+
+
+async def run(url, concurrency, requests, questions, timeout):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    results = []
+    pending = iter(range(requests))
+    streams = OpenStreams()
+
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        async def worker():
+            for i in pending:
+                results.append(await one_stream(client, url, questions[i % len(questions)], streams))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    errors = {}
+    for _, _, error in results:
+        if error:
+            errors[error] = errors.get(error, 0) + 1
+    first = [r[0] for r in results if r[0] is not None and not r[2]]
+    total = [r[1] for r in results if not r[2]]
+    return {
+        "requests": len(results),
+        "ok": len(total),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(len(results) / elapsed, 2) if elapsed else None,
+        "peak_open_streams": streams.peak,
+        "first_chunk_s": {f"p{q}": percentile(first, q) for q in (50, 95, 99)},
+        "total_s": {f"p{q}": percentile(total, q) for q in (50, 95, 99)},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Open concurrent /chat SSE streams and report latency percentiles")
+    parser.add_argument("--url", default="http://localhost:4933")
+    parser.add_argument("--concurrency", type=int, default=100, help="streams held open at once")
+    parser.add_argument("--requests", type=int, default=None, help="total requests (default: 2 x concurrency)")
+    parser.add_argument("--question", action="append", help="question to ask (repeatable)")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--expect-streams", type=int, default=0,
+                        help="fail unless this many streams were open at once and no request failed")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(
+        args.url.rstrip("/"), args.concurrency, args.requests or 2 * args.concurrency,
+        tuple(args.question or DEFAULT_QUESTIONS), args.timeout,
+    ))
+    print(json.dumps(report, indent=2))
+    if args.expect_streams:
+        if report["errors"] or report["peak_open_streams"] < args.expect_streams:
+            raise SystemExit(f"FAIL: {report['peak_open_streams']} streams open at once "
+                             f"(expected {args.expect_streams}), errors {report['errors']}")
+        print(f"OK: {report['peak_open_streams']} streams open at once, no errors")
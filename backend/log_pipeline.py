@@ -0,0 +1,279 @@
+import os
+import gzip
+import json
+import time
+import queue
+import atexit
+import shutil
+import hashlib
+import logging
+import argparse
+import tempfile
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+from metrics import counter, gauge
+from tracing import RequestIdFilter
+
+# Records are queued on the request thread and written by one listener thread
+LOG_DIR = os.getenv("LOG_DIR", "logs")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()            # json | text (files; the console is always text)
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))      # records buffered before new ones are dropped
+
+# Rotation: by size, or by time when LOG_ROTATE_WHEN is set (e.g. "midnight", "H")
+LOG_ROTATE_BYTES = int(os.getenv("LOG_ROTATE_BYTES", str(50 * 1024 * 1024)))
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "")
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "10"))
+LOG_COMPRESS = os.getenv("LOG_COMPRESS", "true").lower() in ("1", "true", "yes", "on")
+
+# Chat transcripts: fraction of sessions logged, and the longest message kept
+CHAT_LOG_SAMPLE_RATE = float(os.getenv("CHAT_LOG_SAMPLE_RATE", "1.0"))
+CHAT_LOG_MAX_CHARS = int(os.getenv("CHAT_LOG_MAX_CHARS", "2000"))
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(funcName)s:%(lineno)d - %(message)s'
+CHAT_TEXT_FORMAT = '%(asctime)s - CHAT - [%(request_id)s] %(message)s'
+
+records_dropped = counter(
+    "log_records_dropped_total", "Log records dropped because the log queue was full", ["level"],
+)
+records_sampled_out = counter(
+    "log_records_sampled_out_total", "Chat transcript records skipped by sampling", ["logger"],
+)
+queue_depth = gauge("log_queue_depth", "Log records waiting to be written")
+
+# LogRecord attributes that are not user-supplied extras
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: timestamp, level, logger, request ID, message, extras and traceback"""
+
+    def format(self, record):
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+            "func": record.funcName,
+            "line": record.lineno,
+            "thread": record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key not in payload:
+                payload[key] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload["exc"] = record.exc_text
+        if record.stack_info:
+            payload["stack"] = record.stack_info
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class ChatTranscriptFilter(logging.Filter):
+    """Samples chat transcripts per session and truncates long messages
+
+    Sampling hashes the record's session_id so a session is either logged in
+    full or not at all; warnings and errors are always kept.
+    """
+
+    def __init__(self, sample_rate=CHAT_LOG_SAMPLE_RATE, max_chars=CHAT_LOG_MAX_CHARS):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.max_chars = max_chars
+
+    def sampled(self, session_id):
+        if self.sample_rate >= 1 or session_id is None:
+            return True
+        digest = hashlib.blake2b(str(session_id).encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "big") / 2 ** 64 < self.sample_rate
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING and not self.sampled(getattr(record, "session_id", None)):
+            records_sampled_out.inc(logger=record.name)
+            return False
+        message = record.getMessage()
+        if self.max_chars and len(message) > self.max_chars:
+            record.msg = f"{message[:self.max_chars]}... [{len(message) - self.max_chars} chars truncated]"
+            record.args = None
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler that never waits: a full queue drops the record and counts it
+
+    The request ID is resolved here, on the request thread, because the
+    listener thread has no request context.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.addFilter(RequestIdFilter())
+
+    def prepare(self, record):
+        # Merge args now (they may be mutated later); the traceback is formatted by the listener
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            records_dropped.inc(level=record.levelname)
+
+
+class _Listener(QueueListener):
+    def enqueue_sentinel(self):
+        # The queue may be full; wait for room rather than fail to stop
+        self.queue.put(self._sentinel)
+
+    def dequeue(self, block):
+        record = self.queue.get(block)
+        queue_depth.set(self.queue.qsize())
+        return record
+
+
+def _gzip_rotator(source, dest):
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+def rotating_file_handler(path, level=logging.INFO, fmt=TEXT_FORMAT):
+    """File handler rotated by size (or by LOG_ROTATE_WHEN) with gzip-compressed backups"""
+    if LOG_ROTATE_WHEN:
+        handler = TimedRotatingFileHandler(path, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+    else:
+        handler = RotatingFileHandler(path, maxBytes=LOG_ROTATE_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+    if LOG_COMPRESS:
+        handler.namer = lambda name: name + ".gz"
+        handler.rotator = _gzip_rotator
+    handler.setLevel(level)
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(fmt))
+    return handler
+
+
+class LogPipeline:
+    """Bounded queue in front of the real handlers, drained by a single writer thread"""
+
+    def __init__(self, handlers, maxsize=LOG_QUEUE_SIZE):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.handler = NonBlockingQueueHandler(self.queue)
+        self.listener = _Listener(self.queue, *handlers, respect_handler_level=True)
+        self._started = False
+
+    def start(self):
+        if not self._started:
+            self.listener.start()
+            self._started = True
+            atexit.register(self.stop)
+
+    def stop(self):
+        """Flush queued records and stop the writer thread"""
+        if self._started:
+            self._started = False
+            self.listener.stop()
+            for handler in self.listener.handlers:
+                handler.close()
+
+
+def configure_logging(log_dir=LOG_DIR):
+    """Route the root and chat loggers through a LogPipeline; returns (root_logger, chat_logger, pipeline)
+
+    Writes app.log (INFO+), errors.log (ERROR+) and chat.log (chat transcripts)
+    under log_dir, plus text to the console.
+    """
+    os.makedirs(log_dir, exist_ok=True)
+
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.INFO)
+    console_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    file_handler = rotating_file_handler(os.path.join(log_dir, 'app.log'))
+    error_handler = rotating_file_handler(os.path.join(log_dir, 'errors.log'), level=logging.ERROR)
+
+    chat_handler = rotating_file_handler(os.path.join(log_dir, 'chat.log'), fmt=CHAT_TEXT_FORMAT)
+    chat_handler.addFilter(logging.Filter('chat'))
+
+    pipeline = LogPipeline([console_handler, file_handler, error_handler, chat_handler])
+
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+    root_logger.addHandler(pipeline.handler)
+
+    # Chat records propagate to the root queue handler; chat.log picks them out by name
+    chat_logger = logging.getLogger('chat')
+    chat_logger.setLevel(logging.INFO)
+    chat_logger.addFilter(ChatTranscriptFilter())
+
+    pipeline.start()
+    return root_logger, chat_logger, pipeline
+
+
+class _SlowHandler(logging.Handler):
+    """Wraps a handler and adds a fixed delay per record, like a slow or contended disk"""
+
+    def __init__(self, inner, delay_ms):
+        super().__init__(inner.level)
+        self.inner = inner
+        self.delay = delay_ms / 1000
+
+    def emit(self, record):
+        time.sleep(self.delay)
+        self.inner.emit(record)
+
+    def close(self):
+        self.inner.close()
+        super().close()
+
+
+def benchmark(records=2000, delay_ms=0.2, message_chars=1500):
+    """Per-call latency of logger.info with a synchronous file handler vs the queued pipeline"""
+    message = "x" * message_chars
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ("sync", "queued"):
+            inner = rotating_file_handler(os.path.join(tmp, f"{mode}.log"))
+            handler = _SlowHandler(inner, delay_ms)
+            bench_logger = logging.getLogger(f"log_pipeline.bench.{mode}")
+            bench_logger.propagate = False
+            bench_logger.setLevel(logging.INFO)
+            pipeline = None
+            if mode == "sync":
+                handler.addFilter(RequestIdFilter())
+                bench_logger.addHandler(handler)
+            else:
+                pipeline = LogPipeline([handler], maxsize=records * 2)
+                pipeline.start()
+                bench_logger.addHandler(pipeline.handler)
+
+            latencies = []
+            for i in range(records):
+                started = time.perf_counter()
+                bench_logger.info("SESSION: %s | BOT: %s", i, message)
+                latencies.append(time.perf_counter() - started)
+            drain_started = time.perf_counter()
+            if pipeline is not None:
+                pipeline.stop()
+            else:
+                handler.close()
+            latencies.sort()
+            results[mode] = {
+                "p50_us": round(latencies[len(latencies) // 2] * 1e6, 1),
+                "p99_us": round(latencies[int(len(latencies) * 0.99)] * 1e6, 1),
+                "drain_ms": round((time.perf_counter() - drain_started) * 1000, 1),
+            }
+            bench_logger.handlers.clear()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark synchronous vs queued logging")
+    parser.add_argument("--records", type=int, default=2000)
+    parser.add_argument("--delay-ms", type=float, default=0.2, help="simulated per-record disk latency")
+    parser.add_argument("--message-chars", type=int, default=1500)
+    args = parser.parse_args()
+    for mode, stats in benchmark(args.records, args.delay_ms, args.message_chars).items():
+        print(f"{mode:>7}: p50 {stats['p50_us']}us  p99 {stats['p99_us']}us  drain {stats['drain_ms']}ms")
@@ -0,0 +1,133 @@
+import os
+import re
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableLambda
+from metrics import counter
+from tracing import annotate
+
+logger = logging.getLogger(__name__)
+
+REWRITE_CACHE_SIZE = int(os.getenv("REWRITE_CACHE_SIZE", "1024"))
+REWRITE_HISTORY_MESSAGES = int(os.getenv("REWRITE_HISTORY_MESSAGES", "4"))
+
+rewrite_paths = counter(
+    "chat_rewrite_path_total", "How the standalone retrieval query was produced", ["path"]
+)
+
+# Words that usually point back into the conversation
+REFERENTIAL_WORDS = {
+    "it", "its", "it's", "they", "them", "their", "theirs", "this", "that", "these", "those",
+    "he", "she", "him", "her", "hers", "there", "one", "ones", "former", "latter",
+    "same", "above", "previous", "earlier", "mentioned", "said", "else", "more", "another",
+    "other", "again", "also", "too", "instead",
+}
+FOLLOW_UP_PREFIXES = (
+    "and ", "but ", "so ", "or ", "what about", "how about", "why", "how so", "really",
+    "tell me more", "explain", "elaborate", "can you expand", "what else", "ok", "okay",
+)
+MIN_SELF_CONTAINED_WORDS = 3
+WORD_PATTERN = re.compile(r"[a-z']+")
+
+
+def is_self_contained(question):
+    """Cheap check for questions that can be retrieved on without the chat history
+
+    Conservative: anything short, non-English or containing a referential word
+    goes through the LLM rewrite.
+    """
+    text = question.strip().lower()
+    if not text or not text.isascii():
+        return False
+    if text.startswith(FOLLOW_UP_PREFIXES):
+        return False
+    words = WORD_PATTERN.findall(text)
+    if len(words) < MIN_SELF_CONTAINED_WORDS:
+        return False
+    return not any(word in REFERENTIAL_WORDS for word in words)
+
+
+class RewriteCache:
+    """Thread-safe LRU of standalone questions keyed on (recent history, input)"""
+
+    def __init__(self, max_entries=REWRITE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def key(history, question):
+        digest = hashlib.sha256()
+        for message in history[-REWRITE_HISTORY_MESSAGES:]:
+            digest.update(f"{message.type}:{message.content}\x00".encode("utf-8"))
+        digest.update(question.strip().lower().encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def create_fast_history_aware_retriever(llm, retriever, prompt, cache=None):
+    """Drop-in replacement for create_history_aware_retriever with a fast path
+
+    The LLM rewrite only runs when there is history, the question does not look
+    self-contained and the rewrite is not already cached. The path taken is
+    recorded on the request trace as 'rewrite_path'.
+    """
+    cache = cache if cache is not None else RewriteCache()
+    rewrite_chain = prompt | llm | StrOutputParser()
+
+    def plan(inputs):
+        """Returns (path, query, cache key); query is None when a rewrite is needed"""
+        question = inputs["input"]
+        history = inputs.get("chat_history") or []
+
+        if not history:
+            return "no_history", question, None
+        if is_self_contained(question):
+            return "self_contained", question, None
+        key = cache.key(history, question)
+        query = cache.get(key)
+        if query is not None:
+            return "cache", query, key
+        return "rewrite", None, key
+
+    def record(path, query):
+        rewrite_paths.inc(path=path)
+        annotate("rewrite_path", path)
+        annotate("standalone_question", query)
+        return query
+
+    def standalone_question(inputs, config):
+        path, query, key = plan(inputs)
+        if query is None:
+            query = rewrite_chain.invoke(inputs, config).strip() or inputs["input"]
+            cache.put(key, query)
+        return record(path, query)
+
+    async def astandalone_question(inputs, config):
+        path, query, key = plan(inputs)
+        if query is None:
+            query = (await rewrite_chain.ainvoke(inputs, config)).strip() or inputs["input"]
+            cache.put(key, query)
+        return record(path, query)
+
+    return (RunnableLambda(standalone_question, afunc=astandalone_question) | retriever).with_config(
+        run_name="chat_retriever_chain"
+    )
@@ -0,0 +1,175 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from metrics import counter, gauge
+
+logger = logging.getLogger(__name__)
+
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "256"))
+PREDICTION_CACHE_MAX_BYTES = int(os.getenv("PREDICTION_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+PREDICTION_CACHE_DIR = os.getenv("PREDICTION_CACHE_DIR", "")          # empty disables the disk tier
+PREDICTION_CACHE_DISK_MAX_BYTES = int(os.getenv("PREDICTION_CACHE_DISK_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+cache_requests = counter(
+    "prediction_cache_requests_total", "Prediction cache lookups by tier and outcome", ["tier", "result"]
+)
+cache_bytes = gauge("prediction_cache_bytes", "Bytes held by each prediction cache tier", ["tier"])
+cache_entries = gauge("prediction_cache_entries", "Entries held by each prediction cache tier", ["tier"])
+cache_evictions = counter("prediction_cache_evictions_total", "Entries evicted from each tier", ["tier"])
+
+
+def cache_key(image_bytes, model_version, **options):
+    """Content-addressed key: image hash + model version + response options"""
+    digest = hashlib.sha256(image_bytes)
+    digest.update(model_version.encode("utf-8"))
+    for name in sorted(options):
+        digest.update(f"|{name}={options[name]}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class PredictionCache:
+    """Two-tier (in-process LRU + optional on-disk) cache of /predict results
+
+    Values are the JSON-serializable response payloads (label, probability and
+    the encoded heatmap). Both tiers are bounded by size and evict least
+    recently used entries first.
+    """
+
+    def __init__(self, max_entries=PREDICTION_CACHE_SIZE, max_bytes=PREDICTION_CACHE_MAX_BYTES,
+                 disk_dir=PREDICTION_CACHE_DIR, disk_max_bytes=PREDICTION_CACHE_DISK_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir or None
+        self.disk_max_bytes = disk_max_bytes
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_lock = threading.Lock()
+        self._disk_bytes = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._disk_bytes = sum(size for _, _, size in self._disk_entries())
+            cache_bytes.set(self._disk_bytes, tier="disk")
+            logger.info(f"Prediction disk cache at '{self.disk_dir}' ({self._disk_bytes} bytes)")
+
+    def get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                cache_requests.inc(tier="memory", result="hit")
+                return entry[0]
+        cache_requests.inc(tier="memory", result="miss")
+
+        if not self.disk_dir:
+            return None
+
+        value = self._disk_get(key)
+        cache_requests.inc(tier="disk", result="miss" if value is None else "hit")
+        if value is not None:
+            self._memory_put(key, value, len(json.dumps(value)))
+        return value
+
+    def put(self, key, value):
+        payload = json.dumps(value)
+        self._memory_put(key, value, len(payload))
+        if self.disk_dir:
+            self._disk_put(key, payload)
+
+    def _memory_put(self, key, value, size):
+        if self.max_entries <= 0 or size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_bytes -= old[1]
+            self._memory[key] = (value, size)
+            self._memory_bytes += size
+            while len(self._memory) > self.max_entries or self._memory_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted_size
+                cache_evictions.inc(tier="memory")
+            cache_bytes.set(self._memory_bytes, tier="memory")
+            cache_entries.set(len(self._memory), tier="memory")
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _disk_entries(self):
+        """Yield (path, mtime, size) for every cached file"""
+        with os.scandir(self.disk_dir) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(".json"):
+                    stat = entry.stat()
+                    yield entry.path, stat.st_mtime, stat.st_size
+
+    def _disk_get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+            # mtime doubles as the LRU timestamp
+            os.utime(path, None)
+            return value
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Dropping unreadable prediction cache entry {key}: {str(e)}")
+            self._disk_remove(path)
+            return None
+
+    def _disk_put(self, key, payload):
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(payload)
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write prediction cache entry {key}: {str(e)}")
+            return
+
+        with self._disk_lock:
+            self._disk_bytes += len(payload) - previous
+            if self._disk_bytes > self.disk_max_bytes:
+                self._disk_evict()
+            cache_bytes.set(self._disk_bytes, tier="disk")
+
+    def _disk_remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self._disk_lock:
+            self._disk_bytes -= size
+
+    def _disk_evict(self):
+        # Called with _disk_lock held: drop oldest files until under 90% of the bound
+        target = int(self.disk_max_bytes * 0.9)
+        entries = sorted(self._disk_entries(), key=lambda e: e[1])
+        self._disk_bytes = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if self._disk_bytes <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._disk_bytes -= size
+            cache_evictions.inc(tier="disk")
+
+    def stats(self):
+        return {
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "disk_bytes": self._disk_bytes,
+            "memory_hits": cache_requests.value(tier="memory", result="hit"),
+            "disk_hits": cache_requests.value(tier="disk", result="hit"),
+            "misses": cache_requests.value(tier="disk" if self.disk_dir else "memory", result="miss"),
+        }
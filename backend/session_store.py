@@ -0,0 +1,425 @@
+import os
+import re
+import json
+import time
+import logging
+import sqlite3
+import threading
+import weakref
+from collections import OrderedDict
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from metrics import counter, gauge
+
+logger = logging.getLogger(__name__)
+
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")             # memory | sqlite | redis
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(6 * 60 * 60)))
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+SESSION_MAX_MESSAGES = int(os.getenv("SESSION_MAX_MESSAGES", "50"))
+SESSION_SQLITE_PATH = os.getenv("SESSION_SQLITE_PATH", "sessions.db")
+SESSION_REDIS_URL = os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0")
+
+# Roles used in chat_history payloads returned to the frontend
+USER_ROLE = "Customer"
+BOT_ROLE = "PITB"
+SYSTEM_ROLE = "System"
+
+THINK_TAG_PATTERN = re.compile(r"<think>.*?</think>", re.DOTALL)
+
+sessions_gauge = gauge("chat_sessions", "Chat sessions currently held by the session store", ["backend"])
+session_evictions = counter("chat_session_evictions_total", "Chat sessions evicted", ["backend", "reason"])
+
+
+def message_to_dict(message):
+    if isinstance(message, HumanMessage):
+        role = USER_ROLE
+    elif isinstance(message, SystemMessage):
+        role = SYSTEM_ROLE
+    else:
+        role = BOT_ROLE
+    content = message.content if isinstance(message.content, str) else str(message.content)
+    if role == BOT_ROLE:
+        # Only the actual response is kept, never the model's <think> content
+        content = THINK_TAG_PATTERN.sub("", content).strip()
+    return {"role": role, "content": content}
+
+
+def public_message(item):
+    """A stored message without bookkeeping fields such as "ts", as sent to clients"""
+    return {"role": item["role"], "content": item["content"]}
+
+
+def dict_to_message(item):
+    # Only role and content reach the prompt; bookkeeping fields stay in the store
+    if item["role"] == USER_ROLE:
+        return HumanMessage(content=item["content"])
+    if item["role"] == SYSTEM_ROLE:
+        return SystemMessage(content=item["content"])
+    return AIMessage(content=item["content"])
+
+
+class InMemoryBackend:
+    """Process-local sessions with TTL and LRU eviction"""
+    name = "memory"
+
+    def __init__(self, ttl_seconds, max_sessions):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()   # session_id -> (updated_at, messages, summary)
+
+    def _expired(self, updated_at, now):
+        return self.ttl_seconds > 0 and now - updated_at > self.ttl_seconds
+
+    def get(self, session_id):
+        now = time.time()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            if self._expired(entry[0], now):
+                del self._sessions[session_id]
+                session_evictions.inc(backend=self.name, reason="ttl")
+                return None
+            self._sessions.move_to_end(session_id)
+            return list(entry[1])
+
+    def create(self, session_id):
+        with self._lock:
+            if session_id not in self._sessions:
+                self._sessions[session_id] = (time.time(), [], None)
+            self._evict()
+
+    def append(self, session_id, messages, max_messages):
+        with self._lock:
+            _, existing, summary = self._sessions.pop(session_id, (None, [], None))
+            updated = (existing + messages)[-max_messages:] if max_messages > 0 else existing + messages
+            self._sessions[session_id] = (time.time(), updated, summary)
+            self._evict()
+
+    def get_summary(self, session_id):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            return None if entry is None else entry[2]
+
+    def set_summary(self, session_id, summary):
+        # Written in the background: neither refreshes the session nor recreates a deleted one
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                self._sessions[session_id] = (entry[0], entry[1], summary)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def _evict(self):
+        # Called with the lock held; most recently used sessions are at the end
+        now = time.time()
+        while self._sessions:
+            session_id, (updated_at, _, _) = next(iter(self._sessions.items()))
+            if self._expired(updated_at, now):
+                reason = "ttl"
+            elif self.max_sessions > 0 and len(self._sessions) > self.max_sessions:
+                reason = "lru"
+            else:
+                break
+            del self._sessions[session_id]
+            session_evictions.inc(backend=self.name, reason=reason)
+        sessions_gauge.set(len(self._sessions), backend=self.name)
+
+    def count(self):
+        with self._lock:
+            return len(self._sessions)
+
+
+class SQLiteBackend:
+    """Sessions persisted in SQLite so they survive restarts and are shared by local workers"""
+    name = "sqlite"
+
+    def __init__(self, path, ttl_seconds, max_sessions):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self._local = threading.local()
+        self._writes = 0
+        with self._transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, messages TEXT NOT NULL, updated_at REAL NOT NULL, summary TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(sessions)")}
+            if "summary" not in columns:
+                conn.execute("ALTER TABLE sessions ADD COLUMN summary TEXT")
+
+    def _conn(self):
+        # One autocommit connection per thread; WAL lets readers run alongside a writer
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        return _Transaction(self._conn())
+
+    def get(self, session_id):
+        row = self._conn().execute(
+            "SELECT messages, updated_at FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        if self.ttl_seconds > 0 and time.time() - row[1] > self.ttl_seconds:
+            self.delete(session_id)
+            session_evictions.inc(backend=self.name, reason="ttl")
+            return None
+        return json.loads(row[0])
+
+    def create(self, session_id):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO sessions (session_id, messages, updated_at) VALUES (?, '[]', ?)",
+                (session_id, time.time()),
+            )
+        self._maybe_evict()
+
+    def append(self, session_id, messages, max_messages):
+        # BEGIN IMMEDIATE serializes concurrent appends across threads and processes
+        with self._transaction() as conn:
+            row = conn.execute("SELECT messages FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            existing = json.loads(row[0]) if row else []
+            updated = (existing + messages)[-max_messages:] if max_messages > 0 else existing + messages
+            if row:
+                conn.execute(
+                    "UPDATE sessions SET messages = ?, updated_at = ? WHERE session_id = ?",
+                    (json.dumps(updated), time.time(), session_id),
+                )
+            else:
+                conn.execute(
+                    "INSERT INTO sessions (session_id, messages, updated_at) VALUES (?, ?, ?)",
+                    (session_id, json.dumps(updated), time.time()),
+                )
+        self._maybe_evict()
+
+    def get_summary(self, session_id):
+        row = self._conn().execute("SELECT summary FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def set_summary(self, session_id, summary):
+        with self._transaction() as conn:
+            conn.execute("UPDATE sessions SET summary = ? WHERE session_id = ?", (json.dumps(summary), session_id))
+
+    def delete(self, session_id):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def _maybe_evict(self, every=100):
+        self._writes += 1
+        if self._writes % every:
+            return
+        with self._transaction() as conn:
+            if self.ttl_seconds > 0:
+                expired = conn.execute(
+                    "DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl_seconds,)
+                ).rowcount
+                if expired:
+                    session_evictions.inc(expired, backend=self.name, reason="ttl")
+            if self.max_sessions > 0:
+                overflow = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] - self.max_sessions
+                if overflow > 0:
+                    conn.execute(
+                        "DELETE FROM sessions WHERE session_id IN "
+                        "(SELECT session_id FROM sessions ORDER BY updated_at ASC LIMIT ?)", (overflow,)
+                    )
+                    session_evictions.inc(overflow, backend=self.name, reason="lru")
+        sessions_gauge.set(self.count(), backend=self.name)
+
+    def count(self):
+        return self._conn().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+class _Transaction:
+    """Context manager running a block inside BEGIN IMMEDIATE ... COMMIT"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+class RedisBackend:
+    """Sessions in Redis (or any Redis-compatible server) shared across hosts
+
+    Each session is one hash holding its JSON messages and rolling summary.
+    Appends are optimistic WATCH/MULTI transactions that rewrite the trimmed
+    message list and refresh the EXPIRE. TTL is native; LRU eviction is
+    delegated to the server's maxmemory-policy.
+    """
+    name = "redis"
+
+    def __init__(self, url, ttl_seconds, prefix="pcos:session:v2:"):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+
+    def _key(self, session_id):
+        return f"{self.prefix}{session_id}"
+
+    def get(self, session_id):
+        raw = self.client.hget(self._key(session_id), "messages")
+        return None if raw is None else json.loads(raw)
+
+    def create(self, session_id):
+        key = self._key(session_id)
+        pipe = self.client.pipeline()
+        pipe.hsetnx(key, "messages", "[]")
+        if self.ttl_seconds > 0:
+            pipe.expire(key, self.ttl_seconds)
+        pipe.execute()
+
+    def append(self, session_id, messages, max_messages):
+        key = self._key(session_id)
+
+        def update(pipe):
+            raw = pipe.hget(key, "messages")
+            existing = json.loads(raw) if raw is not None else []
+            updated = (existing + messages)[-max_messages:] if max_messages > 0 else existing + messages
+            pipe.multi()
+            pipe.hset(key, "messages", json.dumps(updated))
+            if self.ttl_seconds > 0:
+                pipe.expire(key, self.ttl_seconds)
+
+        self.client.transaction(update, key)
+
+    def get_summary(self, session_id):
+        raw = self.client.hget(self._key(session_id), "summary")
+        return None if raw is None else json.loads(raw)
+
+    def set_summary(self, session_id, summary):
+        key = self._key(session_id)
+
+        def update(pipe):
+            # Do not recreate a session that expired or was cleared meanwhile
+            if not pipe.exists(key):
+                return
+            pipe.multi()
+            pipe.hset(key, "summary", json.dumps(summary))
+
+        self.client.transaction(update, key)
+
+    def delete(self, session_id):
+        self.client.delete(self._key(session_id))
+
+    def count(self):
+        return sum(1 for _ in self.client.scan_iter(match=f"{self.prefix}*"))
+
+
+class SessionStore:
+    """Single source of truth for chat sessions
+
+    Messages are stored as role/content dicts (the chat_history format sent to
+    the frontend) and exposed to LangChain through SessionHistory. Each
+    session keeps at most max_messages; idle sessions expire after the TTL.
+    """
+
+    def __init__(self, backend, max_messages=SESSION_MAX_MESSAGES):
+        self.backend = backend
+        self.max_messages = max_messages
+        self._locks = weakref.WeakValueDictionary()
+        self._locks_guard = threading.Lock()
+
+    def lock(self, session_id):
+        """Per-session re-entrant lock for read-modify-write sequences"""
+        with self._locks_guard:
+            lock = self._locks.get(session_id)
+            if lock is None:
+                lock = threading.RLock()
+                self._locks[session_id] = lock
+            return lock
+
+    def exists(self, session_id):
+        return self.backend.get(session_id) is not None
+
+    def create(self, session_id):
+        self.backend.create(session_id)
+
+    def messages(self, session_id):
+        """Session messages as role/content dicts (the chat_history payload)"""
+        return [public_message(item) for item in self.records(session_id)]
+
+    def records(self, session_id):
+        """Stored messages including bookkeeping fields ("ts"), for history windowing"""
+        return self.backend.get(session_id) or []
+
+    def append(self, session_id, *messages):
+        # "ts" orders messages so summaries can record how far they cover
+        now = time.time()
+        messages = [dict(m, ts=m.get("ts", now + i * 1e-6)) for i, m in enumerate(messages)]
+        with self.lock(session_id):
+            self.backend.append(session_id, messages, self.max_messages)
+
+    def delete(self, session_id):
+        self.backend.delete(session_id)
+
+    def get_summary(self, session_id):
+        """Rolling summary of older turns as {"content", "until"}, or None
+
+        The summary lives in the session's own record, so it expires and is
+        evicted together with the session.
+        """
+        return self.backend.get_summary(session_id)
+
+    def set_summary(self, session_id, content, until):
+        self.backend.set_summary(session_id, {"content": content, "until": until})
+
+    def get_history(self, session_id):
+        return SessionHistory(self, session_id)
+
+    def count(self):
+        return self.backend.count()
+
+
+class SessionHistory(BaseChatMessageHistory):
+    """LangChain chat history view over one session in the store"""
+
+    def __init__(self, store, session_id):
+        self.store = store
+        self.session_id = session_id
+
+    @property
+    def messages(self):
+        return [dict_to_message(item) for item in self.store.messages(self.session_id)]
+
+    def add_messages(self, messages):
+        self.store.append(self.session_id, *[message_to_dict(m) for m in messages])
+
+    def clear(self):
+        self.store.delete(self.session_id)
+
+
+def create_session_store(backend=SESSION_BACKEND):
+    """Build the session store configured by SESSION_BACKEND"""
+    if backend == "memory":
+        impl = InMemoryBackend(SESSION_TTL_SECONDS, SESSION_MAX_SESSIONS)
+    elif backend == "sqlite":
+        impl = SQLiteBackend(SESSION_SQLITE_PATH, SESSION_TTL_SECONDS, SESSION_MAX_SESSIONS)
+    elif backend == "redis":
+        impl = RedisBackend(SESSION_REDIS_URL, SESSION_TTL_SECONDS)
+    else:
+        raise ValueError(f"Unknown session backend '{backend}', expected memory, sqlite or redis")
+    logger.info(
+        f"Session store: {impl.name} (ttl={SESSION_TTL_SECONDS}s, max_sessions={SESSION_MAX_SESSIONS}, "
+        f"max_messages={SESSION_MAX_MESSAGES})"
+    )
+    return SessionStore(impl)
@@ -0,0 +1,34 @@
+"""Speech component: Groq Whisper transcription and PlayAI text-to-speech
+
+Loaded through the component registry in inference.py, so the audio
+pipelines (and numpy) are imported in the background or on first use
+instead of at server start, and never on SERVER_ROLE=vision workers.
+"""
+import os
+import logging
+from groq import Groq, AsyncGroq
+from upstreams import get_upstream
+from transcription import TranscriptionPipeline, GroqTranscriber
+from tts import TTSPipeline, TTSCache, SpeechClient
+
+logger = logging.getLogger(__name__)
+
+GROQ_API_KEY3 = os.getenv('GROQ_API_KEY3')
+groq_upstream = get_upstream("groq")
+groq_client = Groq(api_key=GROQ_API_KEY3, http_client=groq_upstream.client, timeout=groq_upstream.timeout, max_retries=0)
+# Used by the ASGI front end, so waiting on Groq holds no thread
+groq_async_client = AsyncGroq(api_key=GROQ_API_KEY3, http_client=groq_upstream.async_client,
+                              timeout=groq_upstream.timeout, max_retries=0)
+
+# Uploads are downmixed to 16 kHz mono, split at pauses and transcribed chunk-parallel
+transcriber = GroqTranscriber(groq_client, async_client=groq_async_client)
+transcription_pipeline = TranscriptionPipeline(transcriber, atranscribe=transcriber.acall)
+
+# Sentences are synthesized concurrently, cached on disk and streamed as they are ready
+speech_client = SpeechClient(GROQ_API_KEY3)
+tts_pipeline = TTSPipeline(speech_client.synthesize, cache=TTSCache(), asynthesize=speech_client.asynthesize)
+
+
+def shutdown():
+    tts_pipeline.shutdown()
+    transcription_pipeline.shutdown()
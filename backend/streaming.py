@@ -0,0 +1,223 @@
+import os
+import json
+import time
+import argparse
+from metrics import histogram
+
+# Coalescing of streamed answer text into SSE frames
+STREAM_FRAME_MAX_CHARS = int(os.getenv("STREAM_FRAME_MAX_CHARS", "200"))
+STREAM_FRAME_INTERVAL_MS = float(os.getenv("STREAM_FRAME_INTERVAL_MS", "50"))
+
+time_to_first_token = histogram(
+    "chat_time_to_first_token_seconds", "Time from receiving a chat request to its first answer frame",
+    buckets=(0.1, 0.25, 0.5, 1, 1.5, 2, 3, 5, 8, 13),
+)
+
+
+def _partial_tag_suffix(text, tag, start):
+    """Length of the longest proper prefix of tag that text[start:] ends with"""
+    for k in range(min(len(tag) - 1, len(text) - start), 0, -1):
+        if text.endswith(tag[:k]):
+            return k
+    return 0
+
+
+class ThinkTagFilter:
+    """Incremental splitter of streamed text into answer and <think> content
+
+    Works on whole chunks with str.find, and holds back a possible partial tag
+    at the end of a chunk until the next chunk shows whether it is one.
+    """
+    OPEN_TAG = "<think>"
+    CLOSE_TAG = "</think>"
+
+    def __init__(self):
+        self.in_think = False
+        self._pending = ""
+        self._answer = []
+        self._think = []
+
+    def feed(self, chunk):
+        """Consume one chunk; returns the newly visible answer text"""
+        text = self._pending + chunk
+        self._pending = ""
+        visible = []
+        pos = 0
+        while pos < len(text):
+            tag = self.CLOSE_TAG if self.in_think else self.OPEN_TAG
+            idx = text.find(tag, pos)
+            if idx == -1:
+                keep = _partial_tag_suffix(text, tag, pos)
+                end = len(text) - keep
+                self._emit(text[pos:end], visible)
+                self._pending = text[end:]
+                break
+            self._emit(text[pos:idx], visible)
+            pos = idx + len(tag)
+            self.in_think = not self.in_think
+        return "".join(visible)
+
+    def flush(self):
+        """Release any held-back text at the end of the stream"""
+        text, self._pending = self._pending, ""
+        visible = []
+        self._emit(text, visible)
+        return "".join(visible)
+
+    def _emit(self, segment, visible):
+        if not segment:
+            return
+        if self.in_think:
+            self._think.append(segment)
+        else:
+            self._answer.append(segment)
+            visible.append(segment)
+
+    @property
+    def answer(self):
+        return "".join(self._answer)
+
+    @property
+    def think(self):
+        return "".join(self._think)
+
+
+class FrameCoalescer:
+    """Groups streamed text into frames by size or elapsed time
+
+    The first text is released immediately so time-to-first-token is not
+    delayed; after that a frame is released once it reaches max_chars or
+    interval_ms has passed since the previous frame.
+    """
+
+    def __init__(self, max_chars=STREAM_FRAME_MAX_CHARS, interval_ms=STREAM_FRAME_INTERVAL_MS, clock=time.monotonic):
+        self.max_chars = max_chars
+        self.interval = interval_ms / 1000.0
+        self.clock = clock
+        self._buffer = []
+        self._size = 0
+        self._last_emit = None
+
+    def push(self, text):
+        """Add text; returns a frame's worth of text when one is due, else None"""
+        if text:
+            self._buffer.append(text)
+            self._size += len(text)
+        if not self._size:
+            return None
+        now = self.clock()
+        if self._last_emit is None or self._size >= self.max_chars or now - self._last_emit >= self.interval:
+            return self._take(now)
+        return None
+
+    def flush(self):
+        return self._take(self.clock()) if self._size else None
+
+    def _take(self, now):
+        text = "".join(self._buffer)
+        self._buffer = []
+        self._size = 0
+        self._last_emit = now
+        return text
+
+
+def split_frames(text, max_chars=STREAM_FRAME_MAX_CHARS):
+    """Cut an already complete answer into frames, preferring whitespace boundaries"""
+    frames = []
+    while len(text) > max_chars:
+        cut = text.rfind(" ", 0, max_chars) + 1 or max_chars
+        frames.append(text[:cut])
+        text = text[cut:]
+    if text:
+        frames.append(text)
+    return frames
+
+
+class ChunkEvents:
+    """SSE chunk events for one response; counts them and times the first one"""
+
+    def __init__(self, session_id, started_at, request_id=None):
+        self.session_id = session_id
+        self.started_at = started_at
+        self.request_id = request_id
+        self.count = 0
+        self.first_at = None
+
+    def event(self, content):
+        if self.first_at is None:
+            self.first_at = time.time()
+            time_to_first_token.observe(self.first_at - self.started_at)
+        self.count += 1
+        payload = {'type': 'chunk', 'content': content, 'session_id': self.session_id}
+        if self.request_id:
+            payload['request_id'] = self.request_id
+        return sse_event(payload)
+
+    @property
+    def ttft_ms(self):
+        return None if self.first_at is None else round((self.first_at - self.started_at) * 1000, 1)
+
+
+def sse_event(payload):
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+def _legacy_stream(chunks, session_id):
+    """The previous per-character parser, kept only for the benchmark below"""
+    in_think_tag = False
+    for content in chunks:
+        i = 0
+        while i < len(content):
+            if not in_think_tag and content[i:].startswith('<think>'):
+                in_think_tag = True
+                i += 7
+            elif in_think_tag and content[i:].startswith('</think>'):
+                in_think_tag = False
+                i += 8
+            elif in_think_tag:
+                i += 1
+            else:
+                yield sse_event({'type': 'chunk', 'content': content[i], 'session_id': session_id})
+                i += 1
+
+
+def _coalesced_stream(chunks, session_id, max_chars, interval_ms):
+    tag_filter = ThinkTagFilter()
+    frames = FrameCoalescer(max_chars, interval_ms)
+    for content in chunks:
+        frame = frames.push(tag_filter.feed(content))
+        if frame:
+            yield sse_event({'type': 'chunk', 'content': frame, 'session_id': session_id})
+    frame = frames.push(tag_filter.flush()) or frames.flush()
+    if frame:
+        yield sse_event({'type': 'chunk', 'content': frame, 'session_id': session_id})
+
+
+def benchmark(answer_chars=1000, chunk_chars=6, think_chars=200, rounds=50, max_chars=STREAM_FRAME_MAX_CHARS,
+              interval_ms=STREAM_FRAME_INTERVAL_MS):
+    """Compare SSE event counts, bytes and server CPU per response for both parsers"""
+    text = "<think>" + "t" * think_chars + "</think>" + ("PCOS is a common hormonal condition. " * 40)[:answer_chars]
+    chunks = [text[i:i + chunk_chars] for i in range(0, len(text), chunk_chars)]
+    session_id = "00000000-0000-0000-0000-000000000000"
+
+    results = {}
+    for name, stream in (("per_char", lambda: _legacy_stream(chunks, session_id)),
+                         ("coalesced", lambda: _coalesced_stream(chunks, session_id, max_chars, interval_ms))):
+        start = time.process_time()
+        for _ in range(rounds):
+            events = list(stream())
+        cpu_ms = (time.process_time() - start) * 1000 / rounds
+        results[name] = {"events": len(events), "bytes": sum(len(e) for e in events), "cpu_ms": round(cpu_ms, 3)}
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark SSE framing of a streamed chat answer")
+    parser.add_argument("--answer-chars", type=int, default=1000)
+    parser.add_argument("--chunk-chars", type=int, default=6, help="characters per simulated LLM chunk")
+    parser.add_argument("--think-chars", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    for name, result in benchmark(args.answer_chars, args.chunk_chars, args.think_chars, args.rounds).items():
+        print(f"{name:<10} events={result['events']:<6} bytes={result['bytes']:<8} cpu_ms/response={result['cpu_ms']}")
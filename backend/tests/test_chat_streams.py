@@ -0,0 +1,59 @@
+"""The async chat path must hold more concurrent LLM streams than the old 32-slot limit"""
+import asyncio
+import threading
+import pytest
+
+httpx = pytest.importorskip("httpx")
+
+from upstreams import Upstream, start_mock_server, upstream_settings
+
+STREAMS = 100
+
+
+@pytest.fixture
+def server():
+    server = start_mock_server()
+    yield server
+    server.shutdown()
+
+
+def test_llm_upstream_holds_more_than_32_streams(server):
+    upstream = Upstream("test-llm", **upstream_settings("llm"))
+    url = f"http://127.0.0.1:{server.server_port}/stream?seconds=1"
+
+    async def one():
+        async with upstream.async_client.stream("GET", url) as response:
+            await response.aread()
+            return response.status_code
+
+    async def run():
+        statuses = await asyncio.gather(*(one() for _ in range(STREAMS)))
+        await upstream.async_client.aclose()
+        return statuses
+
+    statuses = asyncio.run(run())
+    assert statuses == [200] * STREAMS
+    assert server.state["peak"] > 32
+    assert upstream.status()["in_flight"] == 0
+
+
+def test_queued_async_streams_do_not_take_threads(server):
+    upstream = Upstream("test-limited", **{**upstream_settings("llm"), "max_concurrency": 2})
+    url = f"http://127.0.0.1:{server.server_port}/stream?seconds=0.3"
+
+    async def one():
+        async with upstream.async_client.stream("GET", url) as response:
+            await response.aread()
+
+    async def run():
+        threads = threading.active_count()
+        tasks = [asyncio.ensure_future(one()) for _ in range(20)]
+        await asyncio.sleep(0.2)
+        waiting_threads = threading.active_count() - threads
+        await asyncio.gather(*tasks)
+        await upstream.async_client.aclose()
+        return waiting_threads
+
+    # Two requests are in flight (one server thread each); the 18 queued ones cost nothing
+    assert asyncio.run(run()) <= 4
+    assert server.state["peak"] <= 2
@@ -0,0 +1,43 @@
+"""Chunk merging must not invent continuity between unrelated passages"""
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from langchain_core.documents import Document
+from context_compression import merge_chunks
+
+FIRST = "Polycystic ovary syndrome is a common hormonal disorder among women of reproductive age."
+SECOND = "among women of reproductive age. Symptoms include irregular periods and excess androgen."
+
+
+def chunk(text, source="guide.pdf", page=3):
+    metadata = {"source": source}
+    if page is not None:
+        metadata["page"] = page
+    return Document(page_content=text, metadata=metadata)
+
+
+def test_overlapping_neighbours_are_joined():
+    merged = merge_chunks([chunk(FIRST), chunk(SECOND, page=4)])
+    assert [doc.page_content for doc in merged] == [
+        "Polycystic ovary syndrome is a common hormonal disorder among women of reproductive age. "
+        "Symptoms include irregular periods and excess androgen."
+    ]
+
+
+def test_non_adjacent_chunks_stay_separate():
+    unrelated = "Metformin is sometimes prescribed to improve insulin sensitivity."
+    # Same page but no shared text, a distant page, and another source
+    for other in (chunk(unrelated), chunk(SECOND, page=9), chunk(SECOND, source="other.pdf")):
+        merged = merge_chunks([chunk(FIRST), other])
+        assert [doc.page_content for doc in merged] == [FIRST, other.page_content]
+
+
+def test_chunks_without_page_are_not_joined():
+    merged = merge_chunks([chunk(FIRST, page=None), chunk(SECOND, page=None)])
+    assert len(merged) == 2
+
+
+def test_duplicates_are_dropped():
+    merged = merge_chunks([chunk(FIRST), chunk(FIRST, page=7), chunk(FIRST[:40])])
+    assert [doc.page_content for doc in merged] == [FIRST]
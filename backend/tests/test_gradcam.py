@@ -0,0 +1,48 @@
+"""Grad-CAM keeps one forward hook for its lifetime and does not slow down with use"""
+import time
+import statistics
+import pytest
+
+torch = pytest.importorskip("torch")
+models = pytest.importorskip("torchvision.models")
+
+from gradcam import GradCAM
+
+CALLS = 50
+
+
+@pytest.fixture(scope="module")
+def model():
+    torch.manual_seed(0)
+    return models.resnet18(weights=None, num_classes=2).eval()
+
+
+def test_one_forward_hook_and_none_after_remove(model):
+    layer = model.layer4[-1]
+    assert len(layer._forward_hooks) == 0
+    with GradCAM(model, layer) as engine:
+        assert len(layer._forward_hooks) == 1
+        images = torch.randn(2, 3, 64, 64)
+        for _ in range(5):
+            probs, pred_idx, heatmaps = engine.classify(images, explain=True)
+            assert len(layer._forward_hooks) == 1
+        assert heatmaps.shape[0] == 2
+        engine.classify(images, explain=False)
+        assert len(layer._forward_hooks) == 1
+    assert len(layer._forward_hooks) == 0
+    with pytest.raises(RuntimeError):
+        engine.classify(images, explain=True)
+
+
+def test_latency_stays_flat(model):
+    images = torch.randn(1, 3, 64, 64)
+    latencies = []
+    with GradCAM(model, model.layer4[-1]) as engine:
+        engine.classify(images, explain=True)  # warm-up
+        for _ in range(CALLS):
+            started = time.perf_counter()
+            engine.classify(images, explain=True)
+            latencies.append(time.perf_counter() - started)
+    window = CALLS // 5
+    early, late = statistics.median(latencies[:window]), statistics.median(latencies[-window:])
+    assert late <= early * 2
@@ -0,0 +1,18 @@
+"""Bookkeeping fields stay in the session store"""
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from session_store import InMemoryBackend, SessionStore, USER_ROLE, BOT_ROLE
+
+
+def test_chat_history_has_only_role_and_content():
+    store = SessionStore(InMemoryBackend(ttl_seconds=0, max_sessions=0))
+    store.create("s")
+    store.append("s", {"role": USER_ROLE, "content": "hi"}, {"role": BOT_ROLE, "content": "hello"})
+    store.set_summary("s", "earlier turns", until=0.0)
+
+    assert store.messages("s") == [{"role": USER_ROLE, "content": "hi"}, {"role": BOT_ROLE, "content": "hello"}]
+    assert all("ts" in item for item in store.records("s"))
+    assert [m.content for m in store.get_history("s").messages] == ["hi", "hello"]
+    assert all(not m.additional_kwargs for m in store.get_history("s").messages)
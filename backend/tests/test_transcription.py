@@ -0,0 +1,51 @@
+"""Per-request chunk limits on the shared transcription pool"""
+import time
+import threading
+import pytest
+
+pytest.importorskip("numpy")
+
+from transcription import TranscriptionPipeline, synthetic_recording
+
+
+class SlowTranscriber:
+    """Stand-in API call with a fixed latency that records peak concurrency per upload"""
+
+    def __init__(self, latency=0.2):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.active = {}
+        self.peak = {}
+
+    def __call__(self, filename, data, content_type):
+        upload = filename.rsplit("-", 1)[0]
+        with self.lock:
+            self.active[upload] = self.active.get(upload, 0) + 1
+            self.peak[upload] = max(self.peak.get(upload, 0), self.active[upload])
+        time.sleep(self.latency)
+        with self.lock:
+            self.active[upload] -= 1
+        return "text"
+
+
+def test_long_upload_does_not_stall_other_requests():
+    transcriber = SlowTranscriber()
+    pipeline = TranscriptionPipeline(transcriber, concurrency=2, codec="wav", workers=8)
+    long_upload = synthetic_recording(seconds=300, rate=16000, channels=1)
+    short_upload = synthetic_recording(seconds=20, rate=16000, channels=1)
+    try:
+        long_result = {}
+        worker = threading.Thread(target=lambda: long_result.update(pipeline.run(long_upload, "long.wav", "audio/wav")))
+        worker.start()
+        time.sleep(0.1)
+        started = time.perf_counter()
+        short = pipeline.run(short_upload, "short.wav", "audio/wav")
+        short_s = time.perf_counter() - started
+        worker.join()
+    finally:
+        pipeline.shutdown()
+
+    assert long_result["chunks"] > 4
+    assert transcriber.peak["long"] <= 2 and transcriber.peak["short"] <= 2
+    # The short upload only waits for its own chunks, not the long upload's backlog
+    assert short_s < transcriber.latency * (short["chunks"] + 2)
@@ -0,0 +1,90 @@
+import re
+import time
+import uuid
+import logging
+import contextvars
+from contextlib import contextmanager
+from metrics import histogram
+
+_current_trace = contextvars.ContextVar("request_trace", default=None)
+
+REQUEST_ID_HEADER = "X-Request-ID"
+REQUEST_ID_PATTERN = re.compile(r"[A-Za-z0-9._-]{1,64}")
+
+stage_seconds = histogram(
+    "pipeline_stage_seconds", "Latency of each stage of the chat and vision pipelines", ["pipeline", "stage"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+
+
+class RequestTrace:
+    """Per-request telemetry shared by every component that handles the request"""
+
+    def __init__(self, request_id=None):
+        self.request_id = request_id or str(uuid.uuid4())[:8]
+        self.started_at = time.perf_counter()
+        self.attributes = {}
+        self.spans = {}    # stage -> milliseconds, summed over repeated stages
+
+    def annotate(self, key, value):
+        self.attributes[key] = value
+
+    def record_span(self, stage, seconds):
+        self.spans[stage] = round(self.spans.get(stage, 0.0) + seconds * 1000, 1)
+
+
+def start_trace(request_id=None):
+    """Begin a trace in the current context; returns (trace, token) for end_trace()"""
+    trace = RequestTrace(request_id)
+    return trace, _current_trace.set(trace)
+
+
+def end_trace(token):
+    _current_trace.reset(token)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def incoming_request_id(value):
+    """A caller-supplied X-Request-ID if it is safe to log and echo, else None (a new ID is generated)"""
+    return value if value and REQUEST_ID_PATTERN.fullmatch(value) else None
+
+
+def current_request_id():
+    trace = _current_trace.get()
+    return trace.request_id if trace is not None else None
+
+
+def annotate(key, value):
+    """Record a telemetry attribute on the current request, if any"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.annotate(key, value)
+
+
+def record_stage(pipeline, stage, seconds, trace=None):
+    """Observe a stage duration in pipeline_stage_seconds and on the request trace"""
+    stage_seconds.observe(seconds, pipeline=pipeline, stage=stage)
+    trace = trace or _current_trace.get()
+    if trace is not None:
+        trace.record_span(stage, seconds)
+
+
+@contextmanager
+def span(pipeline, stage):
+    """Time a block as one stage of a pipeline"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(pipeline, stage, time.perf_counter() - started)
+
+
+class RequestIdFilter(logging.Filter):
+    """Adds %(request_id)s to log records ('-' outside a request)"""
+
+    def filter(self, record):
+        record.request_id = current_request_id() or "-"
+        return True
@@ -0,0 +1,446 @@
+import io
+import os
+import json
+import time
+import wave
+import asyncio
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from metrics import counter, histogram
+
+logger = logging.getLogger(__name__)
+
+TRANSCRIBE_MODEL = os.getenv("TRANSCRIBE_MODEL", "whisper-large-v3")
+TRANSCRIBE_LANGUAGE = os.getenv("TRANSCRIBE_LANGUAGE", "en")
+TRANSCRIBE_SAMPLE_RATE = 16000
+TRANSCRIBE_CODEC = os.getenv("TRANSCRIBE_CODEC", "opus")                   # opus | flac | wav
+TRANSCRIBE_OPUS_BITRATE = os.getenv("TRANSCRIBE_OPUS_BITRATE", "24k")
+TRANSCRIBE_CONCURRENCY = int(os.getenv("TRANSCRIBE_CONCURRENCY", "4"))         # chunks in flight per request
+TRANSCRIBE_WORKERS = int(os.getenv("TRANSCRIBE_WORKERS", "32"))                 # shared by all requests
+TRANSCRIBE_CHUNK_SECONDS = float(os.getenv("TRANSCRIBE_CHUNK_SECONDS", "30"))       # cut at the first pause after this
+TRANSCRIBE_MAX_CHUNK_SECONDS = float(os.getenv("TRANSCRIBE_MAX_CHUNK_SECONDS", "60"))
+TRANSCRIBE_SILENCE_DB = float(os.getenv("TRANSCRIBE_SILENCE_DB", "-40"))            # dBFS
+TRANSCRIBE_MIN_SILENCE_MS = int(os.getenv("TRANSCRIBE_MIN_SILENCE_MS", "400"))
+TRANSCRIBE_PAD_MS = int(os.getenv("TRANSCRIBE_PAD_MS", "200"))
+FRAME_MS = 30
+
+CODECS = {
+    # codec -> (ffmpeg output args, file extension, content type)
+    "opus": (["-c:a", "libopus", "-b:a", TRANSCRIBE_OPUS_BITRATE, "-application", "voip", "-f", "ogg"], "ogg", "audio/ogg"),
+    "flac": (["-c:a", "flac", "-f", "flac"], "flac", "audio/flac"),
+    "wav": (["-c:a", "pcm_s16le", "-f", "wav"], "wav", "audio/wav"),
+}
+
+transcribe_bytes = counter("transcribe_bytes_total", "Audio bytes received from clients and sent upstream", ["direction"])
+transcribe_chunks = histogram(
+    "transcribe_chunks", "Chunks per transcription request", buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+transcribe_chunk_seconds = histogram(
+    "transcribe_chunk_seconds", "Upstream transcription latency per chunk",
+    buckets=(0.25, 0.5, 1, 2, 4, 8, 16, 32),
+)
+
+_ffmpeg_warned = threading.Event()
+
+
+def ffmpeg_path():
+    path = shutil.which("ffmpeg")
+    if path is None and not _ffmpeg_warned.is_set():
+        _ffmpeg_warned.set()
+        logger.warning("ffmpeg not found; only WAV uploads are preprocessed, others are sent as-is")
+    return path
+
+
+def _resample(samples, rate, target_rate=TRANSCRIBE_SAMPLE_RATE):
+    if rate == target_rate or len(samples) == 0:
+        return samples
+    count = int(round(len(samples) * target_rate / rate))
+    positions = np.arange(count) * (rate / target_rate)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+def decode_to_pcm(data):
+    """Decode any upload to 16 kHz mono float32 samples in [-1, 1]; None when it cannot be decoded
+
+    Uses ffmpeg when available; without it only PCM WAV is understood.
+    """
+    ffmpeg = ffmpeg_path()
+    if ffmpeg is not None:
+        # A temp file rather than stdin: containers such as mp4/m4a need to seek
+        with tempfile.NamedTemporaryFile(suffix=".audio") as source:
+            source.write(data)
+            source.flush()
+            result = subprocess.run(
+                [ffmpeg, "-nostdin", "-v", "error", "-i", source.name,
+                 "-ac", "1", "-ar", str(TRANSCRIBE_SAMPLE_RATE), "-f", "s16le", "pipe:1"],
+                capture_output=True, timeout=120,
+            )
+        if result.returncode != 0:
+            logger.warning(f"ffmpeg could not decode upload: {result.stderr.decode(errors='replace')[:200]}")
+            return None
+        return np.frombuffer(result.stdout, dtype="<i2").astype(np.float32) / 32768.0
+
+    try:
+        with wave.open(io.BytesIO(data)) as wav:
+            channels, width, rate = wav.getnchannels(), wav.getsampwidth(), wav.getframerate()
+            frames = wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError):
+        return None
+    if width == 1:
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128) / 128.0
+    elif width == 2:
+        samples = np.frombuffer(frames, dtype="<i2").astype(np.float32) / 32768.0
+    elif width == 4:
+        samples = np.frombuffer(frames, dtype="<i4").astype(np.float32) / 2147483648.0
+    else:
+        return None
+    samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels).mean(axis=1)
+    return _resample(samples, rate)
+
+
+def encode_chunk(samples, codec=TRANSCRIBE_CODEC):
+    """Encode 16 kHz mono samples for upload; returns (bytes, extension, content type)"""
+    pcm = (np.clip(samples, -1, 1) * 32767).astype("<i2").tobytes()
+    ffmpeg = ffmpeg_path()
+    if ffmpeg is not None and codec != "wav":
+        args, extension, content_type = CODECS[codec]
+        result = subprocess.run(
+            [ffmpeg, "-nostdin", "-v", "error", "-f", "s16le", "-ar", str(TRANSCRIBE_SAMPLE_RATE), "-ac", "1",
+             "-i", "pipe:0", *args, "pipe:1"],
+            input=pcm, capture_output=True, timeout=120,
+        )
+        if result.returncode == 0:
+            return result.stdout, extension, content_type
+        logger.warning(f"ffmpeg {codec} encode failed, sending WAV: {result.stderr.decode(errors='replace')[:200]}")
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(TRANSCRIBE_SAMPLE_RATE)
+        wav.writeframes(pcm)
+    return buffer.getvalue(), "wav", "audio/wav"
+
+
+def speech_frames(samples, silence_db=TRANSCRIBE_SILENCE_DB, frame_ms=FRAME_MS):
+    """Boolean array: True for each frame_ms frame louder than silence_db"""
+    size = TRANSCRIBE_SAMPLE_RATE * frame_ms // 1000
+    count = len(samples) // size
+    if count == 0:
+        return np.zeros(0, dtype=bool)
+    frames = samples[:count * size].reshape(count, size)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+    return 20 * np.log10(np.maximum(rms, 1e-10)) > silence_db
+
+
+def split_on_silence(samples, chunk_seconds=TRANSCRIBE_CHUNK_SECONDS, max_chunk_seconds=TRANSCRIBE_MAX_CHUNK_SECONDS,
+                     min_silence_ms=TRANSCRIBE_MIN_SILENCE_MS, pad_ms=TRANSCRIBE_PAD_MS):
+    """Trim leading/trailing silence and cut long audio in the middle of pauses
+
+    Returns a list of (start, end) sample offsets. A chunk is cut at the first
+    pause of at least min_silence_ms after chunk_seconds, or at its last
+    silent frame once it reaches max_chunk_seconds.
+    """
+    voiced = speech_frames(samples)
+    if not voiced.any():
+        return []
+    frame = TRANSCRIBE_SAMPLE_RATE * FRAME_MS // 1000
+    pad = int(pad_ms / FRAME_MS)
+    first = max(0, int(np.argmax(voiced)) - pad)
+    last = min(len(voiced), len(voiced) - int(np.argmax(voiced[::-1])) + pad)
+
+    min_gap = max(1, min_silence_ms // FRAME_MS)
+    target = int(chunk_seconds * 1000 / FRAME_MS)
+    limit = int(max_chunk_seconds * 1000 / FRAME_MS)
+
+    cuts = []
+    start = first
+    position = first
+    gap = 0
+    while position < last:
+        gap = 0 if voiced[position] else gap + 1
+        length = position - start
+        if length >= target and gap >= min_gap:
+            cut = position - gap // 2
+            cuts.append((start, cut))
+            start = cut
+        elif length >= limit:
+            window = voiced[start + target:position]
+            # No pause long enough: cut at the last silent frame, else hard cut
+            silent = np.flatnonzero(~window)
+            cut = start + target + int(silent[-1]) if len(silent) else position
+            cuts.append((start, cut))
+            start = cut
+        position += 1
+    if last > start:
+        cuts.append((start, last))
+    return [(s * frame, min(e * frame, len(samples))) for s, e in cuts if e > s]
+
+
+class GroqTranscriber:
+    """Sends one audio file to the Groq Whisper API"""
+
+    def __init__(self, client, model=TRANSCRIBE_MODEL, language=TRANSCRIBE_LANGUAGE, async_client=None):
+        self.client = client
+        self.async_client = async_client
+        self.model = model
+        self.language = language
+
+    def _request(self, filename, data, content_type):
+        return {"file": (filename, data, content_type), "model": self.model,
+                "response_format": "text", "language": self.language}
+
+    def __call__(self, filename, data, content_type):
+        transcription = self.client.audio.transcriptions.create(**self._request(filename, data, content_type))
+        return transcription.strip() if transcription else ""
+
+    async def acall(self, filename, data, content_type):
+        """__call__ on the AsyncGroq client, for the ASGI front end"""
+        transcription = await self.async_client.audio.transcriptions.create(**self._request(filename, data, content_type))
+        return transcription.strip() if transcription else ""
+
+
+class TranscriptionPipeline:
+    """Downmix/resample to 16 kHz mono, trim and split at silences, transcribe chunks concurrently
+
+    stream() yields a 'partial' event each time the next chunk in order is
+    done, then a 'complete' event with the stitched transcription. Uploads
+    that cannot be decoded are forwarded unchanged as a single request.
+    astream() is the same on the event loop: decoding and encoding run on the
+    pipeline's threads, the API calls on atranscribe.
+
+    The thread pool (workers) is shared by every request, and each request
+    keeps at most `concurrency` chunks in flight, so a long upload cannot
+    occupy the whole pool and stall other transcriptions.
+    """
+
+    def __init__(self, transcribe, concurrency=TRANSCRIBE_CONCURRENCY, codec=TRANSCRIBE_CODEC, atranscribe=None,
+                 workers=TRANSCRIBE_WORKERS):
+        self.transcribe = transcribe
+        self.atranscribe = atranscribe
+        self.concurrency = max(1, concurrency)
+        self.codec = codec
+        self._executor = ThreadPoolExecutor(max_workers=max(self.concurrency, workers), thread_name_prefix="transcribe")
+
+    def _transcribe_chunk(self, name, samples):
+        data, extension, content_type = encode_chunk(samples, self.codec)
+        transcribe_bytes.inc(len(data), direction="sent")
+        started = time.perf_counter()
+        text = self.transcribe(f"{name}.{extension}", data, content_type)
+        transcribe_chunk_seconds.observe(time.perf_counter() - started)
+        return text, len(data)
+
+    async def _atranscribe_chunk(self, name, samples, slots):
+        loop = asyncio.get_running_loop()
+        async with slots:
+            data, extension, content_type = await loop.run_in_executor(self._executor, encode_chunk, samples, self.codec)
+            transcribe_bytes.inc(len(data), direction="sent")
+            started = time.perf_counter()
+            text = await self.atranscribe(f"{name}.{extension}", data, content_type)
+        transcribe_chunk_seconds.observe(time.perf_counter() - started)
+        return text, len(data)
+
+    @staticmethod
+    def _partial(index, chunks, text, texts):
+        if text:
+            texts.append(text)
+        return {"type": "partial", "index": index, "chunks": chunks, "text": text, "transcription": " ".join(texts)}
+
+    def stream(self, data, filename, content_type):
+        started = time.perf_counter()
+        transcribe_bytes.inc(len(data), direction="received")
+        name = os.path.splitext(filename or "audio")[0]
+
+        samples = decode_to_pcm(data)
+        if samples is None:
+            transcribe_bytes.inc(len(data), direction="sent")
+            transcribe_chunks.observe(1)
+            text = self.transcribe(filename, data, content_type)
+            yield {"type": "partial", "index": 0, "chunks": 1, "text": text, "transcription": text}
+            yield self._complete(text, 1, len(data), len(data), None, started)
+            return
+
+        spans = split_on_silence(samples)
+        transcribe_chunks.observe(len(spans))
+
+        # A sliding window of `concurrency` chunks: the next one is submitted
+        # as the oldest is handed back
+        def submit(index):
+            start, end = spans[index]
+            return self._executor.submit(self._transcribe_chunk, f"{name}-{index}", samples[start:end])
+
+        futures = deque(submit(index) for index in range(min(self.concurrency, len(spans))))
+        texts = []
+        sent = 0
+        try:
+            for index in range(len(spans)):
+                text, size = futures.popleft().result()
+                if index + len(futures) + 1 < len(spans):
+                    futures.append(submit(index + len(futures) + 1))
+                sent += size
+                yield self._partial(index, len(spans), text, texts)
+        finally:
+            for future in futures:
+                future.cancel()
+        yield self._complete(" ".join(texts), len(spans), len(data), sent,
+                             len(samples) / TRANSCRIBE_SAMPLE_RATE, started)
+
+    async def astream(self, data, filename, content_type):
+        started = time.perf_counter()
+        transcribe_bytes.inc(len(data), direction="received")
+        name = os.path.splitext(filename or "audio")[0]
+
+        loop = asyncio.get_running_loop()
+        samples = await loop.run_in_executor(self._executor, decode_to_pcm, data)
+        if samples is None:
+            transcribe_bytes.inc(len(data), direction="sent")
+            transcribe_chunks.observe(1)
+            text = await self.atranscribe(filename, data, content_type)
+            yield {"type": "partial", "index": 0, "chunks": 1, "text": text, "transcription": text}
+            yield self._complete(text, 1, len(data), len(data), None, started)
+            return
+
+        spans = await loop.run_in_executor(self._executor, split_on_silence, samples)
+        transcribe_chunks.observe(len(spans))
+        slots = asyncio.Semaphore(self.concurrency)
+        tasks = [
+            asyncio.ensure_future(self._atranscribe_chunk(f"{name}-{index}", samples[start:end], slots))
+            for index, (start, end) in enumerate(spans)
+        ]
+        texts = []
+        sent = 0
+        try:
+            for index, task in enumerate(tasks):
+                text, size = await task
+                sent += size
+                yield self._partial(index, len(spans), text, texts)
+        finally:
+            for task in tasks:
+                task.cancel()
+        yield self._complete(" ".join(texts), len(spans), len(data), sent,
+                             len(samples) / TRANSCRIBE_SAMPLE_RATE, started)
+
+    def run(self, data, filename, content_type):
+        """Blocking form of stream(); returns the 'complete' event"""
+        for event in self.stream(data, filename, content_type):
+            pass
+        return event
+
+    async def arun(self, data, filename, content_type):
+        async for event in self.astream(data, filename, content_type):
+            pass
+        return event
+
+    @staticmethod
+    def _complete(text, chunks, bytes_received, bytes_sent, duration_s, started):
+        return {
+            "type": "complete",
+            "transcription": text,
+            "chunks": chunks,
+            "bytes_received": bytes_received,
+            "bytes_sent": bytes_sent,
+            "audio_seconds": None if duration_s is None else round(duration_s, 2),
+            "processing_time": f"{time.perf_counter() - started:.2f}s",
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class _StubTranscriber:
+    """Local stand-in for the transcription API
+
+    Latency is a fixed overhead, plus upload time at uplink_kbps, plus
+    decoding at real_time_factor times the audio length.
+    """
+
+    def __init__(self, base_latency=0.3, uplink_kbps=20000, real_time_factor=0.05):
+        self.base_latency = base_latency
+        self.uplink_kbps = uplink_kbps
+        self.real_time_factor = real_time_factor
+        self.calls = 0
+
+    def __call__(self, filename, data, content_type):
+        self.calls += 1
+        samples = decode_to_pcm(data)
+        seconds = 0 if samples is None else len(samples) / TRANSCRIBE_SAMPLE_RATE
+        time.sleep(self.base_latency + len(data) * 8 / (self.uplink_kbps * 1000) + seconds * self.real_time_factor)
+        return f"[{seconds:.1f}s]"
+
+
+def synthetic_recording(seconds=180, rate=44100, channels=2, seed=0):
+    """Tone bursts separated by pauses, as a client-side WAV recording"""
+    rng = np.random.default_rng(seed)
+    parts = []
+    total = 0.0
+    while total < seconds:
+        speech = rng.uniform(2, 8)
+        pause = rng.uniform(0.3, 1.5)
+        t = np.arange(int(speech * rate)) / rate
+        tone = 0.3 * np.sin(2 * np.pi * rng.uniform(150, 300) * t) * (0.6 + 0.4 * np.sin(2 * np.pi * 3 * t))
+        parts.extend([tone, 0.001 * rng.standard_normal(int(pause * rate))])
+        total += speech + pause
+    mono = np.concatenate(parts)
+    pcm = (np.repeat(mono[:, None], channels, axis=1) * 32767).astype("<i2")
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(pcm.tobytes())
+    return buffer.getvalue()
+
+
+def benchmark(recordings, concurrency=TRANSCRIBE_CONCURRENCY):
+    """Bytes sent and end-to-end latency: raw single upload vs. the preprocessing pipeline"""
+    results = []
+    for name, data in recordings:
+        stub = _StubTranscriber()
+        started = time.perf_counter()
+        stub(f"{name}.wav", data, "audio/wav")
+        raw_s = time.perf_counter() - started
+
+        stub = _StubTranscriber()
+        pipeline = TranscriptionPipeline(stub, concurrency=concurrency)
+        started = time.perf_counter()
+        first_partial_s = None
+        for event in pipeline.stream(data, f"{name}.wav", "audio/wav"):
+            if first_partial_s is None:
+                first_partial_s = time.perf_counter() - started
+        pipelined_s = time.perf_counter() - started
+        pipeline.shutdown()
+
+        results.append({
+            "recording": name,
+            "audio_seconds": event["audio_seconds"],
+            "raw_bytes": len(data),
+            "sent_bytes": event["bytes_sent"],
+            "chunks": event["chunks"],
+            "raw_latency_s": round(raw_s, 2),
+            "pipelined_latency_s": round(pipelined_s, 2),
+            "first_partial_s": round(first_partial_s, 2),
+        })
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Benchmark audio preprocessing and chunked transcription against a local stub")
+    parser.add_argument("files", nargs="*", help="recordings to use (default: synthetic 30s, 2min and 5min WAVs)")
+    parser.add_argument("--concurrency", type=int, default=TRANSCRIBE_CONCURRENCY)
+    args = parser.parse_args()
+
+    if args.files:
+        recordings = []
+        for path in args.files:
+            with open(path, "rb") as f:
+                recordings.append((os.path.basename(path), f.read()))
+    else:
+        recordings = [(f"synthetic-{seconds}s", synthetic_recording(seconds)) for seconds in (30, 120, 300)]
+    print(json.dumps(benchmark(recordings, args.concurrency), indent=2))
@@ -0,0 +1,504 @@
+import os
+import re
+import json
+import time
+import struct
+import hashlib
+import logging
+import asyncio
+import argparse
+import threading
+import unicodedata
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from metrics import counter, gauge, histogram
+from upstreams import get_upstream
+
+logger = logging.getLogger(__name__)
+
+GROQ_TTS_URL = os.getenv("GROQ_TTS_URL", "https://api.groq.com/openai/v1/audio/speech")
+TTS_CONCURRENCY = int(os.getenv("TTS_CONCURRENCY", "3"))          # segments synthesized ahead per request
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", "16"))                 # upstream calls in flight across requests
+TTS_SEGMENT_MIN_CHARS = int(os.getenv("TTS_SEGMENT_MIN_CHARS", "60"))
+TTS_SEGMENT_MAX_CHARS = int(os.getenv("TTS_SEGMENT_MAX_CHARS", "400"))
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "tts_cache")           # empty disables the cache
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+tts_first_audio = histogram(
+    "tts_time_to_first_audio_seconds", "Time from /tts request to the first audio bytes being ready",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16),
+)
+tts_synthesis_seconds = histogram(
+    "tts_segment_synthesis_seconds", "Upstream speech API latency per segment",
+    buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32),
+)
+tts_segments = counter("tts_segments_total", "TTS segments by cache outcome", ["result"])
+tts_cache_bytes = gauge("tts_cache_bytes", "Bytes of synthesized audio held in the TTS cache")
+
+SENTENCE_END = re.compile(r"(?<=[.!?؟۔])\s+|\n+")
+CLAUSE_END = re.compile(r"(?<=[,;:،])\s+")
+
+
+class TTSError(Exception):
+    pass
+
+
+def split_segments(text, min_chars=TTS_SEGMENT_MIN_CHARS, max_chars=TTS_SEGMENT_MAX_CHARS):
+    """Split text into sentence-sized segments for synthesis
+
+    Short sentences are joined up to min_chars and over-long ones are broken at
+    clause boundaries, then at spaces, to stay under max_chars.
+    """
+    pieces = []
+    for sentence in SENTENCE_END.split(text):
+        sentence = " ".join(sentence.split())
+        if not sentence:
+            continue
+        while len(sentence) > max_chars:
+            cut = max((m.end() for m in CLAUSE_END.finditer(sentence, 0, max_chars)), default=0)
+            if cut == 0:
+                cut = sentence.rfind(" ", 0, max_chars) + 1 or max_chars
+            pieces.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if sentence:
+            pieces.append(sentence)
+
+    segments = []
+    for piece in pieces:
+        if segments and len(segments[-1]) < min_chars and len(segments[-1]) + len(piece) < max_chars:
+            segments[-1] = f"{segments[-1]} {piece}"
+        else:
+            segments.append(piece)
+    return segments
+
+
+def parse_wav(data):
+    """Returns (fmt chunk, PCM bytes) of a RIFF/WAVE payload
+
+    Streamed WAVs often carry a placeholder data size, so the data chunk is
+    clamped to the bytes actually present.
+    """
+    if len(data) < 12 or data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        raise TTSError("speech API did not return a WAV payload")
+    fmt = None
+    offset = 12
+    while offset + 8 <= len(data):
+        chunk_id, size = data[offset:offset + 4], struct.unpack("<I", data[offset + 4:offset + 8])[0]
+        body = offset + 8
+        if chunk_id == b"fmt ":
+            fmt = data[body:body + size]
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise TTSError("WAV data chunk precedes fmt chunk")
+            return fmt, data[body:body + size]
+        offset = body + size + (size & 1)
+    raise TTSError("WAV payload has no data chunk")
+
+
+def wav_stream_header(fmt):
+    """WAV header for a stream of unknown length (sizes set to the maximum, as live WAV streams do)"""
+    return (b"RIFF" + struct.pack("<I", 0xFFFFFFFF) + b"WAVE"
+            + b"fmt " + struct.pack("<I", len(fmt)) + fmt
+            + b"data" + struct.pack("<I", 0xFFFFFFFF))
+
+
+class TTSCache:
+    """Synthesized segments on disk, one WAV file per (text, model, voice), evicted LRU by total size
+
+    Recency is kept in memory and mirrored to file mtimes so it survives restarts.
+    """
+
+    def __init__(self, directory=TTS_CACHE_DIR, max_bytes=TTS_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()    # key -> size
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        if not directory:
+            return
+        os.makedirs(directory, exist_ok=True)
+        files = []
+        for name in os.listdir(directory):
+            if name.endswith(".wav"):
+                stat = os.stat(os.path.join(directory, name))
+                files.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._bytes += size
+        tts_cache_bytes.set(self._bytes)
+        logger.info(f"TTS cache: {len(self._entries)} segments, {self._bytes / 1e6:.1f} MB in {directory}")
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    @staticmethod
+    def key(text, model, voice):
+        text = " ".join(unicodedata.normalize("NFKC", text).split())
+        return hashlib.sha256(f"{model}\x00{voice}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.wav")
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+        try:
+            with open(self._path(key), "rb") as f:
+                data = f.read()
+            os.utime(self._path(key))
+        except OSError:
+            with self._lock:
+                self._bytes -= self._entries.pop(key, 0)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key, data):
+        if not self.enabled or len(data) > self.max_bytes:
+            return
+        tmp_path = f"{self._path(key)}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logger.error(f"Failed to write TTS cache entry: {str(e)}")
+            return
+        evicted = []
+        with self._lock:
+            self._bytes += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                old_key, size = self._entries.popitem(last=False)
+                self._bytes -= size
+                evicted.append(old_key)
+            tts_cache_bytes.set(self._bytes)
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "segments": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+class SpeechClient:
+    """Groq (OpenAI-compatible) /audio/speech client on the shared 'groq' upstream"""
+
+    def __init__(self, api_key, url=GROQ_TTS_URL, upstream=None):
+        self.api_key = api_key
+        self.url = url
+        self.upstream = upstream or get_upstream("groq")
+
+    def _request(self, text, model, voice):
+        return {
+            'headers': {'Authorization': f'Bearer {self.api_key}', 'Content-Type': 'application/json'},
+            'json': {'model': model, 'voice': voice, 'input': text, 'response_format': 'wav'},
+        }
+
+    @staticmethod
+    def _audio(response, started):
+        tts_synthesis_seconds.observe(time.perf_counter() - started)
+        if response.status_code != 200:
+            raise TTSError(f"{response.status_code} - {response.text}")
+        return response.content
+
+    def synthesize(self, text, model, voice):
+        started = time.perf_counter()
+        response = self.upstream.client.post(self.url, **self._request(text, model, voice))
+        return self._audio(response, started)
+
+    async def asynthesize(self, text, model, voice):
+        """synthesize() on the upstream's async client, for the ASGI front end"""
+        started = time.perf_counter()
+        response = await self.upstream.async_client.post(self.url, **self._request(text, model, voice))
+        return self._audio(response, started)
+
+
+class SpeechStream:
+    """One /tts response: segments synthesized in a sliding window, audio yielded in order
+
+    head() blocks for the first segment and returns the WAV header plus its
+    PCM, so upstream errors can still become a JSON error response; iterating
+    afterwards yields the remaining segments as they complete.
+    """
+
+    def __init__(self, pipeline, segments, model, voice, started_at=None):
+        self.pipeline = pipeline
+        self.segments = segments
+        self.model = model
+        self.voice = voice
+        self.started_at = started_at or time.perf_counter()
+        self.fmt = None
+        self.first_audio_s = None
+        self._next = 0
+        self._pending = deque()
+        self._fill()
+
+    def _fill(self):
+        while self._next < len(self.segments) and len(self._pending) < self.pipeline.concurrency:
+            self._pending.append(self.pipeline.submit(self.segments[self._next], self.model, self.voice))
+            self._next += 1
+
+    def _accept(self, data):
+        fmt, pcm = parse_wav(data)
+        if self.fmt is None:
+            self.fmt = fmt
+        elif fmt != self.fmt:
+            raise TTSError("speech API returned segments in different audio formats")
+        return pcm
+
+    def _head(self, pcm):
+        self.first_audio_s = time.perf_counter() - self.started_at
+        tts_first_audio.observe(self.first_audio_s)
+        return wav_stream_header(self.fmt) + pcm
+
+    def _pcm(self):
+        future = self._pending.popleft()
+        self._fill()
+        return self._accept(future.result())
+
+    def head(self):
+        return self._head(self._pcm())
+
+    def __iter__(self):
+        try:
+            while self._pending:
+                yield self._pcm()
+        except Exception as e:
+            # Headers are already sent; end the audio early rather than corrupt it
+            logger.error(f"TTS segment failed mid-stream, truncating audio: {str(e)}")
+        finally:
+            self.close()
+
+    def close(self):
+        while self._pending:
+            self._pending.popleft().cancel()
+
+
+class AsyncSpeechStream(SpeechStream):
+    """SpeechStream for the event loop: segments are asyncio tasks on the async HTTP client
+
+    Must be created inside the running loop; await head(), then async-iterate.
+    """
+
+    def _fill(self):
+        while self._next < len(self.segments) and len(self._pending) < self.pipeline.concurrency:
+            segment = self.pipeline.asegment(self.segments[self._next], self.model, self.voice)
+            self._pending.append(asyncio.ensure_future(segment))
+            self._next += 1
+
+    async def _apcm(self):
+        task = self._pending.popleft()
+        self._fill()
+        return self._accept(await task)
+
+    async def head(self):
+        return self._head(await self._apcm())
+
+    async def __aiter__(self):
+        try:
+            while self._pending:
+                yield await self._apcm()
+        except Exception as e:
+            logger.error(f"TTS segment failed mid-stream, truncating audio: {str(e)}")
+        finally:
+            self.close()
+
+
+class TTSPipeline:
+    """Sentence-pipelined, cached text-to-speech
+
+    open() runs segments on a thread pool; aopen() runs them as asyncio tasks
+    with asynthesize, so ASGI requests hold no thread while waiting on the API.
+    """
+
+    def __init__(self, synthesize, cache=None, concurrency=TTS_CONCURRENCY, workers=TTS_WORKERS, asynthesize=None):
+        self.synthesize = synthesize
+        self.asynthesize = asynthesize
+        self.cache = cache if cache is not None else TTSCache(directory="")
+        self.concurrency = max(1, concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tts")
+
+    def _segment(self, text, model, voice):
+        key = TTSCache.key(text, model, voice)
+        data = self.cache.get(key)
+        if data is not None:
+            tts_segments.inc(result="hit")
+            return data
+        tts_segments.inc(result="miss")
+        data = self.synthesize(text, model, voice)
+        self.cache.put(key, data)
+        return data
+
+    def submit(self, text, model, voice):
+        return self._executor.submit(self._segment, text, model, voice)
+
+    async def asegment(self, text, model, voice):
+        key = TTSCache.key(text, model, voice)
+        loop = asyncio.get_running_loop()
+        # Cache files are small; their reads and writes use the pipeline's threads
+        data = await loop.run_in_executor(self._executor, self.cache.get, key)
+        if data is not None:
+            tts_segments.inc(result="hit")
+            return data
+        tts_segments.inc(result="miss")
+        data = await self.asynthesize(text, model, voice)
+        self._executor.submit(self.cache.put, key, data)
+        return data
+
+    @staticmethod
+    def _segments(text):
+        segments = split_segments(text)
+        if not segments:
+            raise TTSError("no speakable text")
+        return segments
+
+    def open(self, text, model, voice, started_at=None):
+        return SpeechStream(self, self._segments(text), model, voice, started_at)
+
+    def aopen(self, text, model, voice, started_at=None):
+        """Async form of open(); call from the event loop"""
+        if self.asynthesize is None:
+            raise TTSError("pipeline has no async synthesizer")
+        return AsyncSpeechStream(self, self._segments(text), model, voice, started_at)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _silent_wav(seconds, rate=24000):
+    pcm = b"\x00\x00" * int(seconds * rate)
+    fmt = struct.pack("<HHIIHH", 1, 1, rate, rate * 2, 2, 16)
+    return (b"RIFF" + struct.pack("<I", 36 + len(pcm)) + b"WAVE" + b"fmt " + struct.pack("<I", 16) + fmt
+            + b"data" + struct.pack("<I", len(pcm)) + pcm)
+
+
+def start_stub_server(port=0, seconds_per_char=0.004, base_latency=0.15):
+    """Local stand-in for the speech API: latency grows with input length, returns silent WAV"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            text = body["input"]
+            time.sleep(base_latency + seconds_per_char * len(text))
+            audio = _silent_wav(len(text) * 0.06)
+            self.send_response(200)
+            self.send_header("Content-Type", "audio/wav")
+            self.send_header("Content-Length", str(len(audio)))
+            self.end_headers()
+            self.wfile.write(audio)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, name="tts-stub", daemon=True).start()
+    return server
+
+
+def benchmark(texts, rounds=3, cache_dir=None):
+    """Time-to-first-audio of one-shot vs. pipelined synthesis, and the segment cache hit rate
+
+    Runs against start_stub_server(). Each round replays every text, so later
+    rounds measure the cache.
+    """
+    server = start_stub_server()
+    client = SpeechClient("stub", url=f"http://127.0.0.1:{server.server_port}/audio/speech",
+                          upstream=get_upstream("tts-stub"))
+
+    def percentile(values, p):
+        values = sorted(values)
+        return round(values[min(len(values) - 1, int(len(values) * p))] * 1000, 1)
+
+    one_shot = []
+    for text in texts:
+        started = time.perf_counter()
+        client.synthesize(" ".join(text.split()), "stub", "stub")
+        one_shot.append(time.perf_counter() - started)
+
+    results = {"one_shot": {"p50_ms": percentile(one_shot, 0.5), "p95_ms": percentile(one_shot, 0.95)}}
+    cache = TTSCache(directory=cache_dir or "", max_bytes=TTS_CACHE_MAX_BYTES)
+    pipeline = TTSPipeline(client.synthesize, cache=cache)
+    for round_number in range(1, rounds + 1):
+        first_audio, total = [], []
+        for text in texts:
+            started = time.perf_counter()
+            stream = pipeline.open(text, "stub", "stub", started_at=started)
+            stream.head()
+            for _ in stream:
+                pass
+            first_audio.append(stream.first_audio_s)
+            total.append(time.perf_counter() - started)
+        results[f"pipelined_round_{round_number}"] = {
+            "first_audio_p50_ms": percentile(first_audio, 0.5),
+            "first_audio_p95_ms": percentile(first_audio, 0.95),
+            "total_p50_ms": percentile(total, 0.5),
+        }
+
+    async def run_async():
+        first_audio = []
+        for text in texts:
+            started = time.perf_counter()
+            stream = async_pipeline.aopen(text, "stub", "stub", started_at=started)
+            await stream.head()
+            async for _ in stream:
+                pass
+            first_audio.append(stream.first_audio_s)
+        return first_audio
+
+    async_pipeline = TTSPipeline(client.synthesize, asynthesize=client.asynthesize)
+    first_audio = asyncio.run(run_async())
+    results["pipelined_async"] = {
+        "first_audio_p50_ms": percentile(first_audio, 0.5),
+        "first_audio_p95_ms": percentile(first_audio, 0.95),
+    }
+    async_pipeline.shutdown()
+    results["cache"] = cache.stats()
+    pipeline.shutdown()
+    server.shutdown()
+    return results
+
+
+if __name__ == "__main__":
+    import tempfile
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Benchmark pipelined, cached TTS against a local stub speech API")
+    parser.add_argument("--texts", default=None, help="file with one text per line (default: built-in PCOS answers)")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.texts:
+        with open(args.texts, encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+    else:
+        texts = [
+            "PCOS is a common hormonal condition. It can cause irregular periods, excess hair growth and acne. "
+            "Many people also have small cysts on their ovaries. A healthcare provider can confirm the diagnosis.",
+            "Regular exercise and a balanced diet can help manage PCOS symptoms. Even a modest weight loss may "
+            "improve insulin sensitivity and make periods more regular. Please consult a healthcare provider "
+            "before starting any new treatment.",
+            "I recommend discussing this with a healthcare provider.",
+        ]
+    with tempfile.TemporaryDirectory() as cache_dir:
+        print(json.dumps(benchmark(texts, args.rounds, cache_dir), indent=2))
@@ -0,0 +1,721 @@
+"""Outbound HTTP layer shared by every external API call
+
+Each upstream (the LLM gateway, Groq, Google embeddings) gets one keep-alive
+connection pool, a concurrency limit, connect/read timeouts, retries with
+jittered exponential backoff bounded by an overall deadline, and a circuit
+breaker. SDKs built on httpx
+(Groq, OpenAI/ChatOpenAI) take upstream.client / upstream.async_client;
+other clients wrap their calls in upstream.call().
+"""
+import os
+import time
+import json
+import random
+import asyncio
+import logging
+import argparse
+import threading
+from collections import deque
+import httpx
+from metrics import counter, gauge, histogram
+
+logger = logging.getLogger(__name__)
+
+UPSTREAM_DEFAULTS = {
+    "max_concurrency": 32,
+    "max_keepalive": 16,
+    "connect_timeout": 5.0,
+    "read_timeout": 60.0,
+    "pool_timeout": 10.0,        # waiting for a concurrency slot
+    "retries": 2,
+    "deadline": 120.0,           # total budget across attempts and backoff, until response headers
+    "backoff_base": 0.25,
+    "backoff_max": 8.0,
+    "failure_threshold": 5,      # consecutive failures that open the circuit
+    "reset_seconds": 30.0,       # open -> half-open after this long
+}
+UPSTREAM_OVERRIDES = {
+    # A chat answer holds its slot (and connection) until the stream is read,
+    # so the LLM limit is the number of concurrent chat streams
+    "llm": {"max_concurrency": 2048, "max_keepalive": 256, "read_timeout": 90.0, "deadline": 150.0},
+    "groq": {"max_concurrency": 16, "read_timeout": 60.0, "deadline": 90.0},
+    "google": {"max_concurrency": 16, "read_timeout": 20.0, "retries": 3, "deadline": 45.0},
+}
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+upstream_requests = counter(
+    "upstream_requests_total", "Outbound requests by upstream and outcome", ["upstream", "outcome"]
+)
+upstream_retries = counter("upstream_retries_total", "Outbound request retries", ["upstream"])
+upstream_seconds = histogram(
+    "upstream_request_seconds", "Outbound request latency until response headers (or the call returns)",
+    ["upstream"], buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64),
+)
+upstream_in_flight = gauge("upstream_in_flight", "Outbound requests holding a concurrency slot", ["upstream"])
+upstream_circuit = gauge("upstream_circuit_state", "Circuit breaker state: 0 closed, 1 half-open, 2 open", ["upstream"])
+
+
+class CircuitOpenError(httpx.TransportError):
+    """Raised without contacting the upstream while its circuit is open"""
+
+
+def upstream_settings(name):
+    """Defaults, per-upstream overrides, then UPSTREAM_<NAME>_<SETTING> environment variables"""
+    settings = {**UPSTREAM_DEFAULTS, **UPSTREAM_OVERRIDES.get(name, {})}
+    for key, default in settings.items():
+        value = os.getenv(f"UPSTREAM_{name.upper()}_{key.upper()}")
+        if value is not None:
+            settings[key] = type(default)(value)
+    return settings
+
+
+def is_transient(error):
+    """Connection problems, timeouts, throttling and 5xx responses are worth retrying"""
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, (httpx.TransportError, TimeoutError, ConnectionError)):
+        return True
+    # google.api_core and SDK status errors carry the HTTP status as .code or .status_code
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    return isinstance(status, int) and status in RETRY_STATUSES
+
+
+class CircuitBreaker:
+    """Opens after failure_threshold consecutive failures; lets one probe through after reset_seconds"""
+
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(self, name, failure_threshold, reset_seconds):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+        upstream_circuit.set(self.CLOSED, upstream=name)
+
+    def _set_state(self, state):
+        if state != self.state:
+            logger.warning(f"Upstream '{self.name}' circuit {('closed', 'half-open', 'open')[state]}")
+        self.state = state
+        upstream_circuit.set(state, upstream=self.name)
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+    def record_throttled(self):
+        """A 429 is no verdict on health while closed, but a throttled probe reopens the circuit"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probing = False
+                self.opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+    def release_probe(self):
+        """The probe ended without reaching the upstream (no slot, cancelled); let the next call probe"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probing = False
+
+
+class _Waiter:
+    """One blocked acquire; granted is only changed under the _Slots lock"""
+
+    def __init__(self, loop=None):
+        self.granted = False
+        self.loop = loop
+        if loop is None:
+            self.event = threading.Event()
+        else:
+            self.future = loop.create_future()
+
+    def wake(self):
+        """Hand the slot over; False if the waiter's event loop is gone"""
+        if self.loop is None:
+            self.event.set()
+            return True
+        try:
+            self.loop.call_soon_threadsafe(self._resolve)
+        except RuntimeError:
+            return False
+        return True
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(True)
+
+
+class _Slots:
+    """Counting semaphore shared by threads and event loops, served first come, first served
+
+    Async callers wait on a future of their own loop, so a queued stream
+    costs no thread.
+    """
+
+    def __init__(self, size):
+        self._free = size
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    def _take(self, waiter):
+        # Called with the lock held: a free slot, or join the queue
+        if self._free and not self._waiters:
+            self._free -= 1
+            return True
+        self._waiters.append(waiter)
+        return False
+
+    def _give_up(self, waiter):
+        """After a timeout or cancellation: True if the slot was granted meanwhile"""
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._waiters.remove(waiter)
+            return False
+
+    def acquire(self, timeout):
+        waiter = _Waiter()
+        with self._lock:
+            if self._take(waiter):
+                return True
+        return waiter.event.wait(timeout) or self._give_up(waiter)
+
+    async def aacquire(self, timeout):
+        waiter = _Waiter(asyncio.get_running_loop())
+        with self._lock:
+            if self._take(waiter):
+                return True
+        try:
+            await asyncio.wait_for(waiter.future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return self._give_up(waiter)
+        except asyncio.CancelledError:
+            if self._give_up(waiter):
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+                if waiter.wake():
+                    return
+                waiter.granted = False
+            self._free += 1
+
+
+class Upstream:
+    def __init__(self, name, max_concurrency, max_keepalive, connect_timeout, read_timeout, pool_timeout,
+                 retries, deadline, backoff_base, backoff_max, failure_threshold, reset_seconds):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_keepalive = max_keepalive
+        self.retries = retries
+        self.deadline = deadline
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = httpx.Timeout(connect=connect_timeout, read=read_timeout, write=read_timeout, pool=pool_timeout)
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_seconds)
+        self._slots = _Slots(max_concurrency)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._client = None
+        self._async_client = None
+
+    @property
+    def limits(self):
+        return httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_keepalive)
+
+    @property
+    def client(self):
+        """Shared httpx.Client; pass as http_client= to httpx-based SDKs"""
+        with self._lock:
+            if self._client is None:
+                transport = _GuardedTransport(self, httpx.HTTPTransport(limits=self.limits))
+                self._client = httpx.Client(transport=transport, timeout=self.timeout)
+            return self._client
+
+    @property
+    def async_client(self):
+        with self._lock:
+            if self._async_client is None:
+                transport = _AsyncGuardedTransport(self, httpx.AsyncHTTPTransport(limits=self.limits))
+                self._async_client = httpx.AsyncClient(transport=transport, timeout=self.timeout)
+            return self._async_client
+
+    # Concurrency slots
+
+    def _track(self, delta):
+        with self._lock:
+            self._in_flight += delta
+            upstream_in_flight.set(self._in_flight, upstream=self.name)
+
+    def _pool_timeout(self, timeout):
+        upstream_requests.inc(upstream=self.name, outcome="pool_timeout")
+        return httpx.PoolTimeout(f"No free slot for upstream '{self.name}' within {timeout:.2f}s")
+
+    def acquire(self, timeout=None):
+        timeout = self.timeout.pool if timeout is None else timeout
+        if not self._slots.acquire(timeout):
+            raise self._pool_timeout(timeout)
+        self._track(1)
+
+    async def aacquire(self, timeout=None):
+        timeout = self.timeout.pool if timeout is None else timeout
+        if not await self._slots.aacquire(timeout):
+            raise self._pool_timeout(timeout)
+        self._track(1)
+
+    def release(self):
+        self._track(-1)
+        self._slots.release()
+
+    # Retry policy
+
+    def check_circuit(self):
+        if not self.breaker.allow():
+            upstream_requests.inc(upstream=self.name, outcome="circuit_open")
+            raise CircuitOpenError(f"Upstream '{self.name}' circuit is open")
+
+    def deadline_at(self):
+        return time.monotonic() + self.deadline
+
+    def _slot_timeout(self, deadline):
+        return max(0.0, min(self.timeout.pool, deadline - time.monotonic()))
+
+    def admit(self, deadline):
+        """Pass the circuit breaker and take a slot, waiting no longer than the deadline allows"""
+        self.check_circuit()
+        try:
+            self.acquire(self._slot_timeout(deadline))
+        except BaseException:
+            self.breaker.release_probe()
+            raise
+
+    async def aadmit(self, deadline):
+        self.check_circuit()
+        try:
+            await self.aacquire(self._slot_timeout(deadline))
+        except BaseException:
+            self.breaker.release_probe()
+            raise
+
+    def may_retry(self, attempt, delay, deadline):
+        """Another attempt is allowed and its backoff ends before the deadline"""
+        return attempt < self.retries and time.monotonic() + delay < deadline
+
+    @staticmethod
+    def bound_timeouts(request, deadline):
+        """Cap the request's httpx timeouts at the time left before the deadline"""
+        remaining = max(deadline - time.monotonic(), 0.001)
+        timeouts = request.extensions.get("timeout", {})
+        request.extensions["timeout"] = {
+            key: remaining if timeouts.get(key) is None else min(timeouts[key], remaining)
+            for key in ("connect", "read", "write", "pool")
+        }
+
+    def backoff(self, attempt, retry_after=None):
+        """Full-jitter exponential backoff, or the server's Retry-After when it is shorter than backoff_max"""
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def record(self, started, outcome, failure):
+        upstream_seconds.observe(time.perf_counter() - started, upstream=self.name)
+        upstream_requests.inc(upstream=self.name, outcome=outcome)
+        if failure:
+            self.breaker.record_failure()
+        elif outcome == "http_429":
+            self.breaker.record_throttled()
+        else:
+            self.breaker.record_success()
+
+    @staticmethod
+    def outcome(status_code):
+        if status_code == 429:
+            return "http_429"
+        return f"http_{status_code // 100}xx"
+
+    def call(self, fn, *args, **kwargs):
+        """Run a non-httpx client call under this upstream's limit, retries and circuit breaker
+
+        The deadline stops further retries; the call's own timeout bounds each attempt.
+        """
+        deadline = self.deadline_at()
+        for attempt in range(self.retries + 1):
+            self.admit(deadline)
+            started = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                transient = is_transient(e)
+                self.record(started, "error" if transient else "client_error", failure=transient)
+                delay = self.backoff(attempt)
+                if not transient or not self.may_retry(attempt, delay, deadline):
+                    raise
+                logger.warning(f"Upstream '{self.name}' call failed ({str(e)}), retry {attempt + 1} in {delay:.2f}s")
+                upstream_retries.inc(upstream=self.name)
+            except BaseException:
+                self.breaker.release_probe()
+                raise
+            else:
+                self.record(started, "ok", failure=False)
+                return result
+            finally:
+                self.release()
+            time.sleep(delay)
+
+    def status(self):
+        return {
+            "circuit": ("closed", "half-open", "open")[self.breaker.state],
+            "consecutive_failures": self.breaker.failures,
+            "in_flight": self._in_flight,
+            "max_concurrency": self.max_concurrency,
+        }
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+
+
+def _transport_outcome(error):
+    return "timeout" if isinstance(error, httpx.TimeoutException) else "connect_error"
+
+
+class _ReleasingStream(httpx.SyncByteStream):
+    """Response body that frees the concurrency slot once it is read or closed"""
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+        self._released = False
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            if not self._released:
+                self._released = True
+                self._release()
+
+
+class _AsyncReleasingStream(httpx.AsyncByteStream):
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+        self._released = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._released:
+                self._released = True
+                self._release()
+
+
+class _GuardedTransport(httpx.BaseTransport):
+    def __init__(self, upstream, transport):
+        self.upstream = upstream
+        self.transport = transport
+
+    def handle_request(self, request):
+        upstream = self.upstream
+        deadline = upstream.deadline_at()
+        for attempt in range(upstream.retries + 1):
+            upstream.admit(deadline)
+            upstream.bound_timeouts(request, deadline)
+            started = time.perf_counter()
+            try:
+                response = self.transport.handle_request(request)
+            except httpx.TransportError as e:
+                upstream.release()
+                upstream.record(started, _transport_outcome(e), failure=True)
+                delay = upstream.backoff(attempt)
+                if not upstream.may_retry(attempt, delay, deadline):
+                    raise
+                logger.warning(f"Upstream '{upstream.name}' {type(e).__name__}, retry {attempt + 1} in {delay:.2f}s")
+            except BaseException:
+                upstream.release()
+                upstream.breaker.release_probe()
+                raise
+            else:
+                status = response.status_code
+                upstream.record(started, upstream.outcome(status), failure=status >= 500)
+                delay = upstream.backoff(attempt, response.headers.get("retry-after"))
+                if status not in RETRY_STATUSES or not upstream.may_retry(attempt, delay, deadline):
+                    return httpx.Response(status, headers=response.headers, extensions=response.extensions,
+                                          stream=_ReleasingStream(response.stream, upstream.release))
+                response.close()
+                upstream.release()
+                logger.warning(f"Upstream '{upstream.name}' returned {status}, retry {attempt + 1} in {delay:.2f}s")
+            upstream_retries.inc(upstream=upstream.name)
+            time.sleep(delay)
+
+    def close(self):
+        self.transport.close()
+
+
+class _AsyncGuardedTransport(httpx.AsyncBaseTransport):
+    def __init__(self, upstream, transport):
+        self.upstream = upstream
+        self.transport = transport
+
+    async def handle_async_request(self, request):
+        upstream = self.upstream
+        deadline = upstream.deadline_at()
+        for attempt in range(upstream.retries + 1):
+            await upstream.aadmit(deadline)
+            upstream.bound_timeouts(request, deadline)
+            started = time.perf_counter()
+            try:
+                response = await self.transport.handle_async_request(request)
+            except httpx.TransportError as e:
+                upstream.release()
+                upstream.record(started, _transport_outcome(e), failure=True)
+                delay = upstream.backoff(attempt)
+                if not upstream.may_retry(attempt, delay, deadline):
+                    raise
+                logger.warning(f"Upstream '{upstream.name}' {type(e).__name__}, retry {attempt + 1} in {delay:.2f}s")
+            except BaseException:
+                upstream.release()
+                upstream.breaker.release_probe()
+                raise
+            else:
+                status = response.status_code
+                upstream.record(started, upstream.outcome(status), failure=status >= 500)
+                delay = upstream.backoff(attempt, response.headers.get("retry-after"))
+                if status not in RETRY_STATUSES or not upstream.may_retry(attempt, delay, deadline):
+                    return httpx.Response(status, headers=response.headers, extensions=response.extensions,
+                                          stream=_AsyncReleasingStream(response.stream, upstream.release))
+                await response.aclose()
+                upstream.release()
+                logger.warning(f"Upstream '{upstream.name}' returned {status}, retry {attempt + 1} in {delay:.2f}s")
+            upstream_retries.inc(upstream=upstream.name)
+            await asyncio.sleep(delay)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+_upstreams = {}
+_upstreams_lock = threading.Lock()
+
+
+def get_upstream(name):
+    with _upstreams_lock:
+        upstream = _upstreams.get(name)
+        if upstream is None:
+            upstream = _upstreams[name] = Upstream(name, **upstream_settings(name))
+        return upstream
+
+
+def upstreams_status():
+    with _upstreams_lock:
+        return {name: upstream.status() for name, upstream in _upstreams.items()}
+
+
+def start_mock_server(port=0):
+    """Local upstream for exercising the layer: /ok, /slow?seconds=, /stream?seconds= (headers first, body after the
+    delay), /flaky (every other request 503), /error, /throttle (429)"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import urlparse, parse_qs
+
+    state = {"flaky": 0, "active": 0, "peak": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _reply(self, status, body):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            try:
+                self.wfile.write(payload)
+            except (BrokenPipeError, ConnectionResetError):
+                pass    # the client gave up (deadline tests)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            with lock:
+                state["active"] += 1
+                state["peak"] = max(state["peak"], state["active"])
+            try:
+                if url.path == "/slow":
+                    time.sleep(float(parse_qs(url.query).get("seconds", ["1"])[0]))
+                    self._reply(200, {"ok": True})
+                elif url.path == "/stream":
+                    payload = json.dumps({"ok": True}).encode()
+                    self.send_response(200)
+                    self.send_header("Content-Length", str(len(payload)))
+                    self.end_headers()
+                    self.wfile.flush()
+                    time.sleep(float(parse_qs(url.query).get("seconds", ["1"])[0]))
+                    self.wfile.write(payload)
+                elif url.path == "/flaky":
+                    with lock:
+                        state["flaky"] += 1
+                        fail = state["flaky"] % 2 == 1
+                    self._reply(503 if fail else 200, {"ok": not fail})
+                elif url.path == "/error":
+                    self._reply(500, {"ok": False})
+                elif url.path == "/throttle":
+                    self._reply(429, {"ok": False})
+                else:
+                    self._reply(200, {"ok": True})
+            finally:
+                with lock:
+                    state["active"] -= 1
+
+        def log_message(self, *args):
+            pass
+
+    ThreadingHTTPServer.request_queue_size = 1024
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.state = state
+    threading.Thread(target=server.serve_forever, name="upstream-mock", daemon=True).start()
+    return server
+
+
+def self_check():
+    """Exercise retries, deadlines, the concurrency limit and the circuit breaker against start_mock_server()"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    server = start_mock_server()
+    base = f"http://127.0.0.1:{server.server_port}"
+    results = {}
+
+    def attempt(upstream, path):
+        started = time.perf_counter()
+        try:
+            status = upstream.client.get(base + path).status_code
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        return status, round(time.perf_counter() - started, 3)
+
+    flaky = Upstream("mock-flaky", **{**UPSTREAM_DEFAULTS, "backoff_base": 0.01})
+    results["flaky_retried"] = [attempt(flaky, "/flaky") for _ in range(3)]
+
+    slow = Upstream("mock-slow", **{**UPSTREAM_DEFAULTS, "read_timeout": 0.2, "retries": 0})
+    results["read_deadline"] = attempt(slow, "/slow?seconds=1")
+
+    limited = Upstream("mock-limited", **{**UPSTREAM_DEFAULTS, "max_concurrency": 4})
+    while server.state["active"]:
+        time.sleep(0.05)
+    server.state["peak"] = 0
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        list(pool.map(lambda _: attempt(limited, "/slow?seconds=0.1"), range(16)))
+    results["peak_concurrency_at_server"] = server.state["peak"]
+
+    broken = Upstream("mock-broken", **{**UPSTREAM_DEFAULTS, "retries": 0, "failure_threshold": 3, "reset_seconds": 0.5})
+    results["breaker"] = [attempt(broken, "/error") for _ in range(5)]
+    time.sleep(0.6)
+    results["breaker_half_open_probe"] = attempt(broken, "/ok")
+    results["breaker_state"] = broken.status()["circuit"]
+
+    # A half-open probe that is throttled reopens the circuit rather than leaving it stuck half-open
+    throttled = Upstream("mock-throttled", **{**UPSTREAM_DEFAULTS, "retries": 0, "failure_threshold": 1, "reset_seconds": 0.3})
+    attempt(throttled, "/error")
+    time.sleep(0.4)
+    results["breaker_throttled_probe"] = [attempt(throttled, "/throttle"), throttled.status()["circuit"]]
+    time.sleep(0.4)
+    results["breaker_after_throttled_probe"] = [attempt(throttled, "/ok"), throttled.status()["circuit"]]
+
+    # A probe that never gets a slot gives the probe back
+    starved = Upstream("mock-starved", **{**UPSTREAM_DEFAULTS, "retries": 0, "failure_threshold": 1,
+                                          "reset_seconds": 0.3, "max_concurrency": 1, "pool_timeout": 0.1})
+    attempt(starved, "/error")
+    time.sleep(0.4)
+    starved.acquire()
+    results["breaker_starved_probe"] = attempt(starved, "/ok")
+    starved.release()
+    results["breaker_after_starved_probe"] = [attempt(starved, "/ok"), starved.status()["circuit"]]
+
+    # The deadline bounds all attempts together, not each one
+    bounded = Upstream("mock-bounded", **{**UPSTREAM_DEFAULTS, "read_timeout": 1.0, "retries": 3,
+                                          "backoff_base": 0.01, "deadline": 1.5})
+    results["overall_deadline"] = attempt(bounded, "/slow?seconds=3")
+
+    # Async streams hold their slot until the body is read; waiting for a slot costs no thread
+    async def open_streams(upstream, count, seconds):
+        async def one():
+            try:
+                async with upstream.async_client.stream("GET", f"{base}/stream?seconds={seconds}") as response:
+                    await response.aread()
+                    return response.status_code
+            except httpx.HTTPError as e:
+                return type(e).__name__
+
+        statuses = await asyncio.gather(*(one() for _ in range(count)))
+        await upstream.async_client.aclose()
+        counts = {}
+        for status in statuses:
+            counts[status] = counts.get(status, 0) + 1
+        return counts
+
+    def streams(upstream, count, seconds):
+        while server.state["active"]:
+            time.sleep(0.05)
+        server.state["peak"] = 0
+        counts = asyncio.run(open_streams(upstream, count, seconds))
+        return {"statuses": counts, "peak_at_server": server.state["peak"]}
+
+    results["async_limited_streams"] = streams(Upstream("mock-async-limited", **{**UPSTREAM_DEFAULTS, "max_concurrency": 4}), 16, 0.1)
+    results["llm_concurrent_streams"] = streams(Upstream("mock-llm", **upstream_settings("llm")), 200, 1.0)
+
+    down = Upstream("mock-down", **{**UPSTREAM_DEFAULTS, "connect_timeout": 0.5, "backoff_base": 0.01})
+    started = time.perf_counter()
+    try:
+        down.client.get("http://127.0.0.1:9/")
+        results["connection_refused"] = "unexpected response"
+    except httpx.HTTPError as e:
+        results["connection_refused"] = (type(e).__name__, round(time.perf_counter() - started, 3))
+
+    server.shutdown()
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    argparse.ArgumentParser(description="Exercise the outbound HTTP layer against local mock servers").parse_args()
+    print(json.dumps(self_check(), indent=2))
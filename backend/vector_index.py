@@ -0,0 +1,310 @@
+import os
+import json
+import math
+import time
+import logging
+import sqlite3
+import argparse
+import threading
+from collections.abc import Mapping
+import numpy as np
+import faiss
+from langchain_community.docstore.base import Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+# Serving index built from the exact vectors at publish time
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "flat")                      # flat | ivf | ivfpq | hnsw
+VECTOR_INDEX_NLIST = int(os.getenv("VECTOR_INDEX_NLIST", "0"))                  # 0 = derived from corpus size
+VECTOR_INDEX_PQ_M = int(os.getenv("VECTOR_INDEX_PQ_M", "16"))
+VECTOR_INDEX_PQ_NBITS = int(os.getenv("VECTOR_INDEX_PQ_NBITS", "8"))
+VECTOR_INDEX_HNSW_M = int(os.getenv("VECTOR_INDEX_HNSW_M", "32"))
+VECTOR_INDEX_EF_CONSTRUCTION = int(os.getenv("VECTOR_INDEX_EF_CONSTRUCTION", "200"))
+# Query-time knobs, applied on load so they can be tuned without a rebuild
+VECTOR_INDEX_NPROBE = int(os.getenv("VECTOR_INDEX_NPROBE", "8"))
+VECTOR_INDEX_EF_SEARCH = int(os.getenv("VECTOR_INDEX_EF_SEARCH", "64"))
+# FAISS only memory-maps the inverted lists of IVF indexes (ivf, ivfpq); flat and
+# hnsw indexes are always read into each worker's own memory
+VECTOR_INDEX_MMAP = os.getenv("VECTOR_INDEX_MMAP", "true").lower() in ("1", "true", "yes")
+
+INDEX_TYPES = ("flat", "ivf", "ivfpq", "hnsw")
+INDEX_FILE = "index.faiss"        # serving (possibly approximate) index
+VECTORS_FILE = "vectors.faiss"    # exact flat index, used for incremental builds
+DOCSTORE_FILE = "docstore.sqlite"
+# IVF/PQ k-means wants roughly this many training points per centroid
+MIN_POINTS_PER_CENTROID = 39
+
+
+def index_settings(index_type=VECTOR_INDEX_TYPE):
+    """Build-time parameters recorded in the manifest; a change triggers a republish"""
+    return {
+        "type": index_type,
+        "nlist": VECTOR_INDEX_NLIST,
+        "pq_m": VECTOR_INDEX_PQ_M,
+        "pq_nbits": VECTOR_INDEX_PQ_NBITS,
+        "hnsw_m": VECTOR_INDEX_HNSW_M,
+        "ef_construction": VECTOR_INDEX_EF_CONSTRUCTION,
+    }
+
+
+def _nlist_for(count, nlist):
+    if nlist <= 0:
+        nlist = int(4 * math.sqrt(count))
+    return max(1, min(nlist, count // MIN_POINTS_PER_CENTROID))
+
+
+def _pq_m_for(dimension, m):
+    # PQ sub-quantizers must divide the dimension
+    while m > 1 and dimension % m:
+        m -= 1
+    return m
+
+
+def build_ann_index(vectors, settings):
+    """Build the serving index for (n, d) float32 vectors; falls back to flat for tiny corpora"""
+    count, dimension = vectors.shape
+    index_type = settings["type"]
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}', expected one of {', '.join(INDEX_TYPES)}")
+
+    if index_type == "ivfpq" and count < 2 ** settings["pq_nbits"]:
+        logger.warning(f"Only {count} vectors, too few to train a PQ codebook; using flat")
+        index_type = "flat"
+    nlist = _nlist_for(count, settings["nlist"])
+
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(dimension)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, settings["hnsw_m"])
+        index.hnsw.efConstruction = settings["ef_construction"]
+    else:
+        quantizer = faiss.IndexFlatL2(dimension)
+        if index_type == "ivf":
+            index = faiss.IndexIVFFlat(quantizer, dimension, nlist, faiss.METRIC_L2)
+        else:
+            index = faiss.IndexIVFPQ(quantizer, dimension, nlist, _pq_m_for(dimension, settings["pq_m"]),
+                                     settings["pq_nbits"])
+        index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+def apply_search_params(index, nprobe=VECTOR_INDEX_NPROBE, ef_search=VECTOR_INDEX_EF_SEARCH):
+    try:
+        faiss.extract_index_ivf(index).nprobe = nprobe
+    except RuntimeError:
+        pass
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = ef_search
+    return index
+
+
+def read_index(path, mmap=VECTOR_INDEX_MMAP):
+    """Read a FAISS index, memory-mapped when possible so worker processes share pages
+
+    Only the inverted lists of IVF indexes are mapped; a flat or HNSW index is
+    loaded into private memory even with mmap=True, so use VECTOR_INDEX_TYPE=ivf
+    (or ivfpq) when the index should be shared across workers.
+    """
+    if mmap:
+        try:
+            index = faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError as e:
+            logger.info(f"Memory-mapped load not supported for '{path}' ({str(e)}), reading into memory")
+        else:
+            try:
+                faiss.extract_index_ivf(index)
+            except RuntimeError:
+                logger.info(f"'{path}' is not an IVF index; it is held in memory by each worker, not shared")
+            return index
+    return faiss.read_index(path)
+
+
+class SQLiteDocstore(Docstore):
+    """Read-only docstore of chunk text and JSON metadata, keyed by chunk ID
+
+    The connection is opened when the store is loaded, not on first use, so a
+    version directory pruned by a later publish stays readable by the workers
+    still serving it (an open file outlives its unlinking). Threads share the
+    connection under a lock; every query is a single indexed lookup.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+
+    def _fetch(self, sql, params=(), one=True):
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            return cursor.fetchone() if one else cursor.fetchall()
+
+    def search(self, search):
+        row = self._fetch("SELECT content, metadata FROM docs WHERE id = ?", (search,))
+        if row is None:
+            return f"ID {search} not found."
+        return Document(id=search, page_content=row[0], metadata=json.loads(row[1]))
+
+    def position_id(self, position):
+        row = self._fetch("SELECT id FROM docs WHERE position = ?", (position,))
+        return None if row is None else row[0]
+
+    def count(self):
+        return self._fetch("SELECT COUNT(*) FROM docs")[0]
+
+    def rows(self):
+        return self._fetch("SELECT position, id, content, metadata FROM docs ORDER BY position", one=False)
+
+    def close(self):
+        self._conn.close()
+
+
+class _PositionIds(Mapping):
+    """index_to_docstore_id backed by the docstore, so it is not copied into every worker"""
+
+    def __init__(self, docstore):
+        self.docstore = docstore
+
+    def __getitem__(self, position):
+        doc_id = self.docstore.position_id(int(position))
+        if doc_id is None:
+            raise KeyError(position)
+        return doc_id
+
+    def __len__(self):
+        return self.docstore.count()
+
+    def __iter__(self):
+        return (row[0] for row in self.docstore.rows())
+
+
+def save_vector_store(vectorstore, directory, settings=None):
+    """Write the exact vectors, the serving index and the SQLite docstore to directory"""
+    settings = settings or index_settings()
+    os.makedirs(directory, exist_ok=True)
+    flat = vectorstore.index
+    vectors = flat.reconstruct_n(0, flat.ntotal) if flat.ntotal else np.zeros((0, flat.d), dtype="float32")
+
+    faiss.write_index(flat, os.path.join(directory, VECTORS_FILE))
+    started = time.perf_counter()
+    faiss.write_index(build_ann_index(vectors, settings), os.path.join(directory, INDEX_FILE))
+    logger.info(f"Built '{settings['type']}' index over {flat.ntotal} vectors in {time.perf_counter() - started:.2f}s")
+
+    conn = sqlite3.connect(os.path.join(directory, DOCSTORE_FILE))
+    try:
+        conn.execute("CREATE TABLE docs (position INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, "
+                     "content TEXT NOT NULL, metadata TEXT NOT NULL)")
+        rows = []
+        for position in range(flat.ntotal):
+            doc_id = vectorstore.index_to_docstore_id[position]
+            doc = vectorstore.docstore.search(doc_id)
+            rows.append((position, doc_id, doc.page_content, json.dumps(doc.metadata, default=str)))
+        conn.executemany("INSERT INTO docs VALUES (?, ?, ?, ?)", rows)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def load_vector_store(directory, embeddings, mmap=VECTOR_INDEX_MMAP):
+    """Serving store: memory-mapped ANN index plus the read-only SQLite docstore"""
+    index = apply_search_params(read_index(os.path.join(directory, INDEX_FILE), mmap))
+    docstore = SQLiteDocstore(os.path.join(directory, DOCSTORE_FILE))
+    return FAISS(embeddings, index, docstore, _PositionIds(docstore))
+
+
+def load_editable_store(directory, embeddings):
+    """Exact, fully in-memory store for the incremental builder (supports add and delete)"""
+    index = faiss.read_index(os.path.join(directory, VECTORS_FILE))
+    documents, position_ids = {}, {}
+    docstore = SQLiteDocstore(os.path.join(directory, DOCSTORE_FILE))
+    try:
+        for position, doc_id, content, metadata in docstore.rows():
+            documents[doc_id] = Document(id=doc_id, page_content=content, metadata=json.loads(metadata))
+            position_ids[position] = doc_id
+    finally:
+        docstore.close()
+    return FAISS(embeddings, index, InMemoryDocstore(documents), position_ids)
+
+
+def load_exact_vectors(directory):
+    """(n, d) float32 vectors from a published version or the legacy flat layout"""
+    path = os.path.join(directory, VECTORS_FILE)
+    if not os.path.exists(path):
+        path = os.path.join(directory, INDEX_FILE)
+    index = faiss.read_index(path)
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def benchmark(vectors, k=5, queries=200, noise=0.05, configs=None, seed=0):
+    """recall@k against exact search, per-query latency and index size for each configuration
+
+    Queries are stored vectors plus Gaussian noise, so the benchmark runs
+    offline without calling the embedding API.
+    """
+    rng = np.random.default_rng(seed)
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    picks = rng.choice(len(vectors), size=min(queries, len(vectors)), replace=False)
+    scale = noise * float(np.linalg.norm(vectors, axis=1).mean()) / math.sqrt(vectors.shape[1])
+    query_vectors = vectors[picks] + rng.normal(0, scale, size=(len(picks), vectors.shape[1])).astype("float32")
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(query_vectors, k)
+
+    configs = configs or [
+        ("flat", {}),
+        ("ivf", {"nprobe": 1}), ("ivf", {"nprobe": 8}), ("ivf", {"nprobe": 32}),
+        ("ivfpq", {"nprobe": 8}), ("ivfpq", {"nprobe": 32}),
+        ("hnsw", {"ef_search": 16}), ("hnsw", {"ef_search": 64}), ("hnsw", {"ef_search": 256}),
+    ]
+    results = []
+    for index_type, search_params in configs:
+        started = time.perf_counter()
+        index = build_ann_index(vectors, index_settings(index_type))
+        build_s = time.perf_counter() - started
+        apply_search_params(index, search_params.get("nprobe", VECTOR_INDEX_NPROBE),
+                            search_params.get("ef_search", VECTOR_INDEX_EF_SEARCH))
+
+        latencies, hits = [], 0
+        for i, query in enumerate(query_vectors):
+            started = time.perf_counter()
+            _, found = index.search(query.reshape(1, -1), k)
+            latencies.append((time.perf_counter() - started) * 1000)
+            hits += len(set(found[0]) & set(truth[i]))
+        latencies.sort()
+        results.append({
+            "index": index_type,
+            **search_params,
+            f"recall@{k}": round(hits / (k * len(query_vectors)), 4),
+            "p50_ms": round(latencies[len(latencies) // 2], 4),
+            "p95_ms": round(latencies[int(len(latencies) * 0.95)], 4),
+            "build_s": round(build_s, 3),
+            "size_mb": round(faiss.serialize_index(index).nbytes / 1e6, 2),
+        })
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Benchmark recall@k vs. latency of FAISS index options")
+    parser.add_argument("--index-dir", default=None, help="published index version (default: faiss_index/CURRENT)")
+    parser.add_argument("--synthetic", type=int, default=0, help="use N random clustered vectors instead")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        rng = np.random.default_rng(0)
+        centers = rng.normal(size=(max(1, args.synthetic // 100), args.dim))
+        data = centers[rng.integers(0, len(centers), args.synthetic)] + 0.3 * rng.normal(size=(args.synthetic, args.dim))
+    else:
+        from embedding import resolve_index_path
+        data = load_exact_vectors(args.index_dir or resolve_index_path())
+
+    print(f"{len(data)} vectors, dim {data.shape[1]}")
+    for result in benchmark(data, k=args.k, queries=args.queries):
+        print("  ".join(f"{key}={value}" for key, value in result.items()))
@@ -0,0 +1,65 @@
+import os
+import logging
+import torch
+from imaging import render_heatmap, HEATMAP_FORMAT, HEATMAP_QUALITY
+from batching import MicroBatcher
+from gradcam import GradCAM
+from classifier_backends import load_backend
+from classifier_model import CLASSES, load_classifier, weights_fingerprint, preprocess_image
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Micro-batching of concurrent /predict requests
+CLASSIFIER_MAX_BATCH_SIZE = int(os.getenv("CLASSIFIER_MAX_BATCH_SIZE", "8"))
+CLASSIFIER_MAX_WAIT_MS = float(os.getenv("CLASSIFIER_MAX_WAIT_MS", "10"))
+
+def build_prediction(probs, pred_idx, heatmap, rgb, heatmap_format=HEATMAP_FORMAT, heatmap_quality=HEATMAP_QUALITY):
+    """Format one classifier result as the /predict JSON payload"""
+    result = {
+        "label": CLASSES[pred_idx],
+        "probability": round(probs[pred_idx].item(), 4),
+    }
+    if heatmap is not None:
+        result.update(render_heatmap(heatmap, rgb, heatmap_format, heatmap_quality))
+    return result
+
+classifier_model = load_classifier()
+
+# Grad-CAM engine is attached once at model load and shared by every request
+grad_cam_engine = GradCAM(classifier_model, classifier_model.layer4[-1])  # Target the last conv layer
+logger.info("Classifier and Grad-CAM engine loaded")
+
+# Optimized backend (TorchScript / torch.compile / ONNX Runtime) for requests without a heatmap
+classifier_backend = load_backend(classifier_model)
+
+# Changes whenever the weights or the serving backend change
+MODEL_VERSION = f"{weights_fingerprint()}-{classifier_backend.name}-{classifier_backend.quantization}"
+
+def classify_batch(explain, tensors):
+    """Run a micro-batch of (1, C, H, W) tensors through the classifier
+
+    Returns one (probs, pred_idx, heatmap) tuple per input; heatmap is None
+    when explain is False.
+    """
+    batch = torch.cat(tensors, dim=0)
+    if explain:
+        # Grad-CAM needs autograd through the eager model
+        probs, pred_idx, heatmaps = grad_cam_engine.classify(batch, explain=True)
+    else:
+        with span("vision", "forward"):
+            probs = torch.softmax(classifier_backend(batch), dim=1)
+        pred_idx, heatmaps = probs.argmax(dim=1), None
+    probs = probs.cpu()
+    pred_idx = pred_idx.cpu()
+    return [
+        (probs[i], pred_idx[i].item(), heatmaps[i] if heatmaps is not None else None)
+        for i in range(len(tensors))
+    ]
+
+classifier_batcher = MicroBatcher(
+    classify_batch,
+    max_batch_size=CLASSIFIER_MAX_BATCH_SIZE,
+    max_wait_ms=CLASSIFIER_MAX_WAIT_MS,
+    name="classifier",
+)